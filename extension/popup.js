@@ -9,50 +9,79 @@ const eventsCount = document.getElementById("events-count");
 const priorityCount = document.getElementById("priority-count");
 const feedContainer = document.getElementById("feed-container");
 
-async function updateStatus() {
-    try {
-        const response = await fetch(`${API_URL}/status`);
-        const data = await response.json();
-        statusSpan.textContent = data.running ? "ACTIVE" : "INACTIVE";
-
-        // Update Stats
-        if (data.stats) {
-            eventsCount.textContent = data.stats.created_today;
-            priorityCount.textContent = data.stats.priority_count;
-        }
-
-        if (data.running) {
-            document.body.classList.add("running");
-            document.body.classList.remove("stopped");
-            statusDot.className = "status-dot running";
-            startBtn.disabled = true;
-            stopBtn.disabled = false;
-        } else {
-            document.body.classList.add("stopped");
-            document.body.classList.remove("running");
-            statusDot.className = "status-dot stopped";
-            startBtn.disabled = false;
-            stopBtn.disabled = true;
-        }
-    } catch (error) {
-        statusSpan.textContent = "DISCONNECTED";
-        statusDot.className = "status-dot";
-        document.body.classList.remove("running", "stopped");
+// Last full status, patched with the deltas pushed by /events.
+let currentStatus = {};
+// Feed as rendered, newest first; /events pushes only emails not sent yet.
+let currentFeed = [];
+const FEED_LIMIT = 10;
+
+function renderStatus(data) {
+    statusSpan.textContent = data.running ? "ACTIVE" : "INACTIVE";
+
+    // Update Stats
+    if (data.stats) {
+        eventsCount.textContent = data.stats.created_today;
+        priorityCount.textContent = data.stats.priority_count;
+    }
+
+    if (data.running) {
+        document.body.classList.add("running");
+        document.body.classList.remove("stopped");
+        statusDot.className = "status-dot running";
         startBtn.disabled = true;
+        stopBtn.disabled = false;
+    } else {
+        document.body.classList.add("stopped");
+        document.body.classList.remove("running");
+        statusDot.className = "status-dot stopped";
+        startBtn.disabled = false;
         stopBtn.disabled = true;
     }
 }
 
-async function updateFeed() {
+function renderDisconnected() {
+    statusSpan.textContent = "DISCONNECTED";
+    statusDot.className = "status-dot";
+    document.body.classList.remove("running", "stopped");
+    startBtn.disabled = true;
+    stopBtn.disabled = true;
+}
+
+async function updateStatus() {
+    // One-off refresh; the server answers 304 while the status is unchanged.
     try {
-        const response = await fetch(`${API_URL}/recent_emails`);
-        const data = await response.json();
-        renderFeed(data.emails);
+        const response = await fetch(`${API_URL}/status`);
+        currentStatus = await response.json();
+        renderStatus(currentStatus);
     } catch (error) {
-        console.error("Failed to fetch feed:", error);
+        renderDisconnected();
     }
 }
 
+function connectEvents() {
+    const events = new EventSource(`${API_URL}/events`);
+
+    events.addEventListener("open", () => {
+        // Every (re)connection starts with a full snapshot.
+        currentStatus = {};
+        currentFeed = [];
+    });
+
+    events.addEventListener("status", (event) => {
+        currentStatus = { ...currentStatus, ...JSON.parse(event.data) };
+        renderStatus(currentStatus);
+    });
+
+    events.addEventListener("feed", (event) => {
+        const data = JSON.parse(event.data);
+        currentFeed = data.emails.concat(currentFeed).slice(0, FEED_LIMIT);
+        renderFeed(currentFeed);
+    });
+
+    // EventSource reconnects by itself.
+    events.addEventListener("error", renderDisconnected);
+}
+
 function renderFeed(emails) {
     feedContainer.innerHTML = "";
     if (!emails || emails.length === 0) {
@@ -96,7 +125,8 @@ startBtn.addEventListener("click", async () => {
         const response = await fetch(`${API_URL}/start`, { method: "POST" });
         const data = await response.json();
         messageDiv.textContent = data.message;
-        setTimeout(updateStatus, 500);
+        // The change itself arrives on /events; this restores the label if nothing changed.
+        renderStatus(currentStatus);
     } catch (error) {
         messageDiv.textContent = "Failed to start agent";
         updateStatus();
@@ -110,18 +140,13 @@ stopBtn.addEventListener("click", async () => {
         const response = await fetch(`${API_URL}/stop`, { method: "POST" });
         const data = await response.json();
         messageDiv.textContent = data.message;
-        setTimeout(updateStatus, 500);
+        // The change itself arrives on /events; this restores the label if nothing changed.
+        renderStatus(currentStatus);
     } catch (error) {
         messageDiv.textContent = "Failed to stop agent";
         updateStatus();
     }
 });
 
-// Initial check
-updateStatus();
-updateFeed();
-// Poll status every 2 seconds
-setInterval(() => {
-    updateStatus();
-    updateFeed();
-}, 2000);
+// Status and feed changes are pushed by the server instead of polled.
+connectEvents();
@@ -1,49 +1,157 @@
 import time
+import asyncio
+import functools
 import threading
 import traceback
-from typing import Optional
-from src.gmail_client import GmailClient
-from src.extraction import extract_event_data
-from src.calendar_client import CalendarClient
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+from src.gmail_client import GmailClient, BATCH_SIZE as GMAIL_BATCH_SIZE, MODIFY_BATCH_SIZE
+from src.extraction import extract_event_data_async, extract_event_data_batch, BATCH_MAX_EMAILS
+from src.extraction_cache import ExtractionCache
+from src.calendar_client import CalendarClient, event_id_for, BATCH_SIZE as CALENDAR_BATCH_SIZE
+from src.calendar_index import CalendarIndex, parse_time
+from src.ledger import ProcessedLedger
+from src.email_store import EmailStore
+from src.work_queue import WorkQueue, STAGES, FETCH, EXTRACT, INSERT, LABEL
+from src.backfill import Backfill
+from src.notify import ChangeNotifier
+from src.metrics import OPERATION_SECONDS, POLL_CYCLE_SECONDS, INTENTS, EVENTS_CREATED, count_error
+from src.prefilter import PreFilter, DEFAULT_THRESHOLD
+from src.preprocess import preprocess_email_body, DEFAULT_TOKEN_BUDGET
+from src.ics import parse_ics
+from src.scheduler import PollScheduler, DEFAULT_MIN_INTERVAL, DEFAULT_MAX_INTERVAL
+
+# Earlier messages summarized when a thread is coalesced, and snippet length.
+THREAD_SUMMARY_MESSAGES = 5
+THREAD_SNIPPET_CHARS = 200
+
+# Seconds an idle stage worker waits for upstream work before looking again.
+STAGE_IDLE_WAIT = 1.0
+# Seconds stop() waits for the cycle in progress before returning; the cycle
+# still finishes its current jobs afterwards.
+STOP_TIMEOUT = 5.0
+
+# Processed messages are marked read in bulk: once this many label jobs are
+# ready, once the oldest has waited LABEL_MAX_DELAY seconds, or when nothing
+# upstream can add to the batch (end of a cycle, or stopping).
+LABEL_FLUSH_SIZE = MODIFY_BATCH_SIZE
+LABEL_MAX_DELAY = 10.0
+
+def _dedupe_invite_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keeps one VEVENT per (uid, recurrenceId), the highest SEQUENCE, in first-seen order."""
+    kept: Dict[Any, Dict[str, Any]] = {}
+    for i, event in enumerate(events):
+        key = (event['uid'], event.get('recurrenceId')) if event.get('uid') else i
+        if key not in kept or event.get('sequence', 0) > kept[key].get('sequence', 0):
+            kept[key] = event
+    return list(kept.values())
 
 class Agent:
-    def __init__(self, poll_interval: int = 60):
+    def __init__(self, poll_interval: int = 60, prefilter_threshold: float = DEFAULT_THRESHOLD,
+                 extraction_concurrency: int = 5, io_workers: int = 4, extraction_mode: str = "single",
+                 body_token_budget: int = DEFAULT_TOKEN_BUDGET, min_poll_interval: float = DEFAULT_MIN_INTERVAL,
+                 max_poll_interval: float = DEFAULT_MAX_INTERVAL, stage_workers: Optional[Dict[str, int]] = None):
         self.poll_interval = poll_interval
+        # Polls sooner while mail is arriving, backs off when idle, and wakes
+        # at once on request_sync() or stop().
+        self.scheduler = PollScheduler(poll_interval, min_poll_interval, max_poll_interval)
+        self.body_token_budget = body_token_budget
+        # "single": one LLM request per email; "batch": several emails per request.
+        self.extraction_mode = extraction_mode
+        # Maximum OpenAI calls in flight, and threads for calendar/Gmail writes.
+        self.extraction_concurrency = extraction_concurrency
+        self.io_workers = io_workers
+        # Concurrent workers per pipeline stage (fetch, extract, insert,
+        # label); raise the count of whichever stage is the bottleneck.
+        self.stage_workers = {FETCH: 1, EXTRACT: extraction_concurrency, INSERT: io_workers, LABEL: 1,
+                              **(stage_workers or {})}
+        self.label_flush_size = LABEL_FLUSH_SIZE
+        self.label_max_delay = LABEL_MAX_DELAY
+        self.io_pool: Optional[ThreadPoolExecutor] = None
+        # Caps LLM calls in flight across agents that share a loop; see AgentManager.
+        self.extraction_slots: Optional[asyncio.Semaphore] = None
+        # Event loop that drives extraction. It outlives individual poll cycles
+        # because the async OpenAI client's connections are bound to one loop.
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.prefilter = PreFilter(prefilter_threshold)
         self.running = False
         self.thread: Optional[threading.Thread] = None
         self.gmail_client = None
         self.calendar_client = None
-        self.calendar_client = None
+        # Local view of the calendar for duplicate and conflict checks.
+        self.calendar_index: Optional[CalendarIndex] = None
+        self.ledger: Optional[ProcessedLedger] = None
+        self.extraction_cache: Optional[ExtractionCache] = None
+        # Durable queue carrying each email through the pipeline stages, so
+        # work in flight survives a crash or restart.
+        self.work_queue: Optional[WorkQueue] = None
+        # Scans past mail into the same queue, behind live mail.
+        self.backfill: Optional[Backfill] = None
+        # Pipeline workers stop taking jobs at this time (monotonic), so a
+        # long backlog does not hold up the next poll.
+        self._poll_due = 0.0
         self.status = "Stopped"
         self.stats = {"created_today": 0, "priority_count": 0}
-        self.recent_emails = [] # List of dicts: {id, subject, sender, summary, category, importance}
+        # The day created_today counts; it starts again from zero each day.
+        self._stats_date = date.today()
+        # Important emails ({id, subject, sender, summary, category,
+        # importance}): the newest in memory, the history on disk.
+        self.email_store: Optional[EmailStore] = None
+        # Published whenever status, stats or the email feed may have changed,
+        # so the server can push updates instead of being polled.
+        self.changes = ChangeNotifier()
 
     def initialize_clients(self):
         """Initializes API clients. Done lazily to allow server startup without creds."""
-        if not self.gmail_client:
+        if self.gmail_client is None:
             print("Initializing Gmail Client...")
             self.gmail_client = GmailClient()
-        if not self.calendar_client:
+        if self.calendar_client is None:
             print("Initializing Calendar Client...")
             self.calendar_client = CalendarClient()
+        if self.calendar_index is None:
+            self.calendar_index = CalendarIndex(self.calendar_client)
+        if self.ledger is None:
+            self.ledger = ProcessedLedger()
+        if self.extraction_cache is None:
+            self.extraction_cache = ExtractionCache()
+        if self.work_queue is None:
+            self.work_queue = WorkQueue()
+        if self.email_store is None:
+            self.email_store = EmailStore()
+        if self.backfill is None:
+            self.backfill = Backfill(self.gmail_client, self.work_queue, self.ledger, on_queued=self.request_sync)
 
     def start(self):
         """Starts the agent loop in a background thread."""
         if self.running:
             print("Agent is already running.")
             return
+        if self.thread is not None and self.thread.is_alive():
+            # Its cycle still uses the event loop and the I/O pool.
+            print("Agent is still stopping; start it again once it has stopped.")
+            return
 
         try:
             self.initialize_clients()
+            if self.io_pool is None:
+                self.io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="agent-io")
+            # Leases still held were taken by a run that died mid-job.
+            recovered = self.work_queue.recover()
+            if recovered:
+                print(f"Resuming {recovered} jobs left in flight by the previous run.")
             self.running = True
             self.status = "Running"
             self.thread = threading.Thread(target=self._run_loop, daemon=True)
             self.thread.start()
+            self.backfill.resume()
             print("Agent started.")
         except Exception as e:
             print(f"Failed to start agent: {e}")
             self.status = f"Error: {e}"
             self.running = False
+        self.changes.publish()
 
     def stop(self):
         """Stops the agent loop."""
@@ -52,87 +160,616 @@ class Agent:
         
         print("Stopping agent...")
         self.running = False
+        self.status = "Stopping"
+        self.scheduler.wake()
+        if self.backfill is not None:
+            self.backfill.stop()
         if self.thread:
-            self.thread.join(timeout=5)
+            self.thread.join(timeout=STOP_TIMEOUT)
+            if self.thread.is_alive():
+                # The loop thread shuts the pool down once the cycle is done.
+                print("Agent stopping; the current cycle is finishing its jobs.")
+                self.changes.publish()
+                return
+        self._release_pool()
         self.status = "Stopped"
+        self.changes.publish()
         print("Agent stopped.")
 
+    def _release_pool(self):
+        if self.io_pool:
+            self.io_pool.shutdown(wait=False)
+            self.io_pool = None
+
+    def request_sync(self):
+        """Polls now instead of at the next scheduled time, e.g. on a push notification."""
+        self.scheduler.wake()
+
     def _run_loop(self):
         """Main polling loop."""
         print("Entering main loop...")
         while self.running:
+            found = 0
             try:
-                self._process_emails()
+                found = self._process_emails()
             except Exception as e:
                 print(f"Error in main loop: {e}")
                 traceback.print_exc()
-            
-            # Sleep in small chunks to allow faster stopping
-            for _ in range(self.poll_interval):
-                if not self.running:
-                    break
-                time.sleep(1)
-
-    def _process_emails(self):
-        """Fetches and processes unread emails."""
+                count_error("poll", e)
+            if not self.running:
+                break
+
+            interval = self.next_poll_delay(found)
+            self.changes.publish()
+            print(f"Next poll in {interval:.0f}s.")
+            if self.scheduler.wait(interval):
+                print("Woken up for an immediate sync.")
+
+        # No cycle uses the pool any more. If stop() gave up waiting for
+        # this cycle, the agent only counts as stopped from here.
+        self._release_pool()
+        if self.status == "Stopping":
+            self.status = "Stopped"
+            self.changes.publish()
+            print("Agent stopped.")
+
+    def next_poll_delay(self, found: int) -> float:
+        """Seconds until the next poll, given how many new emails the last one found."""
+        interval = self.scheduler.record_poll(found)
+        # Jobs left over from a long backlog, or backing off after a
+        # failure, run when due rather than at the next idle poll.
+        due = self.work_queue.next_available_at()
+        if due is not None:
+            interval = min(interval, max(0.0, due - time.time()))
+        return interval
+
+    def _process_emails(self) -> int:
+        """Runs one poll cycle on the agent's own event loop; see run_cycle."""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(self.run_cycle())
+
+    async def run_cycle(self) -> int:
+        """
+        Queues newly arrived unread emails, then runs the pipeline until no
+        job is due. Blocking API calls run on io_pool, so several agents can
+        share one event loop.
+
+        Returns:
+            Number of newly arrived emails (retries not included), which
+            drives the poll interval.
+        """
+        self._roll_stats()
+        with POLL_CYCLE_SECONDS.time():
+            loop = asyncio.get_running_loop()
+            found = await loop.run_in_executor(self.io_pool, self._queue_new_emails)
+            if not self.work_queue.has_ready():
+                print("No new emails.")
+                return found
+
+            if self.calendar_index is not None:
+                try:
+                    await loop.run_in_executor(self.io_pool, self.calendar_index.sync)
+                except Exception as e:
+                    print(f"Calendar index sync failed, using the previous state: {e}")
+
+            await self._run_pipeline()
+            return found
+
+    def _roll_stats(self):
+        """Starts created_today again on a new day."""
+        today = date.today()
+        if today != self._stats_date:
+            self._stats_date = today
+            self.stats["created_today"] = 0
+
+    def _count_created(self):
+        self._roll_stats()
+        self.stats["created_today"] += 1
+        EVENTS_CREATED.inc()
+
+    def _queue_new_emails(self) -> int:
+        """Lists new mail and queues it for the fetch stage. Returns how many messages were listed."""
         print("Checking for new emails...")
-        emails = self.gmail_client.fetch_recent_emails(max_results=5, query='is:unread')
-        
-        if not emails:
-            print("No new emails.")
-            return
+        with OPERATION_SECONDS.time(operation="gmail_list"):
+            message_ids, checkpoint = self.gmail_client.list_new_message_ids(query='is:unread')
+        # Skip anything already handled, e.g. no-event emails left unread that
+        # come back after a full resync or a restart.
+        queued = self.work_queue.enqueue_many(FETCH, self.ledger.filter_unprocessed(message_ids))
+        # The IDs are durable now, so the checkpoint can move past them.
+        self.gmail_client.commit_checkpoint(checkpoint)
+        self.ledger.prune()
+        self.email_store.prune()
+        if queued:
+            print(f"Queued {queued} new emails.")
+        return len(message_ids)
+
+    async def _run_pipeline(self):
+        """
+        Runs stage_workers[stage] workers for every stage until no job is
+        due, or until the next poll is due (poll_interval from now).
 
+        Each worker leases a batch of its stage's jobs, handles it and goes
+        back for more, so the stages overlap: events are inserted while later
+        emails are still being extracted.
+        """
+        self._wakeup = asyncio.Event()
+        self._busy = 0
+        self._poll_due = time.monotonic() + self.poll_interval
+        await asyncio.gather(*(self._stage_worker(stage) for stage in STAGES
+                               for _ in range(self.stage_workers[stage])))
+
+    async def _stage_worker(self, stage: str):
+        handler = {FETCH: self._fetch_stage, EXTRACT: self._extract_stage,
+                   INSERT: self._insert_stage, LABEL: self._label_stage}[stage]
+        while self.running and time.monotonic() < self._poll_due:
+            if stage == LABEL and not self._label_due():
+                jobs = []
+            else:
+                jobs = self.work_queue.lease(stage, self._lease_size(stage))
+            if not jobs:
+                if self._busy == 0 and not self.work_queue.has_ready():
+                    # Nothing in flight can produce more work; let the other workers exit too.
+                    self._wakeup.set()
+                    return
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), STAGE_IDLE_WAIT)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._handle(stage, handler, jobs)
+
+        if stage == LABEL:
+            # Stopping, or the next poll is due: write what is ready now
+            # rather than leave it for the next cycle.
+            jobs = self.work_queue.lease(stage, self._lease_size(stage))
+            if jobs:
+                await self._handle(stage, handler, jobs)
+
+    async def _handle(self, stage: str, handler, jobs: List[Dict[str, Any]]):
+        self._busy += 1
+        try:
+            await handler(jobs)
+        except Exception as e:
+            print(f"Error in {stage} stage: {e}")
+            count_error(stage, e)
+            # Jobs the handler already settled are not affected.
+            for job in jobs:
+                if self.running:
+                    self.work_queue.fail(job['id'], str(e))
+                else:
+                    self.work_queue.release(job['id'])
+        finally:
+            self._busy -= 1
+            # Jobs may have moved on to other stages, and stats or the
+            # feed may have changed.
+            self._wakeup.set()
+            self.changes.publish()
+
+    def _label_due(self) -> bool:
+        """
+        True when the ready label jobs should be written now rather than
+        wait for more: see LABEL_FLUSH_SIZE. A burst of mail thus costs one
+        batchModify call instead of one per email that reaches the stage.
+        """
+        count, oldest = self.work_queue.backlog(LABEL)
+        if not count:
+            return False
+        if count >= self.label_flush_size or time.time() - oldest >= self.label_max_delay:
+            return True
+        # Nothing in flight or waiting upstream can add to the batch.
+        return self._busy == 0 and not any(self.work_queue.backlog(stage)[0] for stage in STAGES if stage != LABEL)
+
+    def _lease_size(self, stage: str) -> int:
+        """Jobs a worker takes at once: one batched API call's worth, or a single email."""
+        if stage == FETCH:
+            return GMAIL_BATCH_SIZE
+        if stage == LABEL:
+            return MODIFY_BATCH_SIZE
+        if self.extraction_mode == "batch":
+            return BATCH_MAX_EMAILS if stage == EXTRACT else CALENDAR_BATCH_SIZE
+        return 1
+
+    async def _fetch_stage(self, jobs: List[Dict[str, Any]]):
+        """
+        Downloads the messages and sorts them: bulk mail is dropped on its
+        headers, invites go straight to the insert stage, and the rest is
+        cleaned, coalesced by thread and pre-filtered before extraction.
+        """
+        message_ids = [job['id'] for job in jobs]
+        backfilled = {job['id'] for job in jobs if job['payload'].get('backfill')}
+        with OPERATION_SECONDS.time(operation="gmail_get"):
+            emails = await asyncio.get_running_loop().run_in_executor(self.io_pool, functools.partial(
+                self.gmail_client.fetch_emails, message_ids, triage=self.prefilter.triage
+            ))
+        fetched = {email['id'] for email in emails}
+        for message_id in message_ids:
+            if message_id not in fetched:
+                count_error("gmail_get", "download failed")
+                self.work_queue.fail(message_id, "download failed")
+
+        candidates = []
+        for email in emails:
+            if email['id'] in backfilled:
+                email['backfill'] = True
+            if email.get('triaged_out'):
+                # Bulk mail rejected from its headers alone; no body was downloaded.
+                print(f"Skipping email '{email['subject']}' (metadata triage).")
+                self._finish(email, "triaged_out", f"sender: {email['sender']}")
+                continue
+            # Invites carrying an iCalendar part are applied directly, without the LLM.
+            if email.get('calendar') or email.get('calendar_attachments'):
+                if await self._queue_invite(email):
+                    continue
+            self._preprocess(email)
+            candidates.append(email)
+
+        for email in await self._coalesce_threads(candidates):
+            # The other messages of the thread ride along with it; their jobs
+            # stay leased here and are settled with its outcome, so a crash
+            # or a dead letter leaves them to be processed on their own.
+            if self._passes_prefilter(email):
+                self.work_queue.advance(email['id'], EXTRACT, {'email': email})
+
+    async def _queue_invite(self, email: Dict[str, Any]) -> bool:
+        """
+        Reads an email's iCalendar invite and queues its events for the
+        insert stage.
+
+        Returns:
+            False if the invite has no usable VEVENT, so the email falls back
+            to LLM extraction; True once it has been handled or queued.
+        """
+        loop = asyncio.get_running_loop()
+        print(f"Processing invite: {email['subject']}")
+        try:
+            calendar_text = email.get('calendar', '')
+            if not calendar_text:
+                # Invites usually carry the same VEVENTs inline and as
+                # invite.ics; attachments are only downloaded without an inline part.
+                for attachment in email.get('calendar_attachments', []):
+                    calendar_text += '\n' + await loop.run_in_executor(
+                        self.io_pool, self.gmail_client.get_attachment, email['id'], attachment['attachment_id']
+                    )
+            invite = parse_ics(calendar_text)
+        except Exception as e:
+            print(f"Could not read invite, falling back to extraction: {e}")
+            return False
+        invite['events'] = _dedupe_invite_events(invite['events'])
+
+        if invite['method'] == 'REPLY':
+            # An attendee's response to one of our invites; nothing to schedule.
+            self._finish(email, "invite_reply")
+            return True
+        if not invite['events']:
+            return False
+        self.work_queue.advance(email['id'], INSERT, {'email': email, 'invite': invite})
+        return True
+
+    async def _extract_stage(self, jobs: List[Dict[str, Any]]):
+        """Extracts each email's event: one LLM request per email, or in "batch" mode one per leased batch."""
+        emails = [job['payload']['email'] for job in jobs]
+        if self.extraction_slots is None:
+            results = await self._extract(emails)
+        else:
+            async with self.extraction_slots:
+                results = await self._extract(emails)
+
+        for email in emails:
+            event_data = self._triage_extraction(email, results[email['id']])
+            if event_data and email.get('backfill') and self._is_past(event_data):
+                # Old mail is scanned for upcoming events only.
+                self._finish(email, "past_event")
+            elif event_data:
+                self.work_queue.advance(email['id'], INSERT, {'email': email, 'event_data': event_data})
+
+    async def _extract(self, emails: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        if self.extraction_mode == "batch":
+            texts = {email['id']: self._email_text(email) for email in emails}
+            with OPERATION_SECONDS.time(operation="extraction"):
+                return await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+                    extract_event_data_batch, texts, cache=self.extraction_cache
+                ))
+        results = {}
         for email in emails:
-            if not self.running:
-                break
-                
             print(f"Processing email: {email['subject']}")
-            
-            # 1. Extract Data
-            # Combine subject and body for better context
-            full_text = f"Subject: {email['subject']}\n\n{email['body']}"
-            extraction_result = extract_event_data(full_text)
-            
-            intent = extraction_result.get("Intent")
-            print(f"Identified Intent: {intent}")
-            
-            # Store in Recent Emails if Important
-            category = extraction_result.get("Category", "Unknown")
-            importance = extraction_result.get("Importance", "Low")
-            
-            if importance in ["High", "Medium"]:
-                self.recent_emails.insert(0, {
-                    "id": email['id'],
-                    "subject": email['subject'],
-                    "sender": email.get('sender', 'Unknown'),
-                    "summary": event_data.get("description") if event_data else "No summary available",
-                    "category": category,
-                    "importance": importance
-                })
-                # Keep only last 10
-                self.recent_emails = self.recent_emails[:10]
-                self.stats["priority_count"] = len(self.recent_emails)
-
-            if intent in ["Meeting", "Registration", "Event"]:
-                event_data = extraction_result.get("EventData")
-                if event_data:
-                    # 2. Create Calendar Event
-                    print(f"Creating event: {event_data.get('title')}")
-                    try:
-                        self.calendar_client.create_event(event_data)
-                        print("Event created successfully.")
-                        self.stats["created_today"] += 1
-                        
-                        # 3. Mark as Read (Only if successfully processed)
-                        self.gmail_client.mark_as_read(email['id'])
-                        
-                    except Exception as e:
-                        print(f"Failed to create event: {e}")
+            with OPERATION_SECONDS.time(operation="extraction"):
+                results[email['id']] = await extract_event_data_async(self._email_text(email),
+                                                                      cache=self.extraction_cache)
+        return results
+
+    async def _insert_stage(self, jobs: List[Dict[str, Any]]):
+        """Writes invites and extracted events to the calendar; batched in "batch" mode."""
+        pending = []
+        for job in jobs:
+            payload = job['payload']
+            if 'invite' in payload:
+                await self._apply_invite(payload['email'], payload['invite'])
             else:
-                print("Skipping email (No event detected).")
-                # Optional: Mark as read anyway so we don't process it forever?
-                # For now, let's leave it unread or maybe mark it read to avoid loops.
-                # self.gmail_client.mark_as_read(email['id']) 
+                pending.append((payload['email'], payload['event_data']))
+
+        if self.extraction_mode == "batch":
+            await self._write_events(pending)
+        else:
+            for email, event_data in pending:
+                await self._create_event(email, event_data)
+
+    async def _label_stage(self, jobs: List[Dict[str, Any]]):
+        """Marks processed messages read, in bulk (MODIFY_BATCH_SIZE per batchModify call)."""
+        message_ids = [message_id for job in jobs for message_id in job['payload']['message_ids']]
+        with OPERATION_SECONDS.time(operation="label_modify"):
+            await asyncio.get_running_loop().run_in_executor(
+                self.io_pool, self.gmail_client.batch_mark_as_read, message_ids
+            )
+        # Each job's message IDs include the thread messages coalesced into it.
+        for message_id in message_ids:
+            self.work_queue.complete(message_id)
+
+    async def _apply_invite(self, email: Dict[str, Any], invite: Dict[str, Any]):
+        """Creates or updates an invite's events, or deletes them for METHOD:CANCEL."""
+        loop = asyncio.get_running_loop()
+        try:
+            for event_data in invite['events']:
+                if event_data['cancelled']:
+                    if event_data['uid']:
+                        await loop.run_in_executor(self.io_pool, self.calendar_client.cancel_invite, event_data)
+                else:
+                    print(f"Saving invite event: {event_data['title']}")
+                    with OPERATION_SECONDS.time(operation="calendar_insert"):
+                        saved = await loop.run_in_executor(self.io_pool, self.calendar_client.save_invite, event_data)
+                    if saved is None:
+                        # An outdated revision of the invite.
+                        continue
+                    if self.calendar_index is not None:
+                        self.calendar_index.add(saved)
+                    self._count_created()
+        except Exception as e:
+            print(f"Failed to apply invite: {e}")
+            count_error("calendar_insert", e)
+            self._retry(email, e)
+            return
+        cancelled = all(event_data['cancelled'] for event_data in invite['events'])
+        self._record(email, "invite_cancelled" if cancelled else "invite_saved")
+        self._mark_read(email)
+
+    def _preprocess(self, email: Dict[str, Any]):
+        """Replaces the body with its cleaned, budgeted text and logs the savings."""
+        prepared = preprocess_email_body(email['body'], email.get('html'), self.body_token_budget)
+        email['body'] = prepared.pop("text")
+        email['preprocess'] = prepared
+        print(f"Preprocessed '{email['subject']}': saved {prepared['bytes_saved']} bytes, "
+              f"~{prepared['tokens_saved']} tokens.")
+
+    async def _coalesce_threads(self, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Reduces each Gmail thread to one email, so a reply chain is extracted
+        once and maps to one calendar event.
+
+        The latest message of each thread is kept, with a compact summary of
+        the earlier messages (sender and snippet) appended to its body. The
+        other messages of the thread fetched this cycle ride along as
+        'coalesced_ids' and share its outcome. Earlier messages from previous
+        cycles are summarized from one batched threads.get call.
+        """
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for email in emails:
+            groups.setdefault(email.get('thread_id', email['id']), []).append(email)
+
+        # Threads that have messages other than the ones fetched this cycle.
+        lookups = [thread_id for thread_id, group in groups.items()
+                   if len(group) > 1 or thread_id != group[0]['id']]
+        summaries: Dict[str, List[Dict[str, Any]]] = {}
+        if lookups:
+            try:
+                summaries = await asyncio.get_running_loop().run_in_executor(
+                    self.io_pool, self.gmail_client.get_thread_summaries, lookups
+                )
+            except Exception as e:
+                print(f"Could not fetch thread summaries: {e}")
+
+        coalesced = []
+        for thread_id, group in groups.items():
+            latest = max(group, key=lambda email: email.get('received_at', 0))
+            earlier = summaries.get(thread_id) or sorted(
+                ({'sender': e.get('sender', 'Unknown'), 'snippet': e.get('snippet') or e['body'][:THREAD_SNIPPET_CHARS],
+                  'id': e['id'], 'received_at': e.get('received_at', 0)} for e in group),
+                key=lambda m: m['received_at']
+            )
+            earlier = [m for m in earlier if m['id'] != latest['id']][-THREAD_SUMMARY_MESSAGES:]
+            if earlier:
+                summary = "\n".join(f"- {m['sender']}: {m['snippet'][:THREAD_SNIPPET_CHARS]}" for m in earlier)
+                latest['body'] += f"\n\nEarlier in this thread (oldest first; the message above is the latest):\n{summary}"
+                print(f"Coalesced thread '{latest['subject']}': {len(group)} new, {len(earlier)} earlier messages.")
+            latest['coalesced_ids'] = [email['id'] for email in group if email is not latest]
+            coalesced.append(latest)
+        return coalesced
+
+    def _event_id(self, email: Dict[str, Any]) -> str:
+        """One event per thread: a later reply updates the event the thread already created."""
+        return event_id_for(email.get('thread_id', email['id']))
+
+    def _record(self, email: Dict[str, Any], outcome: str, detail: Optional[str] = None):
+        """Records an outcome in the ledger for the email and the thread messages coalesced into it."""
+        for message_id in [email['id'], *email.get('coalesced_ids', [])]:
+            self.ledger.record(message_id, outcome, detail)
+
+    def _finish(self, email: Dict[str, Any], outcome: str, detail: Optional[str] = None):
+        """Records the outcome of an email that stays unread, and drops its job and those coalesced into it."""
+        self._record(email, outcome, detail)
+        for message_id in [email['id'], *email.get('coalesced_ids', [])]:
+            self.work_queue.complete(message_id)
+
+    def _mark_read(self, email: Dict[str, Any]):
+        """
+        Hands the email, with the thread messages coalesced into it, to the
+        label stage, which drops their jobs once they are marked read.
+        """
+        self.work_queue.advance(email['id'], LABEL, {'message_ids': [email['id'], *email.get('coalesced_ids', [])]})
+
+    def _retry(self, email: Dict[str, Any], error: Any):
+        """Counts a failed attempt; the job is retried after a backoff, or dead-lettered."""
+        if self.work_queue.fail(email['id'], str(error)):
+            print(f"Giving up on '{email['subject']}' after repeated failures: {error}")
+            # The coalesced messages go back to the fetch stage to be tried on their own.
+            for message_id in email.get('coalesced_ids', []):
+                self.work_queue.fail(message_id, str(error))
+
+    def _passes_prefilter(self, email: Dict[str, Any]) -> bool:
+        """Skips the LLM for emails with no scheduling signal at all."""
+        verdict = self.prefilter.check(email)
+        if verdict["skip"]:
+            detail = f"score {verdict['score']:.1f}: " + "; ".join(verdict["reasons"])
+            print(f"Skipping email '{email['subject']}' (pre-filter, {detail}).")
+            self._finish(email, "prefiltered", detail)
+            return False
+        return True
+
+    def _is_past(self, event_data: Dict[str, Any]) -> bool:
+        end = event_data.get('endDateTime') or event_data.get('endDate')
+        try:
+            return bool(end) and parse_time(end) < time.time()
+        except ValueError:
+            return False
+
+    def _email_text(self, email: Dict[str, Any]) -> str:
+        # Combine subject and body for better context
+        return f"Subject: {email['subject']}\n\n{email['body']}"
+
+    async def _create_event(self, email: Dict[str, Any], event_data: Dict[str, Any]):
+        """Creates one email's event unless the calendar already has it, then marks the email read."""
+        write, detail = self._check_calendar(email, event_data)
+        if not write:
+            return
+
+        print(f"Creating event: {event_data.get('title')}")
+        loop = asyncio.get_running_loop()
+        try:
+            # The ID is derived from the message, so a retry after a crash
+            # updates the event instead of duplicating it.
+            with OPERATION_SECONDS.time(operation="calendar_insert"):
+                created = await loop.run_in_executor(self.io_pool, functools.partial(
+                    self.calendar_client.create_event, event_data, event_id=self._event_id(email)
+                ))
+        except Exception as e:
+            print(f"Failed to create event: {e}")
+            count_error("calendar_insert", e)
+            self._retry(email, e)
+            return
+
+        print("Event created successfully.")
+        self._count_created()
+        if self.calendar_index is not None:
+            self.calendar_index.add(created)
+        # Mark as read only once the event exists.
+        self._record(email, "event_created", detail)
+        self._mark_read(email)
+
+    async def _write_events(self, pending: List[Tuple[Dict[str, Any], Dict[str, Any]]]):
+        """Creates the events for several emails with batched calendar writes, skipping duplicates."""
+        if not pending:
+            return
+        checked = [(email, event_data, self._check_calendar(email, event_data)) for email, event_data in pending]
+        pending = [(email, event_data, detail) for email, event_data, (write, detail) in checked if write]
+        if not pending:
+            return
+        loop = asyncio.get_running_loop()
+        writes = [{'event_id': self._event_id(email), 'event_data': event_data} for email, event_data, _ in pending]
+        try:
+            with OPERATION_SECONDS.time(operation="calendar_insert"):
+                results = await loop.run_in_executor(self.io_pool, self.calendar_client.write_events, writes)
+        except Exception as e:
+            print(f"Failed to write events: {e}")
+            count_error("calendar_insert", e)
+            for email, _, _ in pending:
+                self._retry(email, e)
+            return
+
+        for (email, _, detail), result in zip(pending, results):
+            if not result['ok']:
+                print(f"Failed to create event for '{email['subject']}': {result['error']}")
+                count_error("calendar_insert", result['error'])
+                self._retry(email, result['error'])
+                continue
+            self._count_created()
+            if self.calendar_index is not None:
+                self.calendar_index.add(result['event'])
+            self._record(email, "event_created", detail)
+            self._mark_read(email)
+
+    def _check_calendar(self, email: Dict[str, Any], event_data: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
+        """
+        Looks the event up in the calendar index before it is written.
+
+        Returns:
+            Tuple of (whether to write the event, ledger detail). An event
+            already on the calendar is not written again; the email is marked
+            read and recorded as a duplicate. Conflicts are only reported.
+        """
+        if self.calendar_index is None:
+            return True, None
+        try:
+            found = self.calendar_index.check(event_data)
+        except (KeyError, ValueError) as e:
+            print(f"Could not check event against the calendar: {e}")
+            return True, None
+
+        if found['duplicate']:
+            print(f"Skipping '{event_data.get('title')}': already on the calendar.")
+            self._mark_read(email)
+            self._record(email, "duplicate_event", f"matches event {found['duplicate']['id']}")
+            return False, None
+        # The thread's own event, about to be moved, is not a conflict.
+        conflicts = [e for e in found['conflicts'] if e['id'] != self._event_id(email)]
+        if conflicts:
+            titles = ", ".join(f"'{e['title']}'" for e in conflicts[:3])
+            print(f"Warning: '{event_data.get('title')}' conflicts with {titles}.")
+            return True, f"conflicts with {titles}"
+        return True, None
+
+    def _triage_extraction(self, email: Dict[str, Any], extraction_result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Records everything about an extraction result except event creation.
+
+        Returns:
+            The EventData to create, or None if the email needs no event (its
+            outcome is recorded) or must be retried.
+        """
+        if "Error" in extraction_result:
+            # Not recorded in the ledger; the job is retried after a backoff.
+            self._retry(email, extraction_result["Error"])
+            return None
+        
+        intent = extraction_result.get("Intent")
+        event_data = extraction_result.get("EventData")
+        print(f"Identified Intent: {intent}")
+        INTENTS.inc(intent=str(intent))
+        
+        # Store in Recent Emails if Important
+        category = extraction_result.get("Category", "Unknown")
+        importance = extraction_result.get("Importance", "Low")
+        
+        if importance in ["High", "Medium"]:
+            self.email_store.add({
+                "id": email['id'],
+                "subject": email['subject'],
+                "sender": email.get('sender', 'Unknown'),
+                "summary": event_data.get("description") if event_data else "No summary available",
+                "category": category,
+                "importance": importance
+            })
+            self.stats["priority_count"] = len(self.email_store.recent())
+
+        if intent in ["Meeting", "Registration", "Event"]:
+            if event_data:
+                return event_data
+            self._finish(email, "no_event_data")
+        else:
+            print("Skipping email (No event detected).")
+            # The email stays unread; the ledger keeps it from being sent
+            # to the LLM again.
+            self._finish(email, "no_event")
+        return None
 
 if __name__ == "__main__":
     # Manual Test
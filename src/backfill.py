@@ -0,0 +1,233 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from src.work_queue import FETCH
+
+BACKFILL_STATE_FILE = 'gmail_backfill.json'
+
+# Backfilled messages yield to live mail in every pipeline stage.
+BACKFILL_PRIORITY = -1
+
+# Messages listed per messages.list call.
+DEFAULT_PAGE_SIZE = 100
+# Backfill jobs allowed in the work queue at once. Listing pauses above this,
+# so a large mailbox is fed to the pipeline as fast as it drains rather than
+# all at once.
+DEFAULT_MAX_BACKLOG = 200
+# Seconds between backlog checks while listing is paused.
+BACKLOG_WAIT = 2.0
+
+def _gmail_date(value: str) -> str:
+    """Converts YYYY-MM-DD to the YYYY/MM/DD form of Gmail's after:/before: operators."""
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%Y/%m/%d')
+
+def build_query(after: str, before: Optional[str] = None) -> str:
+    """Gmail query for received mail from `after` up to (not including) `before`, both YYYY-MM-DD."""
+    parts = [f"after:{_gmail_date(after)}"]
+    if before:
+        parts.append(f"before:{_gmail_date(before)}")
+    parts.append("-in:sent -in:drafts")
+    return " ".join(parts)
+
+class Backfill:
+    """
+    Scans a date range of the mailbox and feeds its messages to the agent's
+    work queue, alongside live polling.
+
+    Pages of messages.list are queued at BACKFILL_PRIORITY, below live mail,
+    and the processing itself runs on the pipeline's stage workers, so its
+    concurrency is bounded by theirs. The page token and counters are
+    checkpointed after every page: start() with the same range after an
+    interruption, or resume() when the agent restarts, continues where the
+    scan left off.
+    """
+
+    def __init__(self, gmail_client, work_queue, ledger, on_queued: Optional[Callable[[], None]] = None,
+                 state_file: str = BACKFILL_STATE_FILE, page_size: int = DEFAULT_PAGE_SIZE,
+                 max_backlog: int = DEFAULT_MAX_BACKLOG):
+        """
+        Args:
+            gmail_client: GmailClient used to list pages.
+            work_queue: WorkQueue the messages are queued on.
+            ledger: ProcessedLedger; messages already in it are not queued.
+            on_queued: Called after a page added jobs, e.g. to wake the agent.
+            state_file: Where the checkpoint is kept.
+            page_size: Messages per listed page.
+            max_backlog: Backfill jobs in the queue above which listing pauses.
+        """
+        self.gmail_client = gmail_client
+        self.work_queue = work_queue
+        self.ledger = ledger
+        self.on_queued = on_queued
+        self.state_file = state_file
+        self.page_size = page_size
+        self.max_backlog = max_backlog
+        self.state: Optional[Dict[str, Any]] = self._load()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # (monotonic start, messages processed at start) of the current run, for throughput.
+        self._session = (time.monotonic(), 0)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, after: str, before: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Starts scanning mail received from `after` up to `before` (YYYY-MM-DD).
+
+        An unfinished scan of the same range is resumed from its checkpoint;
+        any other range starts over.
+
+        Raises:
+            ValueError: If a date is malformed.
+            RuntimeError: If a scan is already running.
+        """
+        query = build_query(after, before)
+        if self.running:
+            raise RuntimeError("A backfill is already running.")
+        if not self.state or self.state['query'] != query or self.state['listed_all']:
+            self.state = {
+                'query': query, 'after': after, 'before': before, 'page_token': None, 'pages': 0,
+                'listed': 0, 'queued': 0, 'listed_all': False, 'error': None, 'started_at': time.time(),
+            }
+            self._save()
+        self._launch()
+        return self.status()
+
+    def resume(self) -> bool:
+        """Continues an interrupted scan, if there is one. Returns True if it was resumed."""
+        if self.running or not self.state or self.state['listed_all']:
+            return False
+        print(f"Resuming backfill '{self.state['query']}' at page {self.state['pages'] + 1}.")
+        self._launch()
+        return True
+
+    def stop(self):
+        """Pauses the scan after the current page; resume() or start() picks it up again."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _launch(self):
+        self._stop.clear()
+        self.state['error'] = None
+        self._session = (time.monotonic(), self._processed())
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _processed(self) -> int:
+        if not self.state:
+            return 0
+        return self.state['queued'] - self.work_queue.pending(BACKFILL_PRIORITY)
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                # Let the pipeline catch up before listing more.
+                if self.work_queue.pending(BACKFILL_PRIORITY) >= self.max_backlog:
+                    self._stop.wait(BACKLOG_WAIT)
+                    continue
+
+                message_ids, next_token = self.gmail_client.list_message_page(
+                    self.state['query'], self.state['page_token'], self.page_size
+                )
+                queued = self.work_queue.enqueue_many(
+                    FETCH, self.ledger.filter_unprocessed(message_ids), {'backfill': True}, priority=BACKFILL_PRIORITY
+                )
+                with self._lock:
+                    self.state['pages'] += 1
+                    self.state['listed'] += len(message_ids)
+                    self.state['queued'] += queued
+                    self.state['page_token'] = next_token
+                    self.state['listed_all'] = next_token is None
+                # Checkpointed only once the page's IDs are queued, so an
+                # interruption lists at most this page again.
+                self._save()
+                print(f"Backfill page {self.state['pages']}: queued {queued} of {len(message_ids)} messages.")
+                if queued and self.on_queued:
+                    self.on_queued()
+                if next_token is None:
+                    print(f"Backfill listed all {self.state['listed']} messages.")
+                    return
+        except Exception as e:
+            print(f"Backfill interrupted: {e}")
+            with self._lock:
+                self.state['error'] = str(e)
+            self._save()
+
+    def status(self) -> Dict[str, Any]:
+        """Progress and throughput (messages processed per second in the current run)."""
+        with self._lock:
+            state = dict(self.state) if self.state else None
+        if state is None:
+            return {'state': 'idle'}
+        remaining = self.work_queue.pending(BACKFILL_PRIORITY)
+        processed = state['queued'] - remaining
+        started, processed_before = self._session
+        elapsed = time.monotonic() - started
+        if self.running:
+            phase = 'listing'
+        elif state['listed_all']:
+            phase = 'processing' if remaining else 'done'
+        else:
+            phase = 'paused'
+        return {
+            'state': phase,
+            'query': state['query'],
+            'pages': state['pages'],
+            'listed': state['listed'],
+            'queued': state['queued'],
+            'processed': processed,
+            'remaining': remaining,
+            'messages_per_second': round((processed - processed_before) / elapsed, 2) if elapsed > 0 else 0.0,
+            'error': state['error'],
+        }
+
+    def _load(self) -> Optional[Dict[str, Any]]:
+        if not self.state_file or not os.path.exists(self.state_file):
+            return None
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def _save(self):
+        if not self.state_file:
+            return
+        with self._lock:
+            state = dict(self.state)
+        # Written aside and renamed, so a crash never leaves a torn checkpoint.
+        temp_file = self.state_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_file, self.state_file)
+
+if __name__ == "__main__":
+    # Backfill from the command line: python -m src.backfill --after 2024-01-01
+    import argparse
+    from src.agent import Agent
+
+    parser = argparse.ArgumentParser(description="Scan past mail for events.")
+    parser.add_argument("--after", required=True, help="First day to scan (YYYY-MM-DD).")
+    parser.add_argument("--before", help="Day to stop before (YYYY-MM-DD); default: today.")
+    args = parser.parse_args()
+
+    agent = Agent()
+    agent.start()
+    try:
+        agent.backfill.start(args.after, args.before)
+        while True:
+            status = agent.backfill.status()
+            print(f"Backfill {status['state']}: {status['processed']}/{status['queued']} processed, "
+                  f"{status['messages_per_second']} msg/s.")
+            if status['state'] in ('done', 'paused'):
+                break
+            time.sleep(10)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent.stop()
@@ -1,73 +1,346 @@
+import base64
+import hashlib
 import os
-from typing import Dict, Any
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import threading
+from typing import Dict, Any, List, Optional
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.errors import HttpError
 from dotenv import load_dotenv
+from src.discovery import build_service
+from src.ratelimit import RateLimiter, CALENDAR_LIMITER
+from src.transport import TOKEN_REFRESHER, shared_http
 
 load_dotenv()
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 SERVICE_ACCOUNT_FILE = 'service_account.json'
 
+# Private extended property that tags events created from an iCalendar invite
+# with the invite's UID, so later updates and cancellations can find them.
+ICAL_UID_PROPERTY = 'icalUid'
+# The invite's SEQUENCE, so an outdated invite arriving late is not applied.
+ICAL_SEQUENCE_PROPERTY = 'icalSequence'
+
+# The Calendar API accepts at most 50 calls per batch request.
+BATCH_SIZE = 50
+
+def event_id_for(source_id: str) -> str:
+    """
+    Derives a stable Calendar event ID from a Gmail message ID or invite UID.
+
+    Event IDs must be 5-1024 characters of base32hex (a-v, 0-9), so the
+    source ID is hashed rather than used directly. Inserting twice with the
+    same ID fails with 409 instead of creating a duplicate event.
+    """
+    digest = hashlib.sha1(source_id.encode()).digest()
+    return base64.b32hexencode(digest).decode().lower().rstrip('=')
+
+def instance_id_for(event_id: str, recurrence_id: str) -> str:
+    """
+    ID of one occurrence of a recurring event: the series ID and the
+    occurrence's original start in UTC, e.g. "<id>_20300106T170000Z", or
+    "<id>_20300106" for an all-day series.
+    """
+    return f"{event_id}_{recurrence_id.replace('-', '').replace(':', '')}"
+
+def _is_conflict(error: Exception) -> bool:
+    return isinstance(error, HttpError) and error.resp.status == 409
+
+def _is_missing(error: Exception) -> bool:
+    return isinstance(error, HttpError) and error.resp.status in (404, 410)
+
+def _is_outdated(event: Dict[str, Any], event_data: Dict[str, Any]) -> bool:
+    """True if the saved event came from a later revision (higher SEQUENCE) of the invite."""
+    private = event.get('extendedProperties', {}).get('private', {})
+    return int(private.get(ICAL_SEQUENCE_PROPERTY) or 0) > (event_data.get('sequence') or 0)
+
 class CalendarClient:
-    def __init__(self):
-        self.creds = None
-        self.service = None
-        self.calendar_id = os.getenv("CALENDAR_ID")
+    def __init__(self, service=None, calendar_id: Optional[str] = None, limiter: RateLimiter = CALENDAR_LIMITER,
+                 credentials=None):
+        # With a service shared by several calendars, requests are sent with
+        # these credentials rather than the service's own transport.
+        self.creds = credentials
+        # Shared per-user query quota with retry on 429/5xx.
+        self.limiter = limiter
+        self.service = service
+        self._local = threading.local()
+        self.calendar_id = calendar_id or os.getenv("CALENDAR_ID")
         if not self.calendar_id:
             raise ValueError("CALENDAR_ID not found in environment variables.")
         
-        self.authenticate()
+        if self.service is None:
+            self.authenticate()
+        if self.creds is not None:
+            # Renewed in the background before it expires.
+            TOKEN_REFRESHER.register(self.creds)
 
     def authenticate(self):
         """Authenticates using the service account file."""
         if os.path.exists(SERVICE_ACCOUNT_FILE):
+            from google.oauth2 import service_account
+
             self.creds = service_account.Credentials.from_service_account_file(
                 SERVICE_ACCOUNT_FILE, scopes=SCOPES
             )
-            self.service = build('calendar', 'v3', credentials=self.creds)
+            self.service = build_service('calendar', 'v3', credentials=self.creds)
         else:
             raise FileNotFoundError(f"Service account file '{SERVICE_ACCOUNT_FILE}' not found.")
 
-    def create_event(self, event_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _http(self):
+        """Returns this thread's authorized transport over the thread's shared connections."""
+        if self.creds is None:
+            return None
+        if getattr(self._local, 'http', None) is None:
+            self._local.http = AuthorizedHttp(self.creds, http=shared_http())
+        return self._local.http
+
+    def _execute(self, request):
+        """Executes one API request within the Calendar quota, retrying throttled and transient failures."""
+        return self.limiter.call(request.execute, http=self._http())
+
+    def _event_body(self, event_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Builds a Calendar API event resource from extracted or ICS event data."""
+        if event_data.get('allDay'):
+            start = {'date': event_data['startDate']}
+            end = {'date': event_data['endDate']}
+        else:
+            # Extraction yields UTC timestamps; ICS invites may carry their zone,
+            # which Google needs to expand recurrences across DST changes.
+            time_zone = event_data.get('timeZone') or 'UTC'
+            start = {'dateTime': event_data['startDateTime'], 'timeZone': time_zone}
+            end = {'dateTime': event_data['endDateTime'], 'timeZone': time_zone}
+
+        event = {
+            'summary': event_data.get('title', 'New Event'),
+            'location': event_data.get('location', ''),
+            'description': event_data.get('description', ''),
+            'start': start,
+            'end': end,
+            'attendees': [{'email': email} for email in (event_data.get('attendees') or [])],
+        }
+        if event_data.get('recurrence'):
+            event['recurrence'] = event_data['recurrence']
+        if event_data.get('uid'):
+            event['extendedProperties'] = {'private': {ICAL_UID_PROPERTY: event_data['uid'],
+                                                       ICAL_SEQUENCE_PROPERTY: str(event_data.get('sequence') or 0)}}
+        return event
+
+    def create_event(self, event_data: Dict[str, Any], event_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Inserts an event into the Google Calendar.
         
         Args:
             event_data: Dictionary containing event details (title, startDateTime, endDateTime, etc.)
+            event_id: Deterministic event ID (see event_id_for). If an event with
+                this ID already exists it is updated instead, so retries never
+                create duplicates.
             
         Returns:
-            The created event object from the API.
+            The created (or updated) event object from the API.
         """
         if not self.service:
             raise RuntimeError("Calendar service not initialized. Call authenticate() first.")
 
-        event = {
-            'summary': event_data.get('title', 'New Event'),
-            'location': event_data.get('location', ''),
-            'description': event_data.get('description', ''),
-            'start': {
-                'dateTime': event_data['startDateTime'],
-                'timeZone': 'UTC', # Assuming UTC from extraction, or infer from string
-            },
-            'end': {
-                'dateTime': event_data['endDateTime'],
-                'timeZone': 'UTC',
-            },
-            'attendees': [{'email': email} for email in (event_data.get('attendees') or [])],
-        }
-
+        body = self._event_body(event_data)
+        if event_id:
+            body['id'] = event_id
         try:
-            event_result = self.service.events().insert(
+            event_result = self._execute(self.service.events().insert(
                 calendarId=self.calendar_id,
-                body=event
-            ).execute()
+                body=body
+            ))
             print(f"Event created: {event_result.get('htmlLink')}")
             return event_result
+        except HttpError as e:
+            if event_id and _is_conflict(e):
+                return self.update_event(event_id, event_data)
+            print(f"An error occurred: {e}")
+            raise
         except Exception as e:
             print(f"An error occurred: {e}")
             raise
 
+    def write_events(self, writes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Creates many events with batched HTTP requests.
+
+        Each write is inserted with its deterministic ID; writes whose ID
+        already exists are sent again as updates in a second round of batches.
+
+        Args:
+            writes: List of {'event_id': ..., 'event_data': ...} dicts.
+
+        Returns:
+            One result per write, in the same order: {'event_id', 'ok',
+            'action' ("created" or "updated"), 'event'} on success or
+            {'event_id', 'ok': False, 'error'} on failure.
+        """
+        if not self.service:
+            raise RuntimeError("Calendar service not initialized. Call authenticate() first.")
+
+        results: List[Dict[str, Any]] = [None] * len(writes)
+        conflicts = self._run_batches(writes, range(len(writes)), results, update=False)
+        if conflicts:
+            self._run_batches(writes, conflicts, results, update=True)
+
+        created = sum(1 for r in results if r['ok'] and r['action'] == 'created')
+        updated = sum(1 for r in results if r['ok'] and r['action'] == 'updated')
+        print(f"Batched calendar writes: {created} created, {updated} updated, "
+              f"{len(writes) - created - updated} failed.")
+        return results
+
+    def _run_batches(self, writes, indexes, results, update: bool) -> List[int]:
+        """Sends the given writes in batches, filling results; returns the indexes that hit a 409 on insert."""
+        action = 'updated' if update else 'created'
+        requests = {}
+        for index in indexes:
+            write = writes[index]
+            body = self._event_body(write['event_data'])
+            if update:
+                body['status'] = 'confirmed'
+                requests[str(index)] = self.service.events().update(
+                    calendarId=self.calendar_id, eventId=write['event_id'], body=body
+                )
+            else:
+                body['id'] = write['event_id']
+                requests[str(index)] = self.service.events().insert(calendarId=self.calendar_id, body=body)
+
+        # Throttled calls within a batch are retried in a later batch.
+        responses, failed = self.limiter.execute_batch(
+            self.service.new_batch_http_request, requests, http=self._http(), batch_size=BATCH_SIZE
+        )
+
+        conflicts: List[int] = []
+        for request_id, response in responses.items():
+            index = int(request_id)
+            results[index] = {'event_id': writes[index]['event_id'], 'ok': True, 'action': action, 'event': response}
+        for request_id, error in failed.items():
+            index = int(request_id)
+            if not update and _is_conflict(error):
+                conflicts.append(index)
+            else:
+                results[index] = {'event_id': writes[index]['event_id'], 'ok': False, 'error': str(error)}
+        return sorted(conflicts)
+
+    def update_event(self, event_id: str, event_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Replaces an existing event's details."""
+        if not self.service:
+            raise RuntimeError("Calendar service not initialized. Call authenticate() first.")
+
+        body = self._event_body(event_data)
+        # A deleted event keeps its ID; updating it with this status restores it.
+        body['status'] = 'confirmed'
+        event_result = self._execute(self.service.events().update(
+            calendarId=self.calendar_id,
+            eventId=event_id,
+            body=body
+        ))
+        print(f"Event updated: {event_result.get('htmlLink')}")
+        return event_result
+
+    def list_events(self, sync_token: Optional[str] = None, page_token: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Lists one page of events for incremental sync.
+
+        Without a sync token this is a full listing whose last page carries a
+        nextSyncToken; with one, only events changed since (including deleted
+        ones, with status "cancelled") are returned. An expired token fails
+        with HTTP 410.
+        """
+        if not self.service:
+            raise RuntimeError("Calendar service not initialized. Call authenticate() first.")
+
+        return self._execute(self.service.events().list(
+            calendarId=self.calendar_id,
+            singleEvents=True,
+            maxResults=2500,
+            syncToken=sync_token,
+            pageToken=page_token
+        ))
+
+    def get_event(self, event_id: str) -> Optional[Dict[str, Any]]:
+        """Returns an event (including a deleted one, with status "cancelled"), or None if it does not exist."""
+        if not self.service:
+            raise RuntimeError("Calendar service not initialized. Call authenticate() first.")
+
+        try:
+            return self._execute(self.service.events().get(calendarId=self.calendar_id, eventId=event_id))
+        except HttpError as e:
+            if _is_missing(e):
+                return None
+            raise
+
+    def find_events_by_ical_uid(self, uid: str) -> List[Dict[str, Any]]:
+        """Returns the events created from the invite with this iCalendar UID."""
+        if not self.service:
+            raise RuntimeError("Calendar service not initialized. Call authenticate() first.")
+
+        response = self._execute(self.service.events().list(
+            calendarId=self.calendar_id,
+            privateExtendedProperty=f"{ICAL_UID_PROPERTY}={uid}"
+        ))
+        return response.get('items', [])
+
+    def save_invite(self, event_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Creates the event for an iCalendar invite, or updates the existing one
+        when an invite with the same UID was already saved (a rescheduled
+        meeting arrives as a new REQUEST with the same UID).
+
+        An invite with a RECURRENCE-ID changes one occurrence of the series
+        only; if the series is not in the calendar, the occurrence is saved
+        as an event of its own. An invite older (lower SEQUENCE) than the
+        saved event is ignored.
+
+        Returns:
+            The saved event, or None if the invite was outdated.
+        """
+        uid = event_data.get('uid')
+        if not uid:
+            return self.create_event(event_data)
+        event_id = event_id_for(uid)
+        recurrence_id = event_data.get('recurrenceId')
+        if recurrence_id:
+            event_id = instance_id_for(event_id, recurrence_id)
+
+        existing = self.get_event(event_id)
+        if existing is not None:
+            if _is_outdated(existing, event_data):
+                print(f"Ignoring outdated invite (sequence {event_data.get('sequence')}): {event_data.get('title')}")
+                return None
+            return self.update_event(event_id, event_data)
+        if recurrence_id:
+            event_id = event_id_for(f"{uid}/{recurrence_id}")
+        return self.create_event(event_data, event_id=event_id)
+
+    def cancel_invite(self, event_data: Dict[str, Any]) -> int:
+        """
+        Deletes the events created from a cancelled invite: the whole series,
+        or with a RECURRENCE-ID only that occurrence. Events saved from a
+        later revision (higher SEQUENCE) of the invite are kept.
+
+        Returns:
+            Number of events deleted.
+        """
+        uid = event_data['uid']
+        recurrence_id = event_data.get('recurrenceId')
+        if recurrence_id:
+            candidates = (instance_id_for(event_id_for(uid), recurrence_id), event_id_for(f"{uid}/{recurrence_id}"))
+            events = [event for event in map(self.get_event, candidates)
+                      if event is not None and event.get('status') != 'cancelled']
+        else:
+            events = self.find_events_by_ical_uid(uid)
+
+        deleted = 0
+        for event in events:
+            if _is_outdated(event, event_data):
+                print(f"Ignoring outdated cancellation (sequence {event_data.get('sequence')}): {event.get('summary')}")
+                continue
+            self._execute(self.service.events().delete(calendarId=self.calendar_id, eventId=event['id']))
+            print(f"Event cancelled: {event.get('summary')}")
+            deleted += 1
+        return deleted
+
 if __name__ == "__main__":
     # Manual test (requires service_account.json and CALENDAR_ID)
     try:
@@ -0,0 +1,185 @@
+import bisect
+import re
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from googleapiclient.errors import HttpError
+
+# Events that ended longer ago than this are dropped from the index; new
+# emails are never about them.
+DEFAULT_HORIZON_DAYS = 30
+
+# Busy timed events up to this long are found by a binary search from
+# (start - LONG_EVENT_SECONDS); longer ones (a multi-day conference block)
+# are few and are checked one by one, so they do not widen every search.
+LONG_EVENT_SECONDS = 24 * 60 * 60
+
+def _timestamp(value: Dict[str, Any]) -> Optional[float]:
+    """Converts a Calendar API start/end ({'dateTime'} or {'date'}) to epoch seconds."""
+    if value.get('dateTime'):
+        return parse_time(value['dateTime'])
+    if value.get('date'):
+        return datetime.fromisoformat(value['date']).replace(tzinfo=timezone.utc).timestamp()
+    return None
+
+def parse_time(value: str) -> float:
+    """Parses an ISO 8601 timestamp to epoch seconds; naive values are taken as UTC."""
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def normalize_title(title: str) -> str:
+    return re.sub(r'\s+', ' ', (title or '').strip()).casefold()
+
+class CalendarIndex:
+    """
+    In-memory index of the calendar's events, kept current with the Calendar
+    API's incremental sync (syncToken).
+
+    Events are held in a list sorted by start time, so the duplicate and
+    conflict checks are binary searches instead of an events.list call per
+    email. Call sync() once per poll cycle; it costs one list call when
+    nothing changed, and a full resync only when the sync token expires.
+    """
+
+    def __init__(self, calendar_client, horizon_days: float = DEFAULT_HORIZON_DAYS):
+        self.calendar_client = calendar_client
+        self.horizon_seconds = horizon_days * 24 * 60 * 60
+        self.sync_token: Optional[str] = None
+        self._events: Dict[str, Dict[str, Any]] = {}
+        # (start, event_id) of every event, sorted, for the duplicate check.
+        self._starts: List[Tuple[float, str]] = []
+        # Only busy, timed events can conflict: the short ones sorted the
+        # same way, and the IDs of those longer than LONG_EVENT_SECONDS.
+        self._busy_starts: List[Tuple[float, str]] = []
+        self._long_busy: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def sync(self) -> int:
+        """
+        Applies changes since the last sync, or loads every event on the first
+        call (and when the sync token has expired).
+
+        Returns:
+            Number of events added, changed or removed.
+        """
+        try:
+            return self._sync(self.sync_token)
+        except HttpError as e:
+            if e.resp.status != 410 or self.sync_token is None:
+                raise
+            print("Calendar sync token expired; rebuilding the calendar index.")
+            return self._sync(None)
+
+    def _sync(self, sync_token: Optional[str]) -> int:
+        changes: List[Dict[str, Any]] = []
+        page_token = None
+        while True:
+            response = self.calendar_client.list_events(sync_token=sync_token, page_token=page_token)
+            changes.extend(response.get('items', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+        with self._lock:
+            if sync_token is None:
+                self._events.clear()
+                self._starts.clear()
+                self._busy_starts.clear()
+                self._long_busy.clear()
+            for event in changes:
+                self._apply(event)
+            self.sync_token = response.get('nextSyncToken')
+        print(f"Calendar index synced: {len(changes)} changes, {len(self._events)} events.")
+        return len(changes)
+
+    def add(self, event: Dict[str, Any]):
+        """Indexes an event the agent just wrote, ahead of the next sync."""
+        if not event or 'id' not in event:
+            return
+        with self._lock:
+            self._apply(event)
+
+    def _apply(self, event: Dict[str, Any]):
+        self._remove(event['id'])
+        if event.get('status') == 'cancelled':
+            return
+        start = _timestamp(event.get('start', {}))
+        end = _timestamp(event.get('end', {}))
+        if start is None or end is None:
+            return
+        if end < datetime.now(timezone.utc).timestamp() - self.horizon_seconds:
+            return
+        entry = self._events[event['id']] = {
+            'id': event['id'],
+            'title': event.get('summary', ''),
+            'key': normalize_title(event.get('summary', '')),
+            'start': start,
+            'end': end,
+            'all_day': 'date' in event.get('start', {}),
+            'busy': event.get('transparency') != 'transparent',
+        }
+        bisect.insort(self._starts, (start, event['id']))
+        if entry['busy'] and not entry['all_day']:
+            if end - start > LONG_EVENT_SECONDS:
+                self._long_busy.add(event['id'])
+            else:
+                bisect.insort(self._busy_starts, (start, event['id']))
+
+    def _remove(self, event_id: str):
+        entry = self._events.pop(event_id, None)
+        if entry:
+            self._long_busy.discard(event_id)
+            for starts in (self._starts, self._busy_starts):
+                i = bisect.bisect_left(starts, (entry['start'], event_id))
+                if i < len(starts) and starts[i] == (entry['start'], event_id):
+                    del starts[i]
+
+    def find_duplicate(self, title: str, start: float, end: float) -> Optional[Dict[str, Any]]:
+        """Returns an indexed event with the same title and exactly the same time window, if any."""
+        key = normalize_title(title)
+        with self._lock:
+            i = bisect.bisect_left(self._starts, (start, ''))
+            while i < len(self._starts) and self._starts[i][0] == start:
+                entry = self._events[self._starts[i][1]]
+                if entry['end'] == end and entry['key'] == key:
+                    return dict(entry)
+                i += 1
+        return None
+
+    def find_conflicts(self, start: float, end: float) -> List[Dict[str, Any]]:
+        """Returns busy, timed events overlapping [start, end), ordered by start."""
+        with self._lock:
+            conflicts = [self._events[event_id] for event_id in self._long_busy
+                         if self._events[event_id]['start'] < end and self._events[event_id]['end'] > start]
+            i = bisect.bisect_left(self._busy_starts, (start - LONG_EVENT_SECONDS, ''))
+            while i < len(self._busy_starts) and self._busy_starts[i][0] < end:
+                entry = self._events[self._busy_starts[i][1]]
+                if entry['end'] > start:
+                    conflicts.append(entry)
+                i += 1
+            conflicts = [dict(entry) for entry in conflicts]
+        return sorted(conflicts, key=lambda entry: (entry['start'], entry['id']))
+
+    def check(self, event_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Checks extracted EventData against the index before it is inserted.
+
+        Returns:
+            Dictionary with 'duplicate' (the matching event or None) and
+            'conflicts' (other events overlapping its time window).
+        """
+        if event_data.get('allDay'):
+            start = parse_time(event_data['startDate'])
+            end = parse_time(event_data['endDate'])
+        else:
+            start = parse_time(event_data['startDateTime'])
+            end = parse_time(event_data['endDateTime'])
+        duplicate = self.find_duplicate(event_data.get('title', ''), start, end)
+        conflicts = [e for e in self.find_conflicts(start, end) if not duplicate or e['id'] != duplicate['id']]
+        return {'duplicate': duplicate, 'conflicts': conflicts}
@@ -0,0 +1,138 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+from email.utils import parseaddr
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+EMAIL_STORE_FILE = 'recent_emails.db'
+
+# Newest emails kept in memory for the popup feed and the /events stream.
+DEFAULT_FEED_SIZE = 10
+DEFAULT_RETENTION_DAYS = 365
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+FIELDS = ('id', 'subject', 'sender', 'summary', 'category', 'importance', 'processed_at')
+
+class EmailStore:
+    """
+    Important emails the agent has processed: the newest few in an in-memory
+    ring buffer, all of them in an indexed SQLite table.
+
+    Pages are read newest first with a cursor (the row's insertion sequence)
+    through an index per filter, so a page costs the same however much
+    history is kept. Both halves are guarded by one lock, so the agent's
+    threads can add while server handlers read.
+    """
+
+    def __init__(self, path: str = EMAIL_STORE_FILE, feed_size: int = DEFAULT_FEED_SIZE,
+                 retention_days: float = DEFAULT_RETENTION_DAYS):
+        self.path = path
+        self.retention_seconds = retention_days * 24 * 60 * 60
+        self._lock = threading.Lock()
+        # (seq, email) pairs, newest first.
+        self._feed: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=feed_size)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS emails ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, subject TEXT, sender TEXT, "
+                "sender_address TEXT, summary TEXT, category TEXT, importance TEXT, processed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS emails_time_idx ON emails (processed_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS emails_category_idx ON emails (category, seq)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS emails_importance_idx ON emails (importance, seq)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS emails_sender_idx ON emails (sender_address, seq)")
+        self.prune()
+        # The feed survives restarts.
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT seq, {', '.join(FIELDS)} FROM emails ORDER BY seq DESC LIMIT ?", (feed_size,)
+            ).fetchall()
+        self._feed.extend((row[0], dict(zip(FIELDS, row[1:]))) for row in rows)
+
+    def add(self, email: Dict[str, Any]):
+        """
+        Stores an email summary (id, subject, sender, summary, category,
+        importance) as the newest entry; an email added again moves to the front.
+        """
+        entry = {field: email.get(field) for field in FIELDS}
+        entry['processed_at'] = entry['processed_at'] or time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM emails WHERE id = ?", (entry['id'],))
+            seq = self._conn.execute(
+                "INSERT INTO emails (id, subject, sender, sender_address, summary, category, importance, processed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry['id'], entry['subject'], entry['sender'], _address(entry['sender']), entry['summary'],
+                 entry['category'], entry['importance'], entry['processed_at'])
+            ).lastrowid
+            for item in list(self._feed):
+                if item[1]['id'] == entry['id']:
+                    self._feed.remove(item)
+            self._feed.appendleft((seq, entry))
+
+    def recent(self) -> List[Dict[str, Any]]:
+        """Returns the in-memory feed, newest first."""
+        with self._lock:
+            return [email for _, email in self._feed]
+
+    def query(self, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[int] = None, category: Optional[str] = None,
+              importance: Optional[str] = None, sender: Optional[str] = None,
+              since: Optional[float] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        Returns one page of stored emails, newest first.
+
+        Args:
+            limit: Page size, capped at MAX_PAGE_SIZE.
+            cursor: The next_cursor of the previous page; None for the first page.
+            category, importance: Exact values to match.
+            sender: Email address to match, case-insensitively.
+            since: Only emails processed at or after this Unix time.
+
+        Returns:
+            Tuple of (emails, next_cursor); next_cursor is None on the last page.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        if cursor is None and not any((category, importance, sender, since)):
+            # The hot path: the newest page is usually in memory already.
+            with self._lock:
+                if limit < len(self._feed) or len(self._feed) < self._feed.maxlen:
+                    page = list(self._feed)[:limit]
+                    more = limit < len(self._feed)
+                    return [email for _, email in page], (page[-1][0] if more else None)
+
+        conditions, params = [], []
+        for column, value in (('seq <', cursor), ('category =', category), ('importance =', importance),
+                              ('sender_address =', sender and sender.lower()), ('processed_at >=', since)):
+            if value is not None:
+                conditions.append(f"{column} ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT seq, {', '.join(FIELDS)} FROM emails {where} ORDER BY seq DESC LIMIT ?",
+                (*params, limit + 1)
+            ).fetchall()
+        page = rows[:limit]
+        next_cursor = page[-1][0] if len(rows) > limit else None
+        return [dict(zip(FIELDS, row[1:])) for row in page], next_cursor
+
+    def prune(self) -> int:
+        """Drops emails older than the retention window. Returns the number removed."""
+        cutoff = time.time() - self.retention_seconds
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM emails WHERE processed_at < ?", (cutoff,)).rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def _address(sender: Optional[str]) -> Optional[str]:
+    if not sender:
+        return None
+    return (parseaddr(sender)[1] or sender).lower()
@@ -1,13 +1,86 @@
+import asyncio
 import json
 import os
+import time
+import hashlib
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional, Dict, Any
-from openai import OpenAI
+from typing import Optional, Dict, Any, Callable, List
 from dotenv import load_dotenv
+from src.extraction_cache import ExtractionCache
+from src.metrics import OPENAI_REQUESTS, OPENAI_TOKENS, count_error
+from src.preprocess import estimate_tokens
+from src.ratelimit import OPENAI_LIMITER
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+class _LazyClient:
+    """
+    Stands in for an OpenAI client and builds it on first use, so importing
+    this module neither imports openai (about a second) nor needs an API key.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            # Introspection (e.g. by mock.patch or asyncio) must not build the client.
+            raise AttributeError(name)
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return getattr(self._client, name)
+
+class _PerLoopClient:
+    """
+    Lazily builds one async OpenAI client per event loop. Its connections are
+    bound to the loop that opened them, and a single-account Agent and the
+    AgentManager run their cycles on different loops in the same process.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            # Introspection (e.g. by mock.patch or asyncio) must not build the client.
+            raise AttributeError(name)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.get(loop)
+            if client is None:
+                client = self._clients[loop] = self._factory()
+        return getattr(client, name)
+
+def _openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+def _async_openai_client():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+# Retries are left to OPENAI_LIMITER, which shares RPM/TPM quota across callers.
+client = _LazyClient(_openai_client)
+async_client = _PerLoopClient(_async_openai_client)
+
+# Completion tokens reserved per request when drawing from the TPM quota.
+COMPLETION_TOKEN_ESTIMATE = 300
+
+MODEL = "gpt-4o"
+
+SYSTEM_PROMPT_TEMPLATE = """You are an assistant that reads emails and extracts calendar events.
+The current date and time is {current_time}. Resolve relative dates such as "tomorrow" or "next Friday" against it.
+If the email describes a meeting, a registration or an event with a concrete date and time, set Intent accordingly and fill EventData using ISO 8601 UTC timestamps. If no end time is given, assume the event lasts one hour.
+Otherwise set Intent to "None" and leave EventData empty."""
 
 def get_current_time_str() -> str:
     """Returns the current time in ISO 8601 format."""
@@ -51,28 +124,307 @@ EVENT_EXTRACTION_TOOLS = [
     }
 ]
 
-def extract_event_data(email_text: str) -> Dict[str, Any]:
+def build_system_prompt() -> str:
+    """Renders the system prompt for the current time."""
+    return SYSTEM_PROMPT_TEMPLATE.format(current_time=get_current_time_str())
+
+def extraction_schema_version() -> str:
+    """
+    Returns a short fingerprint of everything that shapes an extraction result:
+    the model, the system prompt template and the tool schema. Cached results
+    are keyed on it, so editing any of them invalidates the cache.
+    """
+    payload = json.dumps(
+        {"model": MODEL, "prompt": SYSTEM_PROMPT_TEMPLATE, "tools": EVENT_EXTRACTION_TOOLS},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+def _cache_key(email_text: str, cache: ExtractionCache) -> str:
+    # Relative dates ("tomorrow") are resolved against today, so results
+    # are only reused within the same local day.
+    namespace = f"{extraction_schema_version()}:{datetime.now().astimezone().date().isoformat()}"
+    return cache.key_for(email_text, namespace)
+
+def _completion_request(email_text: str) -> Dict[str, Any]:
+    """Keyword arguments for chat.completions.create, shared by the sync and async paths."""
+    return {
+        "model": MODEL,
+        "messages": [
+            {"role": "system", "content": build_system_prompt()},
+            {"role": "user", "content": email_text}
+        ],
+        "tools": EVENT_EXTRACTION_TOOLS,
+        "tool_choice": {"type": "function", "function": {"name": "create_calendar_event"}}
+    }
+
+def _quota_cost(request: Dict[str, Any]) -> Dict[str, float]:
+    """Requests and estimated tokens a chat completion draws from the OpenAI quota."""
+    prompt = "".join(message["content"] for message in request["messages"])
+    return {"requests": 1, "tokens": estimate_tokens(prompt) + COMPLETION_TOKEN_ESTIMATE}
+
+def _parse_response(response) -> Dict[str, Any]:
+    tool_call = response.choices[0].message.tool_calls[0]
+    return json.loads(tool_call.function.arguments)
+
+# Batched extraction records usage from pool threads into one caller-owned dict.
+_usage_lock = threading.Lock()
+
+def _record_usage(usage: Optional[Dict[str, int]], response, emails: int = 1):
+    """Counts a response's tokens in the metrics and in the caller-owned usage dict, if any."""
+    response_usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(response_usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(response_usage, "completion_tokens", 0) or 0
+    OPENAI_REQUESTS.inc()
+    OPENAI_TOKENS.inc(prompt_tokens, kind="prompt")
+    OPENAI_TOKENS.inc(completion_tokens, kind="completion")
+    if usage is None:
+        return
+    with _usage_lock:
+        usage["requests"] = usage.get("requests", 0) + 1
+        usage["emails"] = usage.get("emails", 0) + emails
+        usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + prompt_tokens
+        usage["completion_tokens"] = usage.get("completion_tokens", 0) + completion_tokens
+
+def _error_result(e: Exception) -> Dict[str, Any]:
+    print(f"Error extracting event data: {e}")
+    count_error("extraction", e)
+    # "Error" marks the result as a failed call rather than a real "None"
+    # classification, so callers can retry instead of recording it.
+    return {"Intent": "None", "EventData": {}, "Error": str(e)}
+
+def extract_event_data(email_text: str, cache: Optional[ExtractionCache] = None,
+                       usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
     """
     Analyzes email text using OpenAI API to extract structured event data.
     
     Args:
         email_text: The raw text content of the email.
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": email_text}
-            ],
-            tools=EVENT_EXTRACTION_TOOLS,
-            tool_choice={"type": "function", "function": {"name": "create_calendar_event"}}
-        )
+        cache: Optional ExtractionCache. Identical (normalized) emails seen
+            earlier the same day are answered from it without an API call.
+        usage: Optional dict that accumulates request and token counts.
+        
+    Returns:
+        Dictionary with 'Intent' and 'EventData' keys.
+    """
+    key = _cache_key(email_text, cache) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    try:
+        request = _completion_request(email_text)
+        response = OPENAI_LIMITER.call(client.chat.completions.create, cost=_quota_cost(request), **request)
+        _record_usage(usage, response)
+        function_args = _parse_response(response)
+    except Exception as e:
+        return _error_result(e)
 
-        tool_call = response.choices[0].message.tool_calls[0]
-        function_args = json.loads(tool_call.function.arguments)
-        return function_args
+    if key is not None:
+        cache.put(key, function_args)
+    return function_args
 
+async def extract_event_data_async(email_text: str, cache: Optional[ExtractionCache] = None,
+                                   usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """
+    Async variant of extract_event_data using the AsyncOpenAI client, so many
+    extractions can be in flight at once. Same arguments and result shape.
+    """
+    key = _cache_key(email_text, cache) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    try:
+        request = _completion_request(email_text)
+        response = await OPENAI_LIMITER.call_async(async_client.chat.completions.create, cost=_quota_cost(request), **request)
+        _record_usage(usage, response)
+        function_args = _parse_response(response)
     except Exception as e:
-        print(f"Error extracting event data: {e}")
-        return {"Intent": "None", "EventData": {}}
+        return _error_result(e)
+
+    if key is not None:
+        cache.put(key, function_args)
+    return function_args
+
+# Rough input-token budget for one batched request (emails only; the system
+# prompt and tool schema are sent once on top of it).
+BATCH_TOKEN_BUDGET = 6000
+BATCH_MAX_EMAILS = 20
+
+BATCH_PROMPT_SUFFIX = """
+You will receive several emails, each wrapped in <email id="..."> tags. Analyze each one independently and call create_calendar_events once, with exactly one result per email whose message_id is the email's id."""
+
+def _batch_tools() -> list:
+    """Batch variant of EVENT_EXTRACTION_TOOLS: an array of per-email results."""
+    single = EVENT_EXTRACTION_TOOLS[0]["function"]["parameters"]
+    item = {
+        "type": "object",
+        "required": ["message_id"] + single["required"],
+        "properties": {"message_id": {"type": "string", "description": "The id of the email this result is for."}, **single["properties"]}
+    }
+    return [{
+        "type": "function",
+        "function": {
+            "name": "create_calendar_events",
+            "description": "Extracts event data from several emails at once, one result per email.",
+            "parameters": {
+                "type": "object",
+                "required": ["results"],
+                "properties": {"results": {"type": "array", "items": item}}
+            }
+        }
+    }]
+
+def _pack_batches(email_texts: Dict[str, str], token_budget: int) -> List[List[str]]:
+    """Greedily groups message IDs so each group's estimated tokens stay within budget."""
+    batches: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for message_id, text in email_texts.items():
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > token_budget or len(current) >= BATCH_MAX_EMAILS):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(message_id)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _extract_batch(email_texts: Dict[str, str], message_ids: List[str], usage: Optional[Dict[str, int]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Extracts one packed group in a single request.
+
+    Returns:
+        Results keyed by message ID for the emails the model answered validly.
+        Emails missing from the response are left out for the caller to retry.
+    """
+    content = "\n\n".join(f'<email id="{message_id}">\n{email_texts[message_id]}\n</email>' for message_id in message_ids)
+    request = {
+        "model": MODEL,
+        "messages": [
+            {"role": "system", "content": build_system_prompt() + BATCH_PROMPT_SUFFIX},
+            {"role": "user", "content": content}
+        ],
+        "tools": _batch_tools(),
+        "tool_choice": {"type": "function", "function": {"name": "create_calendar_events"}}
+    }
+    cost = _quota_cost(request)
+    cost["tokens"] += COMPLETION_TOKEN_ESTIMATE * (len(message_ids) - 1)
+    response = OPENAI_LIMITER.call(client.chat.completions.create, cost=cost, **request)
+    _record_usage(usage, response, emails=len(message_ids))
+
+    try:
+        items = json.loads(response.choices[0].message.tool_calls[0].function.arguments)["results"]
+    except (json.JSONDecodeError, KeyError, IndexError, TypeError, AttributeError) as e:
+        print(f"Malformed batched extraction response: {e}")
+        return {}
+
+    # Only this batch's IDs: other pending emails belong to batches running concurrently.
+    batch_ids = set(message_ids)
+    results: Dict[str, Dict[str, Any]] = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict) or item.get("message_id") not in batch_ids or "Intent" not in item:
+            continue
+        message_id = item.pop("message_id")
+        item.setdefault("EventData", {})
+        results[message_id] = item
+    return results
+
+def extract_event_data_batch(email_texts: Dict[str, str], cache: Optional[ExtractionCache] = None,
+                             token_budget: int = BATCH_TOKEN_BUDGET, max_workers: int = 1,
+                             usage: Optional[Dict[str, int]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Extracts event data for several emails, packing as many as fit in
+    token_budget into each request so the system prompt and tool schema are
+    sent once per group rather than once per email.
+
+    Emails the batched response leaves out or answers malformed are retried
+    one by one with extract_event_data. If a batched request fails outright,
+    its emails get error results, as a single extraction would.
+
+    Args:
+        email_texts: Email text keyed by message ID.
+        cache: Optional ExtractionCache, shared with single-email extraction.
+        token_budget: Estimated input tokens per batched request.
+        max_workers: Number of batched requests sent in parallel.
+        usage: Optional dict that accumulates request and token counts.
+
+    Returns:
+        Extraction result (as from extract_event_data) keyed by message ID.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    keys: Dict[str, str] = {}
+    pending: Dict[str, str] = {}
+    for message_id, text in email_texts.items():
+        if cache is not None:
+            keys[message_id] = _cache_key(text, cache)
+            cached = cache.get(keys[message_id])
+            if cached is not None:
+                results[message_id] = cached
+                continue
+        pending[message_id] = text
+
+    def run(message_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        try:
+            batch_results = _extract_batch(pending, message_ids, usage)
+        except Exception as e:
+            return {message_id: _error_result(e) for message_id in message_ids}
+        if cache is not None:
+            for message_id, result in batch_results.items():
+                cache.put(keys[message_id], result)
+        for message_id in message_ids:
+            if message_id not in batch_results:
+                batch_results[message_id] = extract_event_data(pending[message_id], cache=cache, usage=usage)
+        return batch_results
+
+    batches = _pack_batches(pending, token_budget)
+    if max_workers > 1 and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for batch_results in pool.map(run, batches):
+                results.update(batch_results)
+    else:
+        for batch in batches:
+            results.update(run(batch))
+
+    return {message_id: results[message_id] for message_id in email_texts}
+
+def compare_extraction_modes(email_texts: Dict[str, str], token_budget: int = BATCH_TOKEN_BUDGET) -> Dict[str, Dict[str, float]]:
+    """
+    Runs the same emails through single and batched extraction (uncached) and
+    reports tokens per email and emails per second for each mode.
+    """
+    report = {}
+    for mode in ("single", "batch"):
+        usage: Dict[str, int] = {}
+        started = time.perf_counter()
+        if mode == "single":
+            for text in email_texts.values():
+                extract_event_data(text, usage=usage)
+        else:
+            extract_event_data_batch(email_texts, token_budget=token_budget, usage=usage)
+        elapsed = time.perf_counter() - started
+        count = len(email_texts) or 1
+        report[mode] = {
+            "requests": usage.get("requests", 0),
+            "prompt_tokens_per_email": usage.get("prompt_tokens", 0) / count,
+            "completion_tokens_per_email": usage.get("completion_tokens", 0) / count,
+            "emails_per_second": len(email_texts) / elapsed if elapsed else 0.0,
+        }
+    return report
 
 if __name__ == "__main__":
     # Simple manual test
     sample_email = "Hey, let's meet for coffee tomorrow at 2 PM at Starbucks."
     print(json.dumps(extract_event_data(sample_email), indent=2))
+
+    # Single vs. batched extraction on a few samples
+    samples = {
+        "a": sample_email,
+        "b": "Project review moved to Friday 11am, same Zoom link.",
+        "c": "Your order #1234 has shipped.",
+    }
+    print(json.dumps(compare_extraction_modes(samples), indent=2))
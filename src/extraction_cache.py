@@ -0,0 +1,141 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+CACHE_FILE = 'extraction_cache.db'
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MEMORY_ENTRIES = 1024
+DEFAULT_DISK_ENTRIES = 20000
+
+# Reply/forward prefixes and quote markers that differ between resends of the
+# same email but do not change what the model should extract.
+_SUBJECT_PREFIX = re.compile(r'^(subject:\s*)((re|fwd?|fw)\s*:\s*)+', re.IGNORECASE | re.MULTILINE)
+_QUOTE_MARKER = re.compile(r'^[ \t]*(>[ \t]?)+', re.MULTILINE)
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_email_text(email_text: str) -> str:
+    """Normalizes email text so trivially different resends hash to the same key."""
+    text = _SUBJECT_PREFIX.sub(r'\1', email_text)
+    text = _QUOTE_MARKER.sub('', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+class ExtractionCache:
+    """
+    Two-tier cache of extraction results.
+
+    An in-memory LRU tier answers repeat lookups without touching disk; a
+    SQLite tier keeps results across restarts. Both tiers expire entries after
+    ttl_seconds and are bounded in size. Keys combine a hash of the normalized
+    email text with a caller-supplied namespace (the prompt/schema version), so
+    a schema change simply stops matching old entries, which then age out.
+    """
+
+    def __init__(self, path: Optional[str] = CACHE_FILE, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 max_memory_entries: int = DEFAULT_MEMORY_ENTRIES, max_disk_entries: int = DEFAULT_DISK_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        # key -> (stored_at, JSON text). JSON text is kept instead of the dict so
+        # every hit hands out an independent copy.
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS extractions ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS accessed_at_idx ON extractions (accessed_at)")
+
+    @staticmethod
+    def key_for(email_text: str, namespace: str) -> str:
+        """Builds the cache key for an email under the given prompt/schema namespace."""
+        digest = hashlib.sha256(normalize_email_text(email_text).encode()).hexdigest()
+        return f"{namespace}:{digest}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns a copy of the cached result, or None on a miss or expired entry."""
+        now = time.time()
+        expired = False
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.stats["hits"] += 1
+                    self.stats["memory_hits"] += 1
+                    return json.loads(entry[1])
+                del self._memory[key]
+                expired = True
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, stored_at FROM extractions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, stored_at = row
+                    if now - stored_at < self.ttl_seconds:
+                        with self._conn:
+                            self._conn.execute("UPDATE extractions SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._remember(key, stored_at, value)
+                        self.stats["hits"] += 1
+                        self.stats["disk_hits"] += 1
+                        return json.loads(value)
+                    with self._conn:
+                        self._conn.execute("DELETE FROM extractions WHERE key = ?", (key,))
+                    expired = True
+
+            if expired:
+                self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Stores a result in both tiers."""
+        now = time.time()
+        text = json.dumps(value)
+        with self._lock:
+            self._remember(key, now, text)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO extractions (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                        (key, text, now, now)
+                    )
+                    self._conn.execute("DELETE FROM extractions WHERE stored_at < ?", (now - self.ttl_seconds,))
+                    removed = self._conn.execute(
+                        "DELETE FROM extractions WHERE key IN ("
+                        "SELECT key FROM extractions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_disk_entries,)
+                    ).rowcount
+                    self.stats["evictions"] += removed
+
+    def _remember(self, key: str, stored_at: float, text: str):
+        """Adds an entry to the memory tier, evicting the least recently used. Caller holds the lock."""
+        self._memory[key] = (stored_at, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM extractions")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -1,49 +1,147 @@
 import os
-import base64
-from typing import List, Dict, Any, Optional
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import json
+import functools
+import threading
+from typing import List, Dict, Any, Optional, Callable, Tuple, TYPE_CHECKING
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.errors import HttpError
+from src.discovery import build_service
+from src.mime import extract_bodies, decode_attachment, DEFAULT_MAX_BYTES
+from src.ratelimit import RateLimiter, GMAIL_LIMITER, GMAIL_QUOTA_UNITS, gmail_cost
+from src.transport import TOKEN_REFRESHER, shared_http
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly', 'https://www.googleapis.com/auth/gmail.modify']
 
+# Where the user's OAuth token is saved after consent.
+TOKEN_FILE = 'token.json'
+
+# Gmail accepts up to 100 calls per batch request but recommends 50 or fewer
+# to stay clear of per-user rate limits.
+BATCH_SIZE = 50
+
+# users.messages.list returns at most 500 messages per page.
+LIST_PAGE_SIZE = 500
+
+# users.messages.batchModify accepts at most 1000 message IDs per call.
+MODIFY_BATCH_SIZE = 1000
+
+# Where the incremental sync checkpoint (last seen historyId) is persisted.
+SYNC_STATE_FILE = 'gmail_sync.json'
+
+# Headers requested in the metadata-only triage phase.
+TRIAGE_HEADERS = ['Subject', 'From', 'Content-Type', 'List-Unsubscribe']
+
+# Decides from a message's metadata whether its full body is worth fetching.
+TriageFilter = Callable[[Dict[str, Any]], bool]
+
+# Labels whose new messages are never candidates for processing.
+IGNORED_LABELS = {'DRAFT', 'SENT', 'SPAM', 'TRASH'}
+
+def load_credentials(token_file: str = TOKEN_FILE) -> Optional['Credentials']:
+    """
+    Loads a saved user token, refreshing (and re-saving) it if it has expired.
+
+    Returns:
+        The credentials, or None if there is no token or it cannot be used
+        without the user consenting again.
+    """
+    if not os.path.exists(token_file):
+        return None
+    # Slow to import, so loaded when a token is first used rather than at startup.
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
+    creds = Credentials.from_authorized_user_file(token_file, SCOPES)
+    if creds.valid:
+        return creds
+    if creds.expired and creds.refresh_token:
+        creds.refresh(Request())
+        save_token(creds, token_file)
+        return creds
+    return None
+
+def save_token(creds: 'Credentials', token_file: str = TOKEN_FILE):
+    """Saves a user token atomically, so a crash mid-write cannot lose the refresh token."""
+    tmp_file = token_file + '.tmp'
+    with open(tmp_file, 'w') as token:
+        token.write(creds.to_json())
+    os.replace(tmp_file, token_file)
+
 class GmailClient:
-    def __init__(self):
-        self.creds = None
-        self.service = None
-        self.authenticate()
+    def __init__(self, service=None, sync_state_file: str = SYNC_STATE_FILE, max_body_bytes: int = DEFAULT_MAX_BYTES,
+                 limiter: RateLimiter = GMAIL_LIMITER, token_file: str = TOKEN_FILE, credentials: Optional['Credentials'] = None):
+        """
+        Args:
+            service: Gmail API service. When it is shared by several accounts,
+                pass each account's credentials too: every request is then
+                sent with them rather than with the service's own transport.
+            sync_state_file: Where the history checkpoint is kept.
+            token_file: The user's OAuth token, used when no service is given.
+        """
+        self.creds = credentials
+        self.token_file = token_file
+        # Shared per-user quota (250 units/s) with retry on 429/5xx.
+        self.limiter = limiter
+        self.max_body_bytes = max_body_bytes
+        self.service = service
+        self.sync_state_file = sync_state_file
+        self.history_id = self._load_history_id()
+        self._local = threading.local()
+        if self.service is None:
+            self.authenticate()
+        if self.creds is not None:
+            # Renewed in the background before it expires, and saved again.
+            TOKEN_REFRESHER.register(self.creds, functools.partial(save_token, token_file=self.token_file))
 
     def authenticate(self):
-        """Authenticates using credentials.json and creates token.json."""
-        if os.path.exists('token.json'):
-            self.creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-        
-        if not self.creds or not self.creds.valid:
-            if self.creds and self.creds.expired and self.creds.refresh_token:
-                self.creds.refresh(Request())
-            else:
-                if not os.path.exists('credentials.json'):
-                     raise FileNotFoundError("credentials.json not found. Please download it from Google Cloud Console.")
-                
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    'credentials.json', SCOPES)
-                self.creds = flow.run_local_server(port=0)
-            
+        """Authenticates using credentials.json and creates the token file."""
+        self.creds = load_credentials(self.token_file)
+
+        if not self.creds:
+            if not os.path.exists('credentials.json'):
+                 raise FileNotFoundError("credentials.json not found. Please download it from Google Cloud Console.")
+            from google_auth_oauthlib.flow import InstalledAppFlow
+
+            flow = InstalledAppFlow.from_client_secrets_file(
+                'credentials.json', SCOPES)
+            self.creds = flow.run_local_server(port=0)
+
             # Save the credentials for the next run
-            with open('token.json', 'w') as token:
-                token.write(self.creds.to_json())
+            save_token(self.creds, self.token_file)
 
-        self.service = build('gmail', 'v1', credentials=self.creds)
+        self.service = build_service('gmail', 'v1', credentials=self.creds)
 
-    def fetch_recent_emails(self, max_results: int = 5, query: str = 'is:unread') -> List[Dict[str, Any]]:
+    def _http(self):
+        """
+        Returns this thread's authorized transport, over the connections shared
+        by all clients on the thread (see shared_http). Without credentials
+        (an injected service) the service's own transport is used.
+        """
+        if self.creds is None:
+            return None
+        if getattr(self._local, 'http', None) is None:
+            self._local.http = AuthorizedHttp(self.creds, http=shared_http())
+        return self._local.http
+
+    def _execute(self, request, method: str):
+        """Executes one API request within the Gmail quota, retrying throttled and transient failures."""
+        return self.limiter.call(request.execute, http=self._http(), cost=gmail_cost(method))
+
+    def fetch_recent_emails(self, max_results: int = 5, query: str = 'is:unread', batch: bool = True,
+                            triage: Optional[TriageFilter] = None) -> List[Dict[str, Any]]:
         """
         Fetches recent emails matching the query.
         
         Args:
             max_results: Maximum number of emails to fetch.
             query: Gmail search query (default: 'is:unread').
+            batch: Fetch message bodies through Gmail batch requests instead of
+                one get() round trip per message.
+            triage: Optional metadata filter; see fetch_emails. Batched mode only.
             
         Returns:
             List of dictionaries containing 'id', 'subject', 'body', 'snippet'.
@@ -51,54 +149,336 @@ class GmailClient:
         if not self.service:
             raise RuntimeError("Gmail service not initialized.")
 
-        results = self.service.users().messages().list(userId='me', q=query, maxResults=max_results).execute()
-        messages = results.get('messages', [])
+        message_ids = self._list_message_ids(query, max_results)
+
+        if batch:
+            return self.fetch_emails(message_ids, triage=triage)
+
+        messages = [self._execute(self.service.users().messages().get(userId='me', id=message_id), 'messages.get') for message_id in message_ids]
+        return [self._parse_message(msg) for msg in messages]
+
+    def _list_message_ids(self, query: str, max_results: int) -> List[str]:
+        results = self._execute(self.service.users().messages().list(userId='me', q=query, maxResults=max_results), 'messages.list')
+        return [message['id'] for message in results.get('messages', [])]
+
+    def list_message_page(self, query: str, page_token: Optional[str] = None,
+                          page_size: int = LIST_PAGE_SIZE) -> Tuple[List[str], Optional[str]]:
+        """
+        Lists one page of the messages matching a query, newest first.
+
+        Args:
+            query: Gmail search query, e.g. 'after:2024/01/01 before:2024/04/01'.
+            page_token: nextPageToken of the previous page; None for the first page.
+            page_size: Messages per page, at most LIST_PAGE_SIZE.
+
+        Returns:
+            Tuple of (message IDs, next page token or None after the last page).
+        """
+        if not self.service:
+            raise RuntimeError("Gmail service not initialized.")
+
+        results = self._execute(self.service.users().messages().list(
+            userId='me', q=query, maxResults=min(page_size, LIST_PAGE_SIZE), pageToken=page_token
+        ), 'messages.list')
+        return [message['id'] for message in results.get('messages', [])], results.get('nextPageToken')
+
+    def fetch_emails(self, message_ids: List[str], triage: Optional[TriageFilter] = None) -> List[Dict[str, Any]]:
+        """
+        Downloads and parses the given messages, preserving their order.
         
-        email_data = []
-        for message in messages:
-            msg = self.service.users().messages().get(userId='me', id=message['id']).execute()
+        Messages that fail to download are skipped; callers see them again on
+        a later retry or resync.
+        
+        Args:
+            message_ids: IDs of the messages to fetch.
+            triage: Optional filter run on metadata first (format=metadata with
+                TRIAGE_HEADERS). Only messages it accepts are downloaded in
+                full; rejected ones are returned with an empty body and
+                'triaged_out': True so callers can record them.
+        """
+        if not message_ids:
+            return []
+
+        rejected: Dict[str, Dict[str, Any]] = {}
+        if triage is not None:
+            metadata = self.get_messages(message_ids, format='metadata', metadata_headers=TRIAGE_HEADERS)
+            for message_id in message_ids:
+                if message_id not in metadata:
+                    continue
+                email = self._parse_metadata(metadata[message_id])
+                if not triage(email):
+                    email['triaged_out'] = True
+                    rejected[message_id] = email
+            candidates = [message_id for message_id in message_ids if message_id in metadata and message_id not in rejected]
+        else:
+            candidates = message_ids
+
+        messages = self.get_messages(candidates) if candidates else {}
+        emails = []
+        for message_id in message_ids:
+            if message_id in rejected:
+                emails.append(rejected[message_id])
+            elif message_id in messages:
+                emails.append(self._parse_message(messages[message_id]))
+        return emails
+
+    def list_new_message_ids(self, query: str = 'is:unread', max_results: int = 50) -> Tuple[List[str], str]:
+        """
+        Lists unread messages added since the last checkpoint, without moving it.
+        
+        The first call (or any call after the stored checkpoint has expired)
+        lists the mailbox with the query instead. Callers store or process the
+        IDs and then pass the returned checkpoint to commit_checkpoint, so a
+        crash in between lists the same messages again rather than losing them.
+        
+        Args:
+            query: Gmail search query used for full resyncs (default: 'is:unread').
+            max_results: Maximum number of messages to list on a full resync.
             
-            # Extract Subject and Sender
-            headers = msg['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+        Returns:
+            Tuple of (message IDs, historyId to commit).
+        """
+        if not self.service:
+            raise RuntimeError("Gmail service not initialized.")
+
+        if self.history_id is not None:
+            try:
+                return self._list_history(self.history_id)
+            except HttpError as e:
+                # Gmail keeps history for roughly a week; older checkpoints return 404.
+                if e.resp.status != 404:
+                    raise
+                print("History checkpoint expired, running full resync.")
+
+        # Take the checkpoint before listing so that mail arriving during the
+        # resync is returned by the next incremental call rather than lost.
+        history_id = self._execute(self.service.users().getProfile(userId='me'), 'getProfile')['historyId']
+        return self._list_message_ids(query, max_results), history_id
+
+    def commit_checkpoint(self, history_id: str):
+        """Advances the incremental sync checkpoint to a historyId from list_new_message_ids."""
+        self._save_history_id(history_id)
+
+    def fetch_new_emails(self, query: str = 'is:unread', max_results: int = 50,
+                         triage: Optional[TriageFilter] = None) -> List[Dict[str, Any]]:
+        """
+        Fetches unread emails added since the last call, using the Gmail history API.
+        
+        A poll of a quiet mailbox is a single history().list() call that
+        returns nothing; see list_new_message_ids for resyncs.
+        
+        Args:
+            query: Gmail search query used for full resyncs (default: 'is:unread').
+            max_results: Maximum number of emails to fetch on a full resync.
+            triage: Optional metadata filter; see fetch_emails.
             
-            # Extract Body
-            body = ""
-            if 'parts' in msg['payload']:
-                for part in msg['payload']['parts']:
-                    if part['mimeType'] == 'text/plain':
-                        data = part['body'].get('data')
-                        if data:
-                            body += base64.urlsafe_b64decode(data).decode()
-            else:
-                # Fallback for simple emails
-                data = msg['payload']['body'].get('data')
-                if data:
-                    body = base64.urlsafe_b64decode(data).decode()
-
-            email_data.append({
-                'id': message['id'],
-                'subject': subject,
-                'sender': sender,
-                'body': body,
-                'snippet': msg.get('snippet', '')
-            })
+        Returns:
+            List of email dictionaries, as returned by fetch_emails.
+        """
+        message_ids, history_id = self.list_new_message_ids(query, max_results)
+        emails = self.fetch_emails(message_ids, triage=triage)
+        self.commit_checkpoint(history_id)
+        return emails
+
+    def _list_history(self, start_history_id: str):
+        """
+        Lists unread messages added since start_history_id.
+        
+        Returns:
+            Tuple of (new message IDs in history order, mailbox's current historyId).
+        """
+        message_ids: List[str] = []
+        seen = set()
+        latest_history_id = start_history_id
+        page_token = None
+
+        while True:
+            response = self._execute(self.service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                pageToken=page_token
+            ), 'history.list')
+
+            for record in response.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    message = added['message']
+                    labels = set(message.get('labelIds', []))
+                    if 'UNREAD' not in labels or labels & IGNORED_LABELS:
+                        continue
+                    if message['id'] not in seen:
+                        seen.add(message['id'])
+                        message_ids.append(message['id'])
+
+            latest_history_id = response.get('historyId', latest_history_id)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return message_ids, latest_history_id
+
+    def _load_history_id(self) -> Optional[str]:
+        if not self.sync_state_file or not os.path.exists(self.sync_state_file):
+            return None
+        with open(self.sync_state_file) as f:
+            return json.load(f).get('historyId')
+
+    def _save_history_id(self, history_id: str):
+        self.history_id = history_id
+        if not self.sync_state_file:
+            return
+        tmp_file = self.sync_state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'historyId': history_id}, f)
+        os.replace(tmp_file, self.sync_state_file)
+
+    def get_messages(self, message_ids: List[str], format: str = 'full',
+                     metadata_headers: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Downloads messages in Gmail batch requests of up to BATCH_SIZE calls each.
+        
+        Args:
+            message_ids: IDs of the messages to fetch.
+            format: Gmail message format ('full' or 'metadata').
+            metadata_headers: Headers to return when format is 'metadata'.
             
-        return email_data
+        Returns:
+            Dictionary mapping message ID to the raw message resource. Messages
+            whose individual call failed are omitted.
+        """
+        if not self.service:
+            raise RuntimeError("Gmail service not initialized.")
+
+        requests = {
+            message_id: self.service.users().messages().get(
+                userId='me', id=message_id, format=format, metadataHeaders=metadata_headers
+            )
+            for message_id in message_ids
+        }
+        # Throttled calls within a batch are retried in a later batch.
+        messages, failed = self.limiter.execute_batch(
+            self.service.new_batch_http_request, requests, http=self._http(),
+            batch_size=BATCH_SIZE, units_per_call=GMAIL_QUOTA_UNITS['messages.get']
+        )
+
+        for message_id, error in failed.items():
+            print(f"Failed to fetch message {message_id}: {error}")
+
+        return messages
+
+    def get_thread_summaries(self, thread_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Fetches the messages of several threads as metadata and snippets only,
+        in Gmail batch requests of up to BATCH_SIZE calls each.
+
+        Returns:
+            Dictionary mapping thread ID to its messages, oldest first, each
+            with 'id', 'sender', 'subject', 'snippet' and 'received_at'.
+            Threads whose call failed are omitted.
+        """
+        if not self.service:
+            raise RuntimeError("Gmail service not initialized.")
+
+        requests = {
+            thread_id: self.service.users().threads().get(
+                userId='me', id=thread_id, format='metadata', metadataHeaders=['From', 'Subject']
+            )
+            for thread_id in thread_ids
+        }
+        responses, failed = self.limiter.execute_batch(
+            self.service.new_batch_http_request, requests, http=self._http(),
+            batch_size=BATCH_SIZE, units_per_call=GMAIL_QUOTA_UNITS['threads.get']
+        )
+        for thread_id, error in failed.items():
+            print(f"Failed to fetch thread {thread_id}: {error}")
+
+        threads: Dict[str, List[Dict[str, Any]]] = {}
+        for thread_id, response in responses.items():
+            messages = []
+            for msg in response.get('messages', []):
+                headers = {h['name'].lower(): h['value'] for h in msg.get('payload', {}).get('headers', [])}
+                messages.append({
+                    'id': msg['id'],
+                    'sender': headers.get('from', 'Unknown Sender'),
+                    'subject': headers.get('subject', 'No Subject'),
+                    'snippet': msg.get('snippet', ''),
+                    'received_at': int(msg.get('internalDate', 0)),
+                })
+            threads[thread_id] = sorted(messages, key=lambda m: m['received_at'])
+        return threads
+
+    def _parse_metadata(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        """Converts a format=metadata message into an email dict with an empty body."""
+        headers = {h['name'].lower(): h['value'] for h in msg.get('payload', {}).get('headers', [])}
+        return {
+            'id': msg['id'],
+            'thread_id': msg.get('threadId', msg['id']),
+            'received_at': int(msg.get('internalDate', 0)),
+            'subject': headers.get('subject', 'No Subject'),
+            'sender': headers.get('from', 'Unknown Sender'),
+            'content_type': headers.get('content-type', ''),
+            'list_unsubscribe': headers.get('list-unsubscribe', ''),
+            'body': '',
+            'html': '',
+            'snippet': msg.get('snippet', '')
+        }
+
+    def _parse_message(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        """Converts a raw Gmail message resource into the email dict used by the agent."""
+        # Extract Subject and Sender
+        headers = msg['payload']['headers']
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+        
+        # Extract Body (nested parts walked, attachments skipped, size capped)
+        bodies = extract_bodies(msg['payload'], self.max_body_bytes)
+
+        return {
+            'id': msg['id'],
+            'thread_id': msg.get('threadId', msg['id']),
+            'received_at': int(msg.get('internalDate', 0)),
+            'subject': subject,
+            'sender': sender,
+            'body': bodies['text'],
+            'html': bodies['html'],
+            'calendar': bodies['calendar'],
+            'calendar_attachments': bodies['calendar_attachments'],
+            'snippet': msg.get('snippet', '')
+        }
+
+    def get_attachment(self, message_id: str, attachment_id: str) -> str:
+        """Downloads an attachment stored out of line (e.g. an .ics invite) and returns it as text."""
+        if not self.service:
+            raise RuntimeError("Gmail service not initialized.")
+
+        attachment = self._execute(self.service.users().messages().attachments().get(
+            userId='me', messageId=message_id, id=attachment_id
+        ), 'messages.attachments.get')
+        return decode_attachment(attachment.get('data', ''))
 
     def mark_as_read(self, message_id: str):
         """Marks an email as read by removing the UNREAD label."""
         if not self.service:
              raise RuntimeError("Gmail service not initialized.")
              
-        self.service.users().messages().modify(
+        self._execute(self.service.users().messages().modify(
             userId='me',
             id=message_id,
             body={'removeLabelIds': ['UNREAD']}
-        ).execute()
+        ), 'messages.modify')
         print(f"Marked message {message_id} as read.")
 
+    def batch_mark_as_read(self, message_ids: List[str]):
+        """Removes the UNREAD label from many messages with batchModify, MODIFY_BATCH_SIZE per call."""
+        if not self.service:
+             raise RuntimeError("Gmail service not initialized.")
+
+        for start in range(0, len(message_ids), MODIFY_BATCH_SIZE):
+            chunk = message_ids[start:start + MODIFY_BATCH_SIZE]
+            self._execute(self.service.users().messages().batchModify(
+                userId='me',
+                body={'ids': chunk, 'removeLabelIds': ['UNREAD']}
+            ), 'messages.batchModify')
+        print(f"Marked {len(message_ids)} messages as read.")
+
 if __name__ == "__main__":
     # Manual test
     try:
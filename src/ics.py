@@ -0,0 +1,201 @@
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Outlook/Exchange invites often use Windows zone names as TZID.
+WINDOWS_TIMEZONES = {
+    'UTC': 'UTC',
+    'GMT Standard Time': 'Europe/London',
+    'W. Europe Standard Time': 'Europe/Berlin',
+    'Romance Standard Time': 'Europe/Paris',
+    'Central Europe Standard Time': 'Europe/Budapest',
+    'E. Europe Standard Time': 'Europe/Bucharest',
+    'Eastern Standard Time': 'America/New_York',
+    'Central Standard Time': 'America/Chicago',
+    'Mountain Standard Time': 'America/Denver',
+    'Pacific Standard Time': 'America/Los_Angeles',
+    'India Standard Time': 'Asia/Kolkata',
+    'China Standard Time': 'Asia/Shanghai',
+    'Tokyo Standard Time': 'Asia/Tokyo',
+    'Korea Standard Time': 'Asia/Seoul',
+    'AUS Eastern Standard Time': 'Australia/Sydney',
+}
+
+# Recurrence properties passed through to Google Calendar verbatim.
+RECURRENCE_PROPERTIES = {'RRULE', 'EXRULE', 'RDATE', 'EXDATE'}
+
+_DURATION = re.compile(r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+def _unfold(text: str) -> List[str]:
+    """Joins folded content lines (continuations start with a space or tab)."""
+    lines: List[str] = []
+    for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        if line[:1] in (' ', '\t') and lines:
+            lines[-1] += line[1:]
+        elif line:
+            lines.append(line)
+    return lines
+
+def _parse_line(line: str) -> Tuple[str, Dict[str, str], str]:
+    """Splits 'NAME;PARAM=x;PARAM="y:z":value' into name, params and value."""
+    in_quotes = False
+    for i, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ':' and not in_quotes:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        return line.upper(), {}, ''
+
+    name, *raw_params = re.split(r';(?=(?:[^"]*"[^"]*")*[^"]*$)', head)
+    params = {}
+    for raw in raw_params:
+        key, _, param_value = raw.partition('=')
+        params[key.upper()] = param_value.strip('"')
+    return name.upper(), params, value
+
+def _unescape(value: str) -> str:
+    return re.sub(r'\\([\\;,nN])', lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+def _zone(tzid: Optional[str]):
+    if not tzid:
+        return None
+    tzid = WINDOWS_TIMEZONES.get(tzid, tzid)
+    try:
+        return ZoneInfo(tzid)
+    except (ZoneInfoNotFoundError, ValueError):
+        print(f"Unknown TZID '{tzid}', assuming UTC.")
+        return timezone.utc
+
+def _parse_datetime(value: str, params: Dict[str, str]):
+    """
+    Parses a DATE or DATE-TIME value.
+
+    Returns:
+        A date for all-day values, otherwise an aware datetime. Floating
+        times (no Z, no TZID) are taken as the agent's local time.
+    """
+    value = value.strip()
+    if params.get('VALUE') == 'DATE' or re.fullmatch(r'\d{8}', value):
+        return datetime.strptime(value[:8], '%Y%m%d').date()
+    if value.endswith('Z'):
+        return datetime.strptime(value[:-1], '%Y%m%dT%H%M%S').replace(tzinfo=timezone.utc)
+    naive = datetime.strptime(value, '%Y%m%dT%H%M%S')
+    zone = _zone(params.get('TZID'))
+    return naive.replace(tzinfo=zone) if zone else naive.astimezone()
+
+def _parse_duration(value: str) -> Optional[timedelta]:
+    match = _DURATION.match(value.strip())
+    if not match:
+        return None
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    delta = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                      minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -delta if sign == '-' else delta
+
+def _address(value: str) -> str:
+    return re.sub(r'^mailto:', '', value.strip(), flags=re.IGNORECASE)
+
+def _utc_iso(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _event_data(properties: List[Tuple[str, Dict[str, str], str, str]], method: str) -> Optional[Dict[str, Any]]:
+    """Converts one VEVENT's properties into the EventData shape CalendarClient consumes."""
+    first = {}
+    for name, params, value, _ in properties:
+        first.setdefault(name, (params, value))
+    if 'DTSTART' not in first:
+        return None
+
+    start = _parse_datetime(first['DTSTART'][1], first['DTSTART'][0])
+    if 'DTEND' in first:
+        end = _parse_datetime(first['DTEND'][1], first['DTEND'][0])
+    elif 'DURATION' in first and _parse_duration(first['DURATION'][1]) is not None:
+        end = start + _parse_duration(first['DURATION'][1])
+    else:
+        # RFC 5545: a DATE start lasts one day, a DATE-TIME start is instantaneous.
+        end = start + timedelta(days=1) if not isinstance(start, datetime) else start
+
+    organizer = _address(first['ORGANIZER'][1]) if 'ORGANIZER' in first else None
+    attendees = [_address(value) for name, _, value, _ in properties if name == 'ATTENDEE']
+    status = first.get('STATUS', ({}, ''))[1].upper()
+    recurrence_id = None
+    if 'RECURRENCE-ID' in first:
+        # An override of one occurrence, identified by its original start.
+        original = _parse_datetime(first['RECURRENCE-ID'][1], first['RECURRENCE-ID'][0])
+        recurrence_id = _utc_iso(original) if isinstance(original, datetime) else original.isoformat()
+
+    event = {
+        'title': _unescape(first.get('SUMMARY', ({}, 'New Event'))[1]),
+        'location': _unescape(first.get('LOCATION', ({}, ''))[1]),
+        'description': _unescape(first.get('DESCRIPTION', ({}, ''))[1]),
+        'attendees': [a for a in attendees if a and a.lower() != (organizer or '').lower()],
+        'organizer': organizer,
+        'uid': first.get('UID', ({}, None))[1],
+        'sequence': int(first.get('SEQUENCE', ({}, '0'))[1] or 0),
+        'recurrence': [raw for name, _, _, raw in properties if name in RECURRENCE_PROPERTIES],
+        'recurrenceId': recurrence_id,
+        'cancelled': method == 'CANCEL' or status == 'CANCELLED',
+    }
+
+    if isinstance(start, datetime):
+        event['startDateTime'] = _utc_iso(start)
+        event['endDateTime'] = _utc_iso(end if isinstance(end, datetime) else start)
+        # Recurrences are expanded in this zone, so DST shifts stay correct.
+        tzid = first['DTSTART'][0].get('TZID')
+        if tzid and isinstance(start.tzinfo, ZoneInfo):
+            event['timeZone'] = start.tzinfo.key
+    else:
+        event['allDay'] = True
+        event['startDate'] = start.isoformat()
+        event['endDate'] = (end if isinstance(end, date) and not isinstance(end, datetime) else start + timedelta(days=1)).isoformat()
+    return event
+
+def parse_ics(text: str) -> Dict[str, Any]:
+    """
+    Parses an iCalendar (RFC 5545) document.
+
+    Handles TZID (IANA and common Windows names), DATE and DATE-TIME values,
+    DURATION, RRULE/EXDATE/RDATE, RECURRENCE-ID, ORGANIZER/ATTENDEE and
+    METHOD:CANCEL.
+
+    Returns:
+        Dictionary with 'method' (e.g. "REQUEST", "CANCEL", "REPLY", or ""
+        when absent) and 'events', a list of EventData dicts with extra
+        'uid', 'sequence', 'organizer', 'recurrence', 'recurrenceId' (the
+        overridden occurrence's original start, UTC "...Z" or a date, else
+        None) and 'cancelled' keys.
+    """
+    method = ''
+    events: List[Dict[str, Any]] = []
+    stack: List[str] = []
+    current: Optional[List[Tuple[str, Dict[str, str], str, str]]] = None
+
+    for line in _unfold(text):
+        name, params, value = _parse_line(line)
+        if name == 'BEGIN':
+            stack.append(value.upper())
+            if stack[-1] == 'VEVENT':
+                current = []
+        elif name == 'END':
+            component = stack.pop() if stack else ''
+            if component == 'VEVENT' and current is not None:
+                events.append(current)
+                current = None
+        elif stack and stack[-1] == 'VCALENDAR' and name == 'METHOD':
+            method = value.strip().upper()
+        elif stack and stack[-1] == 'VEVENT' and current is not None:
+            current.append((name, params, value, line))
+
+    parsed = []
+    for properties in events:
+        try:
+            event = _event_data(properties, method)
+        except ValueError as e:
+            print(f"Skipping unparseable VEVENT: {e}")
+            continue
+        if event:
+            parsed.append(event)
+    return {'method': method, 'events': parsed}
@@ -0,0 +1,116 @@
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional
+
+LEDGER_FILE = 'processed_ledger.db'
+
+# Entries older than this are forgotten. Gmail history checkpoints expire
+# after about a week, so a month comfortably covers any full resync.
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_MAX_ENTRIES = 50000
+
+class ProcessedLedger:
+    """
+    Durable SQLite record of Gmail messages the agent has already handled.
+
+    The agent checks the ledger before sending an email to the LLM, so emails
+    left unread on purpose (no event detected) are not extracted again on every
+    poll or after a server restart.
+    """
+
+    def __init__(self, path: str = LEDGER_FILE, retention_days: float = DEFAULT_RETENTION_DAYS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.retention_seconds = retention_days * 24 * 60 * 60
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS processed ("
+                "message_id TEXT PRIMARY KEY, outcome TEXT NOT NULL, processed_at REAL NOT NULL, detail TEXT)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(processed)")}
+            if "detail" not in columns:
+                # Ledgers created before outcomes carried a detail column.
+                self._conn.execute("ALTER TABLE processed ADD COLUMN detail TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS processed_at_idx ON processed (processed_at)")
+        self.prune()
+
+    def get(self, message_id: str) -> Optional[str]:
+        """Returns the recorded outcome for a message, or None if it was never processed."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT outcome FROM processed WHERE message_id = ?", (message_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def __contains__(self, message_id: str) -> bool:
+        return self.get(message_id) is not None
+
+    def filter_unprocessed(self, message_ids: Iterable[str]) -> List[str]:
+        """Returns the given IDs that are not in the ledger, preserving order."""
+        message_ids = list(message_ids)
+        if not message_ids:
+            return []
+        seen = set()
+        # Stay well below SQLite's bound-parameter limit.
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT message_id FROM processed WHERE message_id IN ({placeholders})", chunk
+                ).fetchall()
+            seen.update(row[0] for row in rows)
+        return [message_id for message_id in message_ids if message_id not in seen]
+
+    def get_detail(self, message_id: str) -> Optional[str]:
+        """Returns the free-form detail recorded with a message's outcome, if any."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT detail FROM processed WHERE message_id = ?", (message_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def record(self, message_id: str, outcome: str, detail: Optional[str] = None):
+        """
+        Records (or overwrites) the outcome of processing a message.
+
+        Args:
+            message_id: Gmail message ID.
+            outcome: Short outcome label, e.g. "event_created" or "no_event".
+            detail: Optional explanation, e.g. why the pre-filter skipped it.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO processed (message_id, outcome, processed_at, detail) VALUES (?, ?, ?, ?)",
+                (message_id, outcome, time.time(), detail)
+            )
+
+    def prune(self) -> int:
+        """
+        Applies the retention policy: drops entries older than the retention
+        window, then the oldest entries beyond max_entries.
+
+        Returns:
+            Number of entries removed.
+        """
+        cutoff = time.time() - self.retention_seconds
+        with self._lock, self._conn:
+            removed = self._conn.execute("DELETE FROM processed WHERE processed_at < ?", (cutoff,)).rowcount
+            removed += self._conn.execute(
+                "DELETE FROM processed WHERE message_id IN ("
+                "SELECT message_id FROM processed ORDER BY processed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+        return removed
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM processed").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,354 @@
+import asyncio
+import heapq
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import httplib2
+
+from src.agent import Agent
+from src.backfill import Backfill
+from src.calendar_client import CalendarClient, SCOPES as CALENDAR_SCOPES, SERVICE_ACCOUNT_FILE
+from src.discovery import build_service
+from src.email_store import EmailStore
+from src.extraction_cache import ExtractionCache
+from src.gmail_client import GmailClient, load_credentials
+from src.ledger import ProcessedLedger
+from src.metrics import count_error
+from src.ratelimit import GMAIL_UNITS_PER_SECOND, RateLimiter, TokenBucket
+from src.work_queue import WorkQueue
+
+# Registered accounts: {account_id: {"token_file": ..., "calendar_id": ...}}.
+ACCOUNTS_FILE = 'accounts.json'
+# Per-account sync checkpoint, ledger, work queue, email store and backfill state.
+ACCOUNTS_DIR = 'accounts'
+# Gmail OAuth tokens of registered accounts. Accounts added through the API
+# can only name a file in here, since refreshed tokens are written back to it.
+TOKENS_DIR = os.getenv('TOKENS_DIR', 'tokens')
+
+# Poll cycles running at once across all accounts; the rest wait their turn.
+DEFAULT_MAX_CONCURRENT_POLLS = 8
+# LLM calls in flight across all accounts.
+DEFAULT_EXTRACTION_CONCURRENCY = 16
+DEFAULT_IO_WORKERS = 16
+
+ACCOUNT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.@+-]{1,128}$')
+TOKEN_FILE_PATTERN = re.compile(r'^[A-Za-z0-9_.@+-]{1,128}\.json$')
+# "primary", an address, or a generated ID such as abc123@group.calendar.google.com.
+CALENDAR_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.@+#-]{1,256}$')
+
+class AgentManager:
+    """
+    Runs the agents of many mailboxes from one process.
+
+    Accounts share one event loop, one I/O thread pool (and with it the
+    per-thread HTTP connections), one Gmail and one Calendar service object,
+    the extraction cache and the Calendar and OpenAI quotas. Gmail's quota is
+    per user, so each account has its own Gmail limiter. An idle account
+    costs an Agent object, three SQLite handles (ledger, work queue and email
+    store) and a heap entry; it has no thread of its own.
+
+    Polls are scheduled from a heap ordered by each account's next poll
+    time. At most max_concurrent_polls cycles run at once and the earliest
+    due account always goes next, so a busy mailbox cannot starve the others;
+    each account keeps its own adaptive interval.
+    """
+
+    def __init__(self, accounts_file: str = ACCOUNTS_FILE, data_dir: str = ACCOUNTS_DIR, tokens_dir: str = TOKENS_DIR,
+                 poll_interval: int = 60, max_concurrent_polls: int = DEFAULT_MAX_CONCURRENT_POLLS,
+                 extraction_concurrency: int = DEFAULT_EXTRACTION_CONCURRENCY, io_workers: int = DEFAULT_IO_WORKERS):
+        self.accounts_file = accounts_file
+        self.data_dir = data_dir
+        self.tokens_dir = tokens_dir
+        self.poll_interval = poll_interval
+        self.max_concurrent_polls = max_concurrent_polls
+        self.extraction_concurrency = extraction_concurrency
+        self.io_workers = io_workers
+        self.accounts: Dict[str, Dict[str, Any]] = self._load_accounts()
+        # Agents of started accounts only; stopped accounts hold no resources.
+        self.agents: Dict[str, Agent] = {}
+        self.extraction_cache: Optional[ExtractionCache] = None
+        self.io_pool: Optional[ThreadPoolExecutor] = None
+        self._gmail_service = None
+        self._calendar_service = None
+        self._calendar_creds = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._services_lock = threading.Lock()
+        # (due, account_id) entries; _due holds the live one per account, so
+        # rescheduling an account just pushes a new entry.
+        self._heap: List[Tuple[float, str]] = []
+        self._due: Dict[str, float] = {}
+        self._polling: Set[str] = set()
+        # Accounts asked to sync while a cycle of theirs was running.
+        self._rerun: Set[str] = set()
+
+    def _load_accounts(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.accounts_file):
+            return {}
+        with open(self.accounts_file) as f:
+            return json.load(f)
+
+    def _save_accounts(self):
+        with open(self.accounts_file, 'w') as f:
+            json.dump(self.accounts, f, indent=2)
+
+    def add_account(self, account_id: str, token_file: str, calendar_id: str):
+        """
+        Registers (or updates) an account.
+
+        Args:
+            account_id: Name used in endpoints and for the account's data directory.
+            token_file: File name of the user's saved Gmail OAuth token in
+                tokens_dir; paths are rejected.
+            calendar_id: Calendar that receives the account's events; the
+                service account must have write access to it.
+
+        Raises:
+            ValueError: If an argument is malformed or token_file is not a plain .json file name.
+        """
+        if not ACCOUNT_ID_PATTERN.match(account_id) or account_id in ('.', '..'):
+            raise ValueError(f"Invalid account ID: {account_id!r}")
+        if not TOKEN_FILE_PATTERN.match(token_file):
+            raise ValueError(f"Invalid token file: {token_file!r}; expected a .json file name in {self.tokens_dir}")
+        if not CALENDAR_ID_PATTERN.match(calendar_id):
+            raise ValueError(f"Invalid calendar ID: {calendar_id!r}")
+        with self._lock:
+            self.accounts[account_id] = {'token_file': os.path.join(self.tokens_dir, token_file),
+                                         'calendar_id': calendar_id}
+            self._save_accounts()
+
+    def _ensure_started(self):
+        """Starts the shared loop and pools on first use."""
+        if self._thread is not None:
+            return
+        self.io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="manager-io")
+        os.makedirs(self.data_dir, exist_ok=True)
+        # Keyed by email content, so it is safely shared by all accounts.
+        self.extraction_cache = ExtractionCache(os.path.join(self.data_dir, 'extraction_cache.db'))
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="agent-manager")
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._schedule(ready), self._loop)
+        ready.wait()
+
+    def _shared_services(self):
+        """One Gmail and one Calendar service for all accounts; each request carries the account's credentials."""
+        # Accounts are built concurrently, outside self._lock.
+        with self._services_lock:
+            if self._gmail_service is None:
+                self._gmail_service = build_service('gmail', 'v1', http=httplib2.Http())
+            if self._calendar_service is None:
+                from google.oauth2 import service_account
+
+                self._calendar_creds = service_account.Credentials.from_service_account_file(
+                    SERVICE_ACCOUNT_FILE, scopes=CALENDAR_SCOPES
+                )
+                self._calendar_service = build_service('calendar', 'v3', http=httplib2.Http())
+            return self._gmail_service, self._calendar_service
+
+    def _build_agent(self, account_id: str) -> Agent:
+        config = self.accounts[account_id]
+        directory = os.path.join(self.data_dir, account_id)
+        os.makedirs(directory, exist_ok=True)
+        creds = load_credentials(config['token_file'])
+        if creds is None:
+            raise RuntimeError(f"No usable Gmail token in {config['token_file']}; the user must sign in again.")
+        gmail_service, calendar_service = self._shared_services()
+
+        agent = Agent(poll_interval=config.get('poll_interval', self.poll_interval))
+        agent.io_pool = self.io_pool
+        agent.extraction_slots = self._extraction_slots
+        agent.extraction_cache = self.extraction_cache
+        try:
+            # Gmail's 250 units/s is a per-user quota, and a Retry-After from one
+            # mailbox must not hold back the others.
+            limiter = RateLimiter(f"gmail:{account_id}", {"units": TokenBucket(GMAIL_UNITS_PER_SECOND)})
+            agent.gmail_client = GmailClient(service=gmail_service, credentials=creds, token_file=config['token_file'],
+                                             sync_state_file=os.path.join(directory, 'gmail_sync.json'), limiter=limiter)
+            agent.calendar_client = CalendarClient(service=calendar_service, calendar_id=config['calendar_id'],
+                                                   credentials=self._calendar_creds)
+            agent.ledger = ProcessedLedger(os.path.join(directory, 'processed_ledger.db'))
+            agent.work_queue = WorkQueue(os.path.join(directory, 'work_queue.db'))
+            agent.email_store = EmailStore(os.path.join(directory, 'recent_emails.db'))
+            agent.backfill = Backfill(agent.gmail_client, agent.work_queue, agent.ledger,
+                                      on_queued=lambda: self.request_sync(account_id),
+                                      state_file=os.path.join(directory, 'gmail_backfill.json'))
+            agent.initialize_clients()
+        except Exception:
+            # Do not leak the stores opened before the failure.
+            self._close(agent)
+            raise
+        return agent
+
+    def start_account(self, account_id: str) -> bool:
+        """
+        Starts polling an account. Returns False if it was already running.
+
+        Raises:
+            KeyError: If the account is not registered.
+        """
+        if account_id not in self.accounts:
+            raise KeyError(account_id)
+        self._ensure_started()
+        if account_id in self.agents:
+            return False
+        # Loading credentials and opening the stores can be slow; other
+        # accounts and the scheduler must not wait for it.
+        agent = self._build_agent(account_id)
+        with self._lock:
+            started = account_id not in self.agents
+            if started:
+                agent.work_queue.recover()
+                agent.running = True
+                agent.status = "Running"
+                self.agents[account_id] = agent
+        if not started:
+            # Started concurrently by another caller.
+            self._close(agent)
+            return False
+        agent.backfill.resume()
+        self.request_sync(account_id)
+        print(f"Started account {account_id}.")
+        return True
+
+    def stop_account(self, account_id: str) -> bool:
+        """Stops polling an account and releases its resources. Returns False if it was not running."""
+        with self._lock:
+            agent = self.agents.pop(account_id, None)
+        if agent is None:
+            return False
+        # Workers stop taking jobs; a cycle in flight finishes its current ones.
+        agent.running = False
+        agent.status = "Stopped"
+        agent.backfill.stop()
+        self._loop.call_soon_threadsafe(self._unschedule, account_id, agent)
+        print(f"Stopped account {account_id}.")
+        return True
+
+    def request_sync(self, account_id: str):
+        """Polls an account as soon as a slot is free."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._push, account_id, time.monotonic())
+
+    def status(self, account_id: str) -> Dict[str, Any]:
+        if account_id not in self.accounts:
+            raise KeyError(account_id)
+        agent = self.agents.get(account_id)
+        if agent is None:
+            return {"status": "Stopped", "running": False}
+        due = self._due.get(account_id)
+        return {
+            "status": agent.status,
+            "running": agent.running,
+            "stats": agent.stats,
+            "poll_interval": agent.scheduler.interval,
+            "next_poll_in": max(0.0, due - time.monotonic()) if due is not None else None,
+            "queue": agent.work_queue.counts(),
+            "gmail_rate_limit": dict(agent.gmail_client.limiter.stats),
+        }
+
+    def shutdown(self):
+        """Stops every account and the shared loop."""
+        for account_id in list(self.agents):
+            self.stop_account(account_id)
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._cancel_tasks(), self._loop).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+            self._loop = self._thread = None
+        if self.io_pool is not None:
+            self.io_pool.shutdown(wait=False)
+
+    # The methods below run on the shared loop.
+
+    def _push(self, account_id: str, due: float):
+        if account_id not in self.agents:
+            return
+        if account_id in self._polling:
+            if due <= time.monotonic():
+                self._rerun.add(account_id)
+            return
+        if account_id in self._due and self._due[account_id] <= due:
+            return
+        self._due[account_id] = due
+        heapq.heappush(self._heap, (due, account_id))
+        self._wakeup.set()
+
+    def _unschedule(self, account_id: str, agent: Agent):
+        self._due.pop(account_id, None)
+        if account_id not in self._polling:
+            self._close(agent)
+
+    async def _cancel_tasks(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _close(self, agent: Agent):
+        for store in (agent.ledger, agent.work_queue, agent.email_store):
+            if store is not None:
+                store.close()
+
+    async def _schedule(self, ready: threading.Event):
+        """Starts the cycles of due accounts, earliest first, within max_concurrent_polls."""
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_concurrent_polls)
+        self._extraction_slots = asyncio.Semaphore(self.extraction_concurrency)
+        ready.set()
+        while True:
+            while self._heap and self._heap[0][0] <= time.monotonic():
+                due, account_id = heapq.heappop(self._heap)
+                if self._due.get(account_id) != due:
+                    # Superseded by an earlier wake-up, or unscheduled.
+                    continue
+                await self._slots.acquire()
+                del self._due[account_id]
+                self._polling.add(account_id)
+                asyncio.ensure_future(self._poll(account_id))
+
+            self._wakeup.clear()
+            # A timer rather than wait_for: on Python 3.11, wait_for can
+            # swallow a cancellation that races with its timeout, which left
+            # shutdown waiting on this task forever.
+            timer = None
+            if self._heap:
+                delay = max(0.0, self._heap[0][0] - time.monotonic())
+                timer = asyncio.get_running_loop().call_later(delay, self._wakeup.set)
+            try:
+                await self._wakeup.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+    async def _poll(self, account_id: str):
+        agent = self.agents.get(account_id)
+        delay = float(self.poll_interval)
+        try:
+            if agent is not None and agent.running:
+                found = await agent.run_cycle()
+                delay = agent.next_poll_delay(found)
+        except Exception as e:
+            print(f"Error polling account {account_id}: {e}")
+            count_error("poll", e)
+            agent.status = f"Error: {e}"
+        finally:
+            self._slots.release()
+            self._polling.discard(account_id)
+            if account_id in self._rerun:
+                self._rerun.discard(account_id)
+                delay = 0.0
+
+        if self.agents.get(account_id) is agent and agent is not None:
+            self._push(account_id, time.monotonic() + delay)
+        elif agent is not None:
+            # Stopped while this cycle ran.
+            self._close(agent)
@@ -0,0 +1,182 @@
+import copy
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Latency buckets in seconds, from a cached lookup to a slow batched LLM call.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Content type of the Prometheus text exposition format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class _Metric:
+    """A named family of samples, one per combination of label values."""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _label_text(self, key: Tuple[str, ...], extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            # Histogram samples are mutable lists; render a consistent copy.
+            items = sorted(copy.deepcopy(self._values).items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key: Tuple[str, ...], value: Any) -> List[str]:
+        return [f"{self.name}{self._label_text(key)} {_number(value)}"]
+
+class Counter(_Metric):
+    """A total that only goes up, e.g. requests or tokens."""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Gauge(_Metric):
+    """A current level, e.g. queue depth."""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Histogram(_Metric):
+    """Observed durations, counted into cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [cumulative count per bucket, sum, count]
+            sample = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample[0][i] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observes how long the with-block takes, including when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        """Number of observations so far."""
+        with self._lock:
+            sample = self._values.get(self._key(labels))
+            return sample[2] if sample else 0
+
+    def _samples(self, key: Tuple[str, ...], value: Any) -> List[str]:
+        counts, total, observations = value
+        lines = [f"{self.name}_bucket{self._label_text(key, [('le', _number(bound))])} {count}"
+                 for bound, count in zip(self.buckets, counts)]
+        lines.append(f"{self.name}_bucket{self._label_text(key, [('le', '+Inf')])} {observations}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {_number(total)}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {observations}")
+        return lines
+
+class Registry:
+    """The metrics exposed at /metrics."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def on_collect(self, collector: Callable[[], None]):
+        """Runs collector before every render, to refresh gauges read from elsewhere (e.g. queue depth)."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def count_error(operation: str, error: Any):
+    """Counts a failure under its exception class ("Error" for plain messages)."""
+    ERRORS.inc(operation=operation, error=type(error).__name__ if isinstance(error, BaseException) else 'Error')
+
+REGISTRY = Registry()
+
+# Time spent in each external call the pipeline makes: gmail_list,
+# gmail_get, extraction, calendar_insert and label_modify.
+OPERATION_SECONDS = REGISTRY.register(Histogram(
+    'agent_operation_seconds', 'Latency of Gmail, OpenAI and Calendar calls by operation.', ['operation']))
+POLL_CYCLE_SECONDS = REGISTRY.register(Histogram(
+    'agent_poll_cycle_seconds', 'Duration of a poll cycle: listing new mail and draining the pipeline.',
+    buckets=DEFAULT_BUCKETS + (120.0, 300.0, 600.0)))
+INTENTS = REGISTRY.register(Counter(
+    'agent_intents_total', 'Extraction results by detected intent.', ['intent']))
+ERRORS = REGISTRY.register(Counter(
+    'agent_errors_total', 'Failures by operation and error class.', ['operation', 'error']))
+OPENAI_TOKENS = REGISTRY.register(Counter(
+    'agent_openai_tokens_total', 'OpenAI tokens billed, from response usage.', ['kind']))
+OPENAI_REQUESTS = REGISTRY.register(Counter(
+    'agent_openai_requests_total', 'OpenAI chat completion requests that returned a response.'))
+EVENTS_CREATED = REGISTRY.register(Counter(
+    'agent_events_created_total', 'Calendar events created or updated.'))
+QUEUE_JOBS = REGISTRY.register(Gauge(
+    'agent_queue_jobs', 'Work queue jobs by stage and state.', ['stage', 'state']))
@@ -0,0 +1,122 @@
+import base64
+import codecs
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Upper bound on body bytes decoded per message. Newsletters can carry
+# megabytes of HTML; the model never sees more than a few kilobytes of it.
+DEFAULT_MAX_BYTES = 256 * 1024
+
+_CHARSET = re.compile(r'charset\s*=\s*"?([^";\s]+)', re.IGNORECASE)
+
+def _header(part: Dict[str, Any], name: str) -> str:
+    name = name.lower()
+    return next((h['value'] for h in part.get('headers', []) if h['name'].lower() == name), '')
+
+def _charset(part: Dict[str, Any]) -> str:
+    """Returns the part's declared charset if Python knows it, else utf-8."""
+    match = _CHARSET.search(_header(part, 'Content-Type'))
+    if match:
+        try:
+            return codecs.lookup(match.group(1)).name
+        except LookupError:
+            pass
+    return 'utf-8'
+
+def _is_attachment(part: Dict[str, Any]) -> bool:
+    return bool(part.get('filename')) or 'attachment' in _header(part, 'Content-Disposition').lower()
+
+def _decode(part: Dict[str, Any], limit: int) -> Tuple[str, int, bool]:
+    """
+    Decodes at most limit bytes of a part's base64url body, so oversized parts
+    are never decoded in full.
+
+    Returns:
+        Tuple of (text, bytes decoded, whether the limit cut the body).
+    """
+    data = part.get('body', {}).get('data', '')
+    if limit <= 0 or not data:
+        return '', 0, bool(data)
+    # Four base64 characters carry three bytes.
+    truncated = len(data) > ((limit + 2) // 3) * 4
+    data = data[:((limit + 2) // 3) * 4]
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))[:limit]
+    # errors='replace' covers mislabelled charsets and a multi-byte character
+    # cut in half by the limit.
+    return raw.decode(_charset(part), errors='replace'), len(raw), truncated
+
+def extract_bodies(payload: Dict[str, Any], max_bytes: int = DEFAULT_MAX_BYTES) -> Dict[str, Any]:
+    """
+    Walks a Gmail message payload and extracts its readable bodies.
+
+    Nested multipart trees are traversed iteratively. text/plain is preferred;
+    text/html is decoded only when the message has no plain-text part.
+    Attachments are never decoded, except that text/calendar parts (inline or
+    small .ics attachments carried inline) are returned separately; .ics
+    attachments stored out of line are listed by attachment ID instead.
+
+    Args:
+        payload: The message's 'payload' from the Gmail API (format=full).
+        max_bytes: Maximum bytes of text/html body decoded for the message.
+
+    Returns:
+        Dictionary with 'text', 'html', 'calendar', 'calendar_attachments'
+        (list of {'attachment_id', 'filename'}), 'skipped_attachments' and
+        'truncated' (True if the byte cap cut the body).
+    """
+    plain_parts: List[Dict[str, Any]] = []
+    html_parts: List[Dict[str, Any]] = []
+    calendar_parts: List[Dict[str, Any]] = []
+    calendar_attachments: List[Dict[str, str]] = []
+    skipped_attachments = 0
+
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        mime_type = part.get('mimeType', '').lower()
+        if mime_type.startswith('multipart/'):
+            # Reversed so parts are visited in document order.
+            stack.extend(reversed(part.get('parts', [])))
+            continue
+
+        filename = part.get('filename', '')
+        is_calendar = mime_type == 'text/calendar' or filename.lower().endswith('.ics')
+        if is_calendar:
+            if part.get('body', {}).get('data'):
+                calendar_parts.append(part)
+            elif part.get('body', {}).get('attachmentId'):
+                calendar_attachments.append({'attachment_id': part['body']['attachmentId'], 'filename': filename})
+        elif _is_attachment(part):
+            skipped_attachments += 1
+        elif mime_type == 'text/plain':
+            plain_parts.append(part)
+        elif mime_type == 'text/html':
+            html_parts.append(part)
+
+    result = {
+        'text': '',
+        'html': '',
+        'calendar': '\n'.join(_decode(part, max_bytes)[0] for part in calendar_parts),
+        'calendar_attachments': calendar_attachments,
+        'skipped_attachments': skipped_attachments,
+        'truncated': False,
+    }
+
+    key, parts = ('text', plain_parts) if plain_parts else ('html', html_parts)
+    chunks = []
+    remaining = max_bytes
+    for part in parts:
+        if remaining <= 0:
+            result['truncated'] = True
+            break
+        text, used, truncated = _decode(part, remaining)
+        chunks.append(text)
+        remaining -= used
+        result['truncated'] = result['truncated'] or truncated
+    result[key] = '\n'.join(chunks)
+    return result
+
+def decode_attachment(data: str, charset: Optional[str] = None) -> str:
+    """Decodes base64url attachment data fetched with messages.attachments.get."""
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    return raw.decode(charset or 'utf-8', errors='replace')
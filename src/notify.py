@@ -0,0 +1,51 @@
+import asyncio
+import threading
+from typing import List, Optional, Tuple
+
+class ChangeNotifier:
+    """
+    Version counter for state shared between the agent's threads and the
+    server's event loop.
+
+    The agent calls publish() whenever something a client displays may have
+    changed; stream handlers await wait() and only then recompute what to
+    send, so an idle agent costs them nothing.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._lock = threading.Lock()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def publish(self):
+        """Bumps the version and wakes every waiter; safe to call from any thread."""
+        with self._lock:
+            self.version += 1
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    async def wait(self, since: int, timeout: Optional[float] = None) -> int:
+        """
+        Waits until the version moves past since, or for at most timeout seconds.
+
+        Returns:
+            The current version; equal to since if the wait timed out.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.version != since:
+                return self.version
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if (loop, future) in self._waiters:
+                    self._waiters.remove((loop, future))
+        return self.version
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,192 @@
+import json
+import re
+import sys
+from typing import Any, Dict, Iterable, List
+
+# Emails scoring below this are treated as having no scheduling signal.
+# A single date or time expression is enough to reach it, so the filter errs
+# towards sending borderline emails to the LLM.
+DEFAULT_THRESHOLD = 2.0
+
+_WEEKDAYS = r'(mon|tue|tues|wed|thu|thur|thurs|fri|sat|sun)(day|nesday|rsday|urday)?'
+_MONTHS = r'(jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?'
+
+DATE_PATTERNS = [
+    re.compile(r'\b' + _WEEKDAYS + r'\b', re.IGNORECASE),
+    re.compile(r'\b' + _MONTHS + r'\s+\d{1,2}(st|nd|rd|th)?\b', re.IGNORECASE),
+    re.compile(r'\b\d{1,2}(st|nd|rd|th)?\s+(of\s+)?' + _MONTHS + r'\b', re.IGNORECASE),
+    re.compile(r'\b\d{4}-\d{2}-\d{2}\b'),
+    re.compile(r'\b\d{1,2}/\d{1,2}(/\d{2,4})?\b'),
+    re.compile(r'\b(today|tonight|tomorrow|next\s+(week|month)|this\s+(week|weekend))\b', re.IGNORECASE),
+]
+
+TIME_PATTERNS = [
+    re.compile(r'\b\d{1,2}(:\d{2})?\s*(a\.?m\.?|p\.?m\.?)(?![a-z])', re.IGNORECASE),
+    re.compile(r'\b([01]?\d|2[0-3]):[0-5]\d\b'),
+    re.compile(r'\b(noon|midnight)\b', re.IGNORECASE),
+]
+
+SCHEDULING_KEYWORDS = re.compile(
+    r'\b(meeting|meet|call|appointment|reservation|reserved|booking|booked|invite|invitation|invited|'
+    r'webinar|conference|workshop|interview|register|registration|registered|rsvp|schedule|scheduled|'
+    r'reschedule|agenda|event|session|kickoff|sync|standup|lunch|dinner|coffee)\b'
+    r'|zoom\.us|meet\.google\.com|teams\.microsoft\.com|calendar',
+    re.IGNORECASE
+)
+
+TRANSACTIONAL_KEYWORDS = re.compile(
+    r'\b(receipt|invoice|order\s*#?|shipped|shipping|delivered|tracking|refund|payment|statement|'
+    r'password|verification code|security alert|sign-?in|unsubscribe|newsletter|digest)\b',
+    re.IGNORECASE
+)
+
+BULK_SENDER = re.compile(
+    r'(no-?reply|do-?not-?reply|newsletter|notifications?|mailer-daemon|marketing|promo(tions)?|digest|news)@',
+    re.IGNORECASE
+)
+
+DATE_WEIGHT = 2.0
+TIME_WEIGHT = 2.0
+KEYWORD_WEIGHT = 1.5
+MAX_KEYWORD_SCORE = 3.0
+BULK_SENDER_PENALTY = 1.0
+TRANSACTIONAL_PENALTY = 1.0
+MAX_TRANSACTIONAL_PENALTY = 2.0
+
+class PreFilter:
+    """
+    Cheap, deterministic check that runs before LLM extraction.
+
+    Scores an email on date/time expressions and scheduling keywords, minus
+    penalties for bulk senders and transactional wording. Emails scoring below
+    the threshold are short-circuited to Intent "None" without an API call.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+
+    def score(self, subject: str, sender: str, body: str) -> Dict[str, Any]:
+        """
+        Scores an email for scheduling signal.
+
+        Returns:
+            Dictionary with 'score' and 'reasons', a list of the signals that
+            contributed to it.
+        """
+        text = f"{subject}\n{body}"
+        score = 0.0
+        reasons: List[str] = []
+
+        date_match = _first_match(DATE_PATTERNS, text)
+        if date_match:
+            score += DATE_WEIGHT
+            reasons.append(f"date expression '{date_match}'")
+
+        time_match = _first_match(TIME_PATTERNS, text)
+        if time_match:
+            score += TIME_WEIGHT
+            reasons.append(f"time expression '{time_match}'")
+
+        keywords = sorted({m.group(0).lower() for m in SCHEDULING_KEYWORDS.finditer(text)})
+        if keywords:
+            score += min(KEYWORD_WEIGHT * len(keywords), MAX_KEYWORD_SCORE)
+            reasons.append(f"scheduling keywords {keywords[:5]}")
+
+        if BULK_SENDER.search(sender or ''):
+            score -= BULK_SENDER_PENALTY
+            reasons.append("bulk sender")
+
+        transactional = sorted({m.group(0).lower() for m in TRANSACTIONAL_KEYWORDS.finditer(text)})
+        if transactional:
+            score -= min(TRANSACTIONAL_PENALTY * len(transactional), MAX_TRANSACTIONAL_PENALTY)
+            reasons.append(f"transactional keywords {transactional[:5]}")
+
+        if not date_match and not time_match:
+            reasons.append("no date or time expression")
+
+        return {"score": score, "reasons": reasons}
+
+    def check(self, email: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Decides whether an email can skip LLM extraction.
+
+        Args:
+            email: Email dict with 'subject', 'sender' and 'body'.
+
+        Returns:
+            The score() result plus 'skip': True when the score is below the threshold.
+        """
+        result = self.score(email.get('subject', ''), email.get('sender', ''), email.get('body', ''))
+        result["skip"] = result["score"] < self.threshold
+        return result
+
+    def triage(self, metadata: Dict[str, Any]) -> bool:
+        """
+        Metadata-only filter for GmailClient's triage phase, run before any
+        body is downloaded.
+
+        Only the subject and headers are known here, so it is stricter about
+        what it rejects than check(): a message is dropped only when it comes
+        from a bulk sender or mailing list (List-Unsubscribe) and its subject
+        has no date, time or scheduling keyword. Calendar invites always pass.
+
+        Returns:
+            True if the full message should be fetched.
+        """
+        if 'text/calendar' in metadata.get('content_type', '').lower():
+            return True
+        subject = metadata.get('subject', '')
+        if (_first_match(DATE_PATTERNS, subject) or _first_match(TIME_PATTERNS, subject)
+                or SCHEDULING_KEYWORDS.search(subject)):
+            return True
+        bulk = bool(metadata.get('list_unsubscribe')) or bool(BULK_SENDER.search(metadata.get('sender', '')))
+        return not bulk
+
+    def evaluate(self, labeled_emails: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Measures the filter against emails labeled with 'is_event'.
+
+        A false negative is an event email the filter would skip; those are
+        the costly mistakes, since the event is never created.
+
+        Returns:
+            Dictionary with counts, 'false_negative_rate', 'skip_rate' (share
+            of non-events skipped) and the subjects of missed events.
+        """
+        events = non_events = false_negatives = skipped_non_events = 0
+        missed: List[str] = []
+        for email in labeled_emails:
+            skip = self.check(email)["skip"]
+            if email["is_event"]:
+                events += 1
+                if skip:
+                    false_negatives += 1
+                    missed.append(email.get('subject', ''))
+            else:
+                non_events += 1
+                if skip:
+                    skipped_non_events += 1
+
+        return {
+            "events": events,
+            "non_events": non_events,
+            "false_negatives": false_negatives,
+            "false_negative_rate": false_negatives / events if events else 0.0,
+            "skip_rate": skipped_non_events / non_events if non_events else 0.0,
+            "missed": missed,
+        }
+
+def _first_match(patterns: List[re.Pattern], text: str):
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            return match.group(0)
+    return None
+
+if __name__ == "__main__":
+    # Evaluate against a labeled fixture file:
+    #   python -m src.prefilter tests/fixtures/prefilter_labeled.json [threshold]
+    with open(sys.argv[1]) as f:
+        fixtures = json.load(f)
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_THRESHOLD
+    print(json.dumps(PreFilter(threshold).evaluate(fixtures), indent=2))
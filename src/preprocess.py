@@ -0,0 +1,200 @@
+import re
+from html import unescape
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional
+
+from src.prefilter import DATE_PATTERNS, TIME_PATTERNS
+
+# Estimated tokens of body text sent to the model per email.
+DEFAULT_TOKEN_BUDGET = 1500
+
+# A reply header ("On Tue, Mar 4, 2025 at 3:00 PM Dana <d@x.com> wrote:") or an
+# Outlook-style separator marks the start of quoted history. Forwarded-message
+# blocks are deliberately kept: they often carry the event itself.
+QUOTE_HEADERS = [
+    re.compile(r'^\s*On .{0,200}wrote:\s*$', re.IGNORECASE),
+    re.compile(r'^\s*-{2,}\s*Original Message\s*-{2,}\s*$', re.IGNORECASE),
+    re.compile(r'^\s*_{10,}\s*$'),
+]
+
+SIGNATURE_MARKERS = [
+    re.compile(r'^-- ?$'),
+    re.compile(r'^\s*Sent from my (iPhone|iPad|Android|mobile|Galaxy|BlackBerry).*$', re.IGNORECASE),
+    re.compile(r'^\s*Get Outlook for (iOS|Android).*$', re.IGNORECASE),
+]
+
+# Explicit legal-footer headings. "This email is ..." phrasing is not used:
+# it opens ordinary messages as often as it opens a disclaimer.
+LEGAL_FOOTERS = re.compile(
+    r'^\s*(CONFIDENTIALITY NOTICE|CONFIDENTIAL(ITY)?:|DISCLAIMER)',
+    re.IGNORECASE
+)
+# A legal footer only ends the body within this many trailing lines.
+LEGAL_FOOTER_MAX_LINES = 20
+
+# Marks text left out by truncation.
+GAP = '[...]'
+# An oversized line is only cut into a window when at least this many tokens are left.
+MIN_CLIP_TOKENS = 50
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token for English text)."""
+    return len(text) // 4 + 1
+
+class _TextExtractor(HTMLParser):
+    """Collects visible text from HTML, with line breaks at block elements."""
+
+    BLOCK_TAGS = {'p', 'div', 'br', 'tr', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'section', 'blockquote'}
+    HIDDEN_TAGS = {'script', 'style', 'head', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._hidden_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.HIDDEN_TAGS:
+            self._hidden_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.HIDDEN_TAGS:
+            self._hidden_depth = max(0, self._hidden_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._hidden_depth:
+            self.parts.append(data)
+
+def html_to_text(html: str) -> str:
+    """Converts an HTML body to plain text, dropping scripts, styles and markup."""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    text = unescape(''.join(parser.parts))
+    lines = [re.sub(r'[ \t\xa0]+', ' ', line).strip() for line in text.splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+def strip_quoted_history(text: str) -> str:
+    """Drops quoted reply history: everything after a reply header, and '>' lines."""
+    kept = []
+    for line in text.splitlines():
+        if any(pattern.match(line) for pattern in QUOTE_HEADERS):
+            break
+        if line.lstrip().startswith('>'):
+            continue
+        kept.append(line)
+    return '\n'.join(kept)
+
+def strip_signature(text: str) -> str:
+    """
+    Drops the signature block and any legal footer.
+
+    A legal footer is only cut in the last LEGAL_FOOTER_MAX_LINES lines and
+    after some kept text, so a message that opens with a "Confidential:"
+    line is not dropped whole.
+    """
+    lines = text.splitlines()
+    has_content = False
+    for i, line in enumerate(lines):
+        if any(pattern.match(line) for pattern in SIGNATURE_MARKERS):
+            return '\n'.join(lines[:i])
+        if has_content and len(lines) - i <= LEGAL_FOOTER_MAX_LINES and LEGAL_FOOTERS.match(line):
+            return '\n'.join(lines[:i])
+        has_content = has_content or bool(line.strip())
+    return text
+
+def _has_date_or_time(line: str) -> bool:
+    return any(p.search(line) for p in DATE_PATTERNS) or any(p.search(line) for p in TIME_PATTERNS)
+
+def _clip_line(line: str, token_budget: int) -> str:
+    """Cuts a line to token_budget tokens, keeping a window around its first date or time."""
+    width = max(0, (token_budget - 1) * 4 - 2 * (len(GAP) + 1))
+    matches = [pattern.search(line) for pattern in DATE_PATTERNS + TIME_PATTERNS]
+    center = min((match.start() for match in matches if match), default=0)
+    start = max(0, min(center - width // 2, len(line) - width))
+    end = start + width
+    return (GAP + ' ' if start else '') + line[start:end] + (' ' + GAP if end < len(line) else '')
+
+def truncate_to_budget(text: str, token_budget: int) -> str:
+    """
+    Shortens text to roughly token_budget tokens.
+
+    Lines carrying a date or time expression (and their immediate neighbours)
+    are kept first; the remaining budget is filled with lines from the top.
+    Kept lines stay in their original order, with "[...]" marking gaps. A
+    line longer than the whole budget (e.g. an unwrapped HTML body) is cut
+    to what is left, around its date or time.
+    """
+    if estimate_tokens(text) <= token_budget:
+        return text
+
+    lines = text.splitlines()
+    priority = []
+    for i, line in enumerate(lines):
+        if _has_date_or_time(line):
+            priority.extend(j for j in (i - 1, i, i + 1) if 0 <= j < len(lines))
+
+    keep = set()
+    used = 0
+    for i in list(dict.fromkeys(priority)) + list(range(len(lines))):
+        if i in keep:
+            continue
+        cost = estimate_tokens(lines[i])
+        if used + cost > token_budget:
+            if cost <= token_budget or token_budget - used < min(MIN_CLIP_TOKENS, token_budget):
+                continue
+            lines[i] = _clip_line(lines[i], token_budget - used)
+            cost = estimate_tokens(lines[i])
+        keep.add(i)
+        used += cost
+
+    output = []
+    previous = -1
+    for i in sorted(keep):
+        if i != previous + 1:
+            output.append(GAP)
+        output.append(lines[i])
+        previous = i
+    if previous != len(lines) - 1:
+        output.append(GAP)
+    return '\n'.join(output)
+
+def preprocess_email_body(body: str, html: Optional[str] = None, token_budget: int = DEFAULT_TOKEN_BUDGET) -> Dict[str, Any]:
+    """
+    Shrinks an email body before it is sent to the model.
+
+    Converts HTML-only bodies to text, strips quoted history, signatures and
+    legal footers, and truncates to token_budget keeping date/time lines.
+
+    Args:
+        body: The text/plain body (may be empty).
+        html: The text/html body, used when there is no plain-text body.
+        token_budget: Estimated tokens to keep.
+
+    Returns:
+        Dictionary with 'text' plus 'original_bytes', 'bytes', 'bytes_saved',
+        'original_tokens', 'tokens' and 'tokens_saved'.
+    """
+    use_html = bool(html) and not body.strip()
+    source = html if use_html else body
+    text = html_to_text(html) if use_html else body
+    text = strip_signature(strip_quoted_history(text))
+    text = re.sub(r'\n{3,}', '\n\n', text).strip()
+    text = truncate_to_budget(text, token_budget)
+
+    original_bytes = len(source.encode())
+    original_tokens = estimate_tokens(source)
+    size = len(text.encode())
+    tokens = estimate_tokens(text)
+    return {
+        "text": text,
+        "original_bytes": original_bytes,
+        "bytes": size,
+        "bytes_saved": original_bytes - size,
+        "original_tokens": original_tokens,
+        "tokens": tokens,
+        "tokens_saved": original_tokens - tokens,
+    }
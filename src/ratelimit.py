@@ -0,0 +1,256 @@
+import asyncio
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+# Gmail API quota units per method (https://developers.google.com/gmail/api/reference/quota).
+# Calls inside a batch request are charged individually.
+GMAIL_QUOTA_UNITS = {
+    'messages.get': 5,
+    'messages.list': 5,
+    'messages.modify': 5,
+    'messages.batchModify': 50,
+    'messages.attachments.get': 5,
+    'threads.get': 10,
+    'history.list': 2,
+    'getProfile': 1,
+}
+# Per-user limit of 250 quota units per second.
+GMAIL_UNITS_PER_SECOND = 250
+
+# Calendar charges one query per call; the per-user default is 600 per minute.
+CALENDAR_REQUESTS_PER_SECOND = 10
+
+# OpenAI limits depend on the account's usage tier, so they are configurable.
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "30000"))
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at rate units per second, up to capacity.
+
+    Callers reserve units up front (the balance may go negative) and then wait
+    out the returned delay, so concurrent callers are served in arrival order
+    instead of racing for refills.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, units: float = 1.0) -> float:
+        """Takes units from the bucket and returns how many seconds the caller must wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # A single call costing more than the capacity still gets through,
+            # after the bucket has fully refilled.
+            self._tokens -= min(units, self.capacity)
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def pause(self, seconds: float):
+        """Holds back every caller for the given time, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+def _status(error: Exception) -> Optional[int]:
+    if isinstance(error, HttpError):
+        return error.resp.status
+    return getattr(error, 'status_code', None)
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Returns the server's Retry-After delay in seconds, if the error carries one."""
+    if isinstance(error, HttpError):
+        headers = error.resp
+    else:
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    value = headers.get('retry-after') or headers.get('Retry-After')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        # HTTP-date form; rare for these APIs, fall back to backoff.
+        return None
+
+def is_retryable(error: Exception) -> bool:
+    """True for throttling (429, Gmail's 403 rate-limit reasons), 5xx and connection failures."""
+    if isinstance(error, (ConnectionError, TimeoutError, socket.timeout)):
+        return True
+    # openai is imported lazily by src.extraction; an OpenAI error implies it is loaded.
+    openai = sys.modules.get('openai')
+    if openai is not None and isinstance(error, openai.APIConnectionError):
+        return True
+    status = _status(error)
+    if status in RETRYABLE_STATUSES:
+        return True
+    if status == 403 and isinstance(error, HttpError):
+        return b'rateLimitExceeded' in (error.content or b'') or b'userRateLimitExceeded' in (error.content or b'')
+    return False
+
+class RateLimiter:
+    """
+    Client-side quota for one API: token buckets (e.g. requests and tokens per
+    minute) that every call draws from, plus retry with exponential backoff
+    and full jitter for throttled and transient failures. Retry-After is
+    honored and pauses all callers of the API, not just the throttled one.
+    """
+
+    def __init__(self, name: str, buckets: Dict[str, TokenBucket], max_retries: int = DEFAULT_MAX_RETRIES,
+                 base_delay: float = DEFAULT_BASE_DELAY, max_delay: float = DEFAULT_MAX_DELAY):
+        self.name = name
+        self.buckets = buckets
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "retries": 0, "throttled": 0, "failures": 0, "wait_seconds": 0.0}
+
+    def _count(self, key: str, amount: float = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _reserve(self, cost: Optional[Dict[str, float]]) -> float:
+        cost = cost if cost is not None else {name: 1 for name in self.buckets}
+        # A limiter without a given bucket (e.g. one with none, in tests) does not limit that unit.
+        wait = max([self.buckets[name].reserve(units) for name, units in cost.items() if name in self.buckets] or [0.0])
+        if wait > 0:
+            self._count("wait_seconds", wait)
+        return wait
+
+    def _backoff(self, error: Exception, attempt: int) -> Optional[float]:
+        """Returns the delay before the next attempt, or None if the error should be raised."""
+        if attempt >= self.max_retries or not is_retryable(error):
+            self._count("failures")
+            return None
+        self._count("retries")
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        server_delay = retry_after(error)
+        if _status(error) == 429 or server_delay is not None:
+            self._count("throttled")
+        if server_delay is not None:
+            delay = server_delay + random.uniform(0, self.base_delay)
+            for bucket in self.buckets.values():
+                bucket.pause(server_delay)
+        print(f"{self.name}: {error.__class__.__name__} ({_status(error)}), retrying in {delay:.1f}s.")
+        return delay
+
+    def acquire(self, cost: Optional[Dict[str, float]] = None):
+        """Blocks until the given units (default: one of each bucket) are available."""
+        wait = self._reserve(cost)
+        if wait > 0:
+            time.sleep(wait)
+
+    def call(self, fn: Callable[..., Any], *args, cost: Optional[Dict[str, float]] = None, **kwargs) -> Any:
+        """Calls fn within the quota, retrying transient failures."""
+        attempt = 0
+        while True:
+            self.acquire(cost)
+            self._count("calls")
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    async def call_async(self, fn: Callable[..., Awaitable[Any]], *args,
+                         cost: Optional[Dict[str, float]] = None, **kwargs) -> Any:
+        """Async variant of call(); waits with asyncio.sleep so the event loop keeps running."""
+        attempt = 0
+        while True:
+            wait = self._reserve(cost)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._count("calls")
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def execute_batch(self, new_batch: Callable[..., Any], requests: Dict[str, Any], http=None,
+                      batch_size: int = 50, units_per_call: float = 1) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+        """
+        Executes googleapiclient requests in batch HTTP requests within the quota.
+
+        Each call in a batch is charged units_per_call. Calls that fail with a
+        retryable error are sent again in a later batch after backoff; the
+        batch request itself is retried like any other call.
+
+        Args:
+            new_batch: The service's new_batch_http_request.
+            requests: Request objects keyed by ID.
+
+        Returns:
+            Tuple of (responses by ID, errors by ID for calls that failed for good).
+        """
+        responses: Dict[str, Any] = {}
+        failed: Dict[str, Exception] = {}
+        pending = list(requests)
+        attempt = 0
+        while pending:
+            retry: Dict[str, Exception] = {}
+
+            def on_response(request_id, response, exception):
+                if exception is None:
+                    responses[request_id] = response
+                elif is_retryable(exception):
+                    retry[request_id] = exception
+                else:
+                    failed[request_id] = exception
+
+            for start in range(0, len(pending), batch_size):
+                chunk = pending[start:start + batch_size]
+                batch = new_batch(callback=on_response)
+                for request_id in chunk:
+                    batch.add(requests[request_id], request_id=request_id)
+                cost = {name: units_per_call * len(chunk) for name in self.buckets}
+                self.call(batch.execute, http=http, cost=cost)
+
+            if not retry:
+                break
+            error = next(iter(retry.values()))
+            delay = self._backoff(error, attempt)
+            if delay is None:
+                failed.update(retry)
+                break
+            time.sleep(delay)
+            attempt += 1
+            pending = list(retry)
+        return responses, failed
+
+GMAIL_LIMITER = RateLimiter("gmail", {"units": TokenBucket(GMAIL_UNITS_PER_SECOND)})
+CALENDAR_LIMITER = RateLimiter("calendar", {"requests": TokenBucket(CALENDAR_REQUESTS_PER_SECOND, 2 * CALENDAR_REQUESTS_PER_SECOND)})
+OPENAI_LIMITER = RateLimiter("openai", {
+    "requests": TokenBucket(OPENAI_RPM / 60, OPENAI_RPM / 60 * 10),
+    "tokens": TokenBucket(OPENAI_TPM / 60, OPENAI_TPM / 6),
+})
+
+def gmail_cost(method: str, calls: int = 1) -> Dict[str, float]:
+    return {"units": GMAIL_QUOTA_UNITS[method] * calls}
+
+def limiter_stats() -> Dict[str, Dict[str, float]]:
+    """Counters for every shared limiter, keyed by API name."""
+    return {limiter.name: dict(limiter.stats) for limiter in (GMAIL_LIMITER, CALENDAR_LIMITER, OPENAI_LIMITER)}
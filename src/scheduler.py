@@ -0,0 +1,48 @@
+import threading
+from typing import Optional
+
+DEFAULT_MIN_INTERVAL = 5.0
+DEFAULT_MAX_INTERVAL = 600.0
+DEFAULT_BACKOFF = 2.0
+
+class PollScheduler:
+    """
+    Decides how long the agent waits between polls, and lets that wait be cut
+    short.
+
+    The interval drops to min_interval as soon as a poll finds new mail (more
+    is likely on the way) and grows by backoff after every idle poll, up to
+    max_interval. wake() ends the current wait at once, for a push
+    notification or a stop request.
+    """
+
+    def __init__(self, interval: float, min_interval: float = DEFAULT_MIN_INTERVAL,
+                 max_interval: float = DEFAULT_MAX_INTERVAL, backoff: float = DEFAULT_BACKOFF):
+        self.min_interval = min(min_interval, interval)
+        self.max_interval = max(max_interval, interval)
+        self.backoff = backoff
+        self.interval = float(interval)
+        self._event = threading.Event()
+
+    def record_poll(self, new_emails: int) -> float:
+        """Updates the interval from the last poll's result and returns it."""
+        if new_emails:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return self.interval
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Sleeps for the current interval (or timeout) unless woken.
+
+        Returns:
+            True if woken early by wake().
+        """
+        woken = self._event.wait(self.interval if timeout is None else timeout)
+        self._event.clear()
+        return woken
+
+    def wake(self):
+        """Ends the current wait immediately; a wake before the wait starts is not lost."""
+        self._event.set()
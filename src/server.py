@@ -2,11 +2,20 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from src.agent import Agent
+from src.email_store import DEFAULT_FEED_SIZE
+from src.manager import AgentManager
+from src.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, QUEUE_JOBS, REGISTRY
+from src.ratelimit import limiter_stats
+from src.work_queue import STAGES, READY, LEASED, DEAD
 import uvicorn
+import hashlib
+import json
 import threading
+from typing import Any, Dict, Optional
 
 app = FastAPI()
 
@@ -20,55 +29,65 @@ app.add_middleware(
 )
 
 # Global Agent Instance
-# Poll every 60 seconds by default
+# Poll every 60 seconds by default; the interval adapts to mail volume.
 agent = Agent(poll_interval=60)
 
-@app.get("/status")
-def get_status():
-    return {"status": agent.status, "running": agent.running}
+# Multi-account mode: accounts registered in accounts.json, each with its own
+# Gmail token and calendar, polled from this process on shared pools.
+manager = AgentManager(poll_interval=60)
 
-@app.post("/start")
-def start_agent(background_tasks: BackgroundTasks):
-    if not agent.running:
-        # The agent.start() method already spawns a thread, so we can call it directly.
-        # However, to be safe and non-blocking for the API, we can use BackgroundTasks 
-        # or just rely on the agent's internal threading.
-        # Agent.start() is non-blocking (spawns thread), so this is fine.
-        agent.start()
-        return {"message": "Agent started"}
-import sys
-import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# An open /events stream gets a comment line this often when nothing changes,
+# so proxies and the browser keep the connection.
+EVENTS_KEEPALIVE_SECONDS = 15
 
-from fastapi import FastAPI, BackgroundTasks
-from fastapi.middleware.cors import CORSMiddleware
-from src.agent import Agent
-import uvicorn
-import threading
+def etag_response(request: Request, content: Any) -> Response:
+    """
+    Returns content as JSON with an ETag, or an empty 304 if the client's
+    If-None-Match already names this exact body.
+    """
+    body = json.dumps(content, sort_keys=True, default=str).encode()
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    if etag in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
-app = FastAPI()
+def status_snapshot() -> Dict[str, Any]:
+    return {
+        "status": agent.status,
+        "running": agent.running,
+        "stats": dict(agent.stats),
+        "poll_interval": agent.scheduler.interval
+    }
 
-# Allow CORS for Chrome Extension
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, restrict this to the extension ID
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def collect_queue_depth():
+    """Sets the queue gauges from the work queues of this agent and every managed account."""
+    # Every series is set, so an emptied stage reads 0 rather than vanishing.
+    totals = {(stage, state): 0 for stage in STAGES for state in (READY, LEASED, DEAD)}
+    for queue_agent in [agent, *list(manager.agents.values())]:
+        if queue_agent.work_queue is None:
+            continue
+        for stage, states in queue_agent.work_queue.counts().items():
+            for state, count in states.items():
+                totals[(stage, state)] = totals.get((stage, state), 0) + count
+    for (stage, state), count in totals.items():
+        QUEUE_JOBS.set(count, stage=stage, state=state)
 
-# Global Agent Instance
-# Poll every 60 seconds by default
-agent = Agent(poll_interval=60)
+REGISTRY.on_collect(collect_queue_depth)
+
+def sse_event(event: str, data: Any, event_id: int) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
 
 @app.post("/start")
 def start_agent(background_tasks: BackgroundTasks):
     if not agent.running:
         # The agent.start() method already spawns a thread, so we can call it directly.
-        # However, to be safe and non-blocking for the API, we can use BackgroundTasks 
+        # However, to be safe and non-blocking for the API, we can use BackgroundTasks
         # or just rely on the agent's internal threading.
         # Agent.start() is non-blocking (spawns thread), so this is fine.
         agent.start()
+        if not agent.running:
+            # Failed to start, or the previous run is still stopping.
+            raise HTTPException(status_code=409, detail=agent.status)
         return {"message": "Agent started"}
     return {"message": "Agent already running"}
 
@@ -79,17 +98,163 @@ def stop_agent():
         return {"message": "Agent stopped"}
     return {"message": "Agent is not running"}
 
+@app.post("/sync")
+def sync():
+    # Wake-up trigger for a push notifier (e.g. a Gmail Pub/Sub push
+    # subscription pointed here) or a local stand-in. Any request body is
+    # ignored; the agent fetches whatever is new.
+    if not agent.running:
+        return {"message": "Agent is not running"}
+    agent.request_sync()
+    return {"message": "Sync requested"}
+
 @app.get("/status")
-async def status():
-    return {
-        "status": agent.status,
-        "running": agent.running,
-        "stats": agent.stats
-    }
+async def status(request: Request):
+    return etag_response(request, status_snapshot())
 
 @app.get("/recent_emails")
-async def recent_emails():
-    return {"emails": agent.recent_emails}
+async def recent_emails(request: Request, limit: int = DEFAULT_FEED_SIZE, cursor: Optional[int] = None,
+                        category: Optional[str] = None, importance: Optional[str] = None,
+                        sender: Optional[str] = None, since: Optional[float] = None):
+    # Important emails, newest first. Pass next_cursor back as cursor for the
+    # next page; category, importance, sender (an address) and since (Unix
+    # time) filter the stored history.
+    if agent.email_store is None:
+        return etag_response(request, {"emails": [], "next_cursor": None})
+    emails, next_cursor = agent.email_store.query(limit=limit, cursor=cursor, category=category,
+                                                  importance=importance, sender=sender, since=since)
+    return etag_response(request, {"emails": emails, "next_cursor": next_cursor})
+
+@app.get("/events")
+async def events(request: Request):
+    # Server-Sent Events stream replacing /status and /recent_emails polling.
+    # The first "status" event carries the whole status and the first "feed"
+    # event the current feed; after that, "status" carries only the fields
+    # that changed and "feed" only emails not sent before. Nothing is sent
+    # while the agent is idle, apart from a keep-alive comment.
+    async def stream():
+        sent_status: Optional[Dict[str, Any]] = None
+        sent_ids = set()
+        version = -1
+        while not await request.is_disconnected():
+            changed = await agent.changes.wait(version, timeout=EVENTS_KEEPALIVE_SECONDS)
+            if changed == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = changed
+            first = sent_status is None
+
+            current = status_snapshot()
+            delta = {key: value for key, value in current.items()
+                     if sent_status is None or sent_status.get(key) != value}
+            if delta:
+                sent_status = current
+                yield sse_event("status", delta, version)
+
+            emails = agent.email_store.recent() if agent.email_store is not None else []
+            new_emails = [email for email in emails if email.get('id') not in sent_ids]
+            # Only ids still in the feed need remembering; older ones never return.
+            sent_ids = {email.get('id') for email in emails}
+            if new_emails or first:
+                yield sse_event("feed", {"emails": new_emails}, version)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/queue")
+async def queue(request: Request):
+    # Jobs per pipeline stage and state, and the jobs that ran out of attempts.
+    if agent.work_queue is None:
+        return etag_response(request, {"counts": {}, "dead_letters": []})
+    return etag_response(request, {"counts": agent.work_queue.counts(),
+                                   "dead_letters": agent.work_queue.dead_letters()})
+
+@app.post("/queue/{job_id}/requeue")
+def requeue(job_id: str):
+    if agent.work_queue is None or not agent.work_queue.requeue(job_id):
+        return {"message": "No such dead letter"}
+    agent.request_sync()
+    return {"message": "Job requeued"}
+
+@app.post("/backfill")
+def start_backfill(after: str, before: Optional[str] = None):
+    # Scans mail received from `after` up to `before` (YYYY-MM-DD) for events,
+    # next to live polling. Re-posting the same range resumes it.
+    if not agent.running:
+        return {"message": "Agent is not running"}
+    try:
+        return agent.backfill.start(after, before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Dates must be YYYY-MM-DD: {e}")
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/backfill")
+async def backfill_status(request: Request):
+    if agent.backfill is None:
+        return etag_response(request, {"state": "idle"})
+    return etag_response(request, agent.backfill.status())
+
+@app.post("/backfill/stop")
+def stop_backfill():
+    if agent.backfill is None or not agent.backfill.running:
+        return {"message": "No backfill running"}
+    agent.backfill.stop()
+    return {"message": "Backfill paused"}
+
+@app.get("/accounts")
+async def list_accounts(request: Request):
+    return etag_response(request, {"accounts": {account_id: manager.status(account_id)
+                                                for account_id in manager.accounts}})
+
+@app.post("/accounts/{account_id}")
+def add_account(account_id: str, token_file: str, calendar_id: str):
+    try:
+        manager.add_account(account_id, token_file, calendar_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Account saved"}
+
+@app.post("/accounts/{account_id}/start")
+def start_account(account_id: str):
+    try:
+        started = manager.start_account(account_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown account")
+    except (RuntimeError, FileNotFoundError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": "Account started" if started else "Account already running"}
+
+@app.post("/accounts/{account_id}/stop")
+def stop_account(account_id: str):
+    if manager.stop_account(account_id):
+        return {"message": "Account stopped"}
+    return {"message": "Account is not running"}
+
+@app.post("/accounts/{account_id}/sync")
+def sync_account(account_id: str):
+    if account_id not in manager.agents:
+        return {"message": "Account is not running"}
+    manager.request_sync(account_id)
+    return {"message": "Sync requested"}
+
+@app.get("/accounts/{account_id}/status")
+async def account_status(account_id: str):
+    try:
+        return manager.status(account_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown account")
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus scrape target: call latencies, intents, errors, OpenAI
+    # tokens, queue depth and poll-cycle durations, summed over all accounts.
+    return PlainTextResponse(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/rate_limits")
+async def rate_limits(request: Request):
+    # Calls, retries, throttled responses and time spent waiting, per API.
+    return etag_response(request, limiter_stats())
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,137 @@
+import threading
+import time
+import weakref
+from datetime import timezone
+from typing import Any, Callable, List, Optional
+
+import httplib2
+import google_auth_httplib2
+
+# Access tokens are refreshed this long before they expire. google-auth
+# itself refreshes inside a request once a token is within about four
+# minutes of expiry, so this must be larger for requests never to wait.
+REFRESH_MARGIN = 300.0
+# Wait after a failed background refresh; if the token expires meanwhile,
+# the next request refreshes it inline as before.
+REFRESH_RETRY_DELAY = 30.0
+
+_local = threading.local()
+
+def shared_http() -> httplib2.Http:
+    """
+    Returns this thread's httplib2.Http, shared by every API client and account.
+
+    httplib2 connections are not thread-safe, so there is one per thread.
+    Clients wrap it in their own AuthorizedHttp, which only adds the
+    account's Authorization header, so the keep-alive connections to
+    Google's API hosts are reused across accounts instead of opened per
+    account.
+    """
+    http = getattr(_local, 'http', None)
+    if http is None:
+        http = _local.http = httplib2.Http()
+    return http
+
+class TokenRefresher:
+    """
+    Refreshes the access tokens of registered credentials on a background
+    thread, shortly before they expire.
+
+    Left alone, google-auth refreshes an expired token inside the request
+    that finds it, so once an hour a poll stalls on the token endpoint (and
+    every I/O thread that hits it at once refreshes too). Credentials are
+    held weakly, so a stopped account that is dropped is forgotten here too.
+    """
+
+    def __init__(self, margin: float = REFRESH_MARGIN, retry_delay: float = REFRESH_RETRY_DELAY):
+        self.margin = margin
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        # credentials -> [on_refresh callback, no retry before this time]
+        self._credentials: "weakref.WeakKeyDictionary[Any, List[Any]]" = weakref.WeakKeyDictionary()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._http: Optional[httplib2.Http] = None
+
+    def register(self, credentials, on_refresh: Optional[Callable[[Any], None]] = None):
+        """
+        Keeps credentials fresh from now on.
+
+        Args:
+            credentials: google-auth credentials, shared with the clients using them.
+            on_refresh: Called with the credentials after each refresh, e.g.
+                to save a user token. It must not hold a reference to the
+                credentials' owner, or they are never released.
+        """
+        if hasattr(credentials, 'refresh_token') and not credentials.refresh_token:
+            # A user token without a refresh token cannot be renewed.
+            return
+        with self._lock:
+            self._credentials[credentials] = [on_refresh, 0.0]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="token-refresher")
+                self._thread.start()
+        self._wakeup.set()
+
+    def unregister(self, credentials):
+        with self._lock:
+            self._credentials.pop(credentials, None)
+
+    def _due(self, credentials, retry_at: float) -> float:
+        """When the credentials should next be refreshed, as a Unix time."""
+        if not credentials.token or credentials.expiry is None:
+            due = 0.0
+        else:
+            # google-auth keeps expiry as a naive UTC datetime.
+            due = credentials.expiry.replace(tzinfo=timezone.utc).timestamp() - self.margin
+        return max(due, retry_at)
+
+    def refresh_due(self) -> Optional[float]:
+        """
+        Refreshes every registered token that is due.
+
+        Returns:
+            When the next one falls due (Unix time), or None if none is registered.
+        """
+        with self._lock:
+            entries = [(credentials, entry, self._due(credentials, entry[1]))
+                       for credentials, entry in self._credentials.items()]
+        now = time.time()
+        next_due = None
+        for credentials, entry, due in entries:
+            if due <= now:
+                self._refresh(credentials, entry)
+                due = self._due(credentials, entry[1])
+                if due <= now:
+                    # A token that lives shorter than the margin; do not spin on it.
+                    entry[1] = due = now + self.retry_delay
+            next_due = due if next_due is None else min(next_due, due)
+        return next_due
+
+    def _refresh(self, credentials, entry: List[Any]):
+        if self._http is None:
+            # Only this thread refreshes, so it owns one connection.
+            self._http = httplib2.Http()
+        try:
+            credentials.refresh(google_auth_httplib2.Request(self._http))
+        except Exception as e:
+            print(f"Background token refresh failed, retrying in {self.retry_delay:.0f}s: {e}")
+            entry[1] = time.time() + self.retry_delay
+            return
+        entry[1] = 0.0
+        on_refresh = entry[0]
+        if on_refresh is not None:
+            try:
+                on_refresh(credentials)
+            except Exception as e:
+                print(f"Failed to save refreshed token: {e}")
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            next_due = self.refresh_due()
+            timeout = max(0.0, next_due - time.time()) if next_due is not None else None
+            self._wakeup.wait(timeout)
+
+# Shared by every client and account in the process.
+TOKEN_REFRESHER = TokenRefresher()
@@ -0,0 +1,333 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+from unittest.mock import patch
+
+from src.agent import Agent
+from src.calendar_client import event_id_for
+from src.email_store import EmailStore
+from src.ledger import ProcessedLedger
+from src.work_queue import WorkQueue, FETCH, EXTRACT, INSERT, LABEL, READY, LEASED, DEAD
+
+MEETING_RESULT = {
+    "Intent": "Meeting",
+    "EventData": {
+        "title": "Sync",
+        "startDateTime": "2030-01-01T10:00:00Z",
+        "endDateTime": "2030-01-01T11:00:00Z",
+    },
+}
+
+
+def make_email(message_id):
+    return {
+        "id": message_id,
+        "subject": f"Meeting {message_id}",
+        "sender": "dana@acme.com",
+        "body": "Let's meet tomorrow at 2pm.",
+        "snippet": "",
+    }
+
+
+class FakeGmailClient:
+    def __init__(self, emails, log):
+        self.emails = emails
+        self.log = log
+
+        self.by_id = {email["id"]: email for email in emails}
+
+    def fetch_emails(self, message_ids, triage=None):
+        return [dict(self.by_id[message_id]) for message_id in message_ids if message_id in self.by_id]
+
+    def list_new_message_ids(self, query="is:unread", max_results=50):
+        emails, self.emails = self.emails, []
+        return [email["id"] for email in emails], "1"
+
+    def commit_checkpoint(self, history_id):
+        self.log.append(("checkpoint", history_id))
+
+    def get_thread_summaries(self, thread_ids):
+        self.log.append(("threads", tuple(thread_ids)))
+        return {}
+
+    def batch_mark_as_read(self, message_ids):
+        self.log.extend(("read", message_id) for message_id in message_ids)
+
+
+class FakeCalendarClient:
+    def __init__(self, log):
+        self.log = log
+
+    def create_event(self, event_data, event_id=None):
+        self.log.append(("insert", event_data["message_id"]))
+        return {"id": event_id}
+
+    def write_events(self, writes):
+        self.log.append(("batch_write", len(writes)))
+        return [{"event_id": w["event_id"], "ok": True, "action": "created", "event": {}} for w in writes]
+
+
+class AgentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_agent(self, emails, **kwargs):
+        agent = Agent(**kwargs)
+        agent.gmail_client = FakeGmailClient(emails, self.log)
+        agent.calendar_client = FakeCalendarClient(self.log)
+        agent.ledger = ProcessedLedger(os.path.join(self.tmp.name, "ledger.db"))
+        agent.work_queue = WorkQueue(os.path.join(self.tmp.name, "queue.db"))
+        agent.email_store = EmailStore(os.path.join(self.tmp.name, "emails.db"))
+        agent.running = True
+        return agent
+
+
+class TestConcurrentPipeline(AgentTestCase):
+    def test_burst_finishes_in_about_one_call_latency(self):
+        in_flight = {"now": 0, "max": 0}
+
+        async def slow_extract(text, cache=None):
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+            message_id = text.split("Meeting ", 1)[1].split("\n", 1)[0]
+            self.log.append(("extract", message_id))
+            await asyncio.sleep(0.2)
+            in_flight["now"] -= 1
+            return {**MEETING_RESULT, "EventData": {**MEETING_RESULT["EventData"], "message_id": message_id}}
+
+        emails = [make_email(f"m{i}") for i in range(20)]
+        agent = self.make_agent(emails, extraction_concurrency=10)
+
+        with patch("src.agent.extract_event_data_async", slow_extract):
+            started = time.perf_counter()
+            agent._process_emails()
+            elapsed = time.perf_counter() - started
+
+        # Sequential processing would take 20 * 0.2s = 4s.
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual(in_flight["max"], 10)
+        for email in emails:
+            steps = [self.log.index((step, email["id"])) for step in ("extract", "insert", "read")]
+            self.assertEqual(steps, sorted(steps))
+        self.assertEqual(agent.ledger.get("m0"), "event_created")
+
+    def test_failed_extraction_is_retried_not_recorded(self):
+        async def failing_extract(text, cache=None):
+            return {"Intent": "None", "EventData": {}, "Error": "rate limited"}
+
+        agent = self.make_agent([make_email("m1")])
+
+        with patch("src.agent.extract_event_data_async", failing_extract):
+            agent._process_emails()
+
+        self.assertIsNone(agent.ledger.get("m1"))
+        self.assertEqual(agent.work_queue.counts(), {EXTRACT: {READY: 1}})
+
+    def test_batch_mode_writes_events_in_one_call(self):
+        def batch_extract(texts, cache=None, max_workers=1):
+            return {message_id: MEETING_RESULT for message_id in texts}
+
+        agent = self.make_agent([make_email(f"m{i}") for i in range(5)], extraction_mode="batch")
+
+        with patch("src.agent.extract_event_data_batch", batch_extract):
+            agent._process_emails()
+
+        self.assertEqual([entry for entry in self.log if entry[0] == "batch_write"], [("batch_write", 5)])
+        self.assertEqual(agent.ledger.get("m4"), "event_created")
+        self.assertEqual(agent.stats["created_today"], 5)
+
+
+class TestInitializeClients(AgentTestCase):
+    def test_injected_empty_ledger_is_kept(self):
+        agent = self.make_agent([])
+        ledger = agent.ledger
+        agent.extraction_cache = object()
+        agent.backfill = object()
+
+        agent.initialize_clients()
+
+        self.assertIs(agent.ledger, ledger)
+        self.assertEqual(len(ledger), 0)
+
+
+class TestStartStop(AgentTestCase):
+    def test_slow_cycle_keeps_its_pool_and_blocks_restart(self):
+        entered, release = threading.Event(), threading.Event()
+        agent = self.make_agent([])
+        agent._process_emails = lambda: entered.set() or release.wait(5) and 0
+        agent.io_pool = pool = ThreadPoolExecutor(max_workers=1)
+        agent.thread = threading.Thread(target=agent._run_loop, daemon=True)
+        agent.thread.start()
+        entered.wait(2)
+
+        with patch("src.agent.STOP_TIMEOUT", 0.05):
+            agent.stop()
+        self.assertEqual(agent.status, "Stopping")
+        self.assertIs(agent.io_pool, pool)
+
+        agent.start()
+        self.assertFalse(agent.running)
+
+        release.set()
+        agent.thread.join(timeout=2)
+        self.assertEqual(agent.status, "Stopped")
+        self.assertIsNone(agent.io_pool)
+
+
+class TestStagedQueue(AgentTestCase):
+    def test_checkpoint_moves_only_after_ids_are_queued(self):
+        agent = self.make_agent([make_email("m1")])
+        agent.work_queue.enqueue_many = lambda stage, ids: self.log.append(("queued", tuple(ids))) or 0
+
+        agent._process_emails()
+
+        self.assertEqual(self.log, [("queued", ("m1",)), ("checkpoint", "1")])
+
+    def test_work_left_in_flight_resumes_after_restart(self):
+        agent = self.make_agent([])
+        event_data = {**MEETING_RESULT["EventData"], "message_id": "m1"}
+        agent.work_queue.enqueue(INSERT, "m1", {"email": make_email("m1"), "event_data": event_data})
+        # The previous run leased the job and died before inserting the event.
+        agent.work_queue.lease(INSERT)
+        agent.work_queue.recover()
+
+        agent._process_emails()
+
+        self.assertEqual(self.log[-2:], [("insert", "m1"), ("read", "m1")])
+        self.assertEqual(agent.ledger.get("m1"), "event_created")
+        self.assertEqual(agent.work_queue.counts(), {})
+
+    def test_repeated_failures_end_in_dead_letters(self):
+        async def failing_extract(text, cache=None):
+            return {"Intent": "None", "EventData": {}, "Error": "context length exceeded"}
+
+        agent = self.make_agent([make_email("m1")])
+        agent.work_queue = WorkQueue(os.path.join(self.tmp.name, "dead.db"), max_attempts=1)
+
+        with patch("src.agent.extract_event_data_async", failing_extract):
+            agent._process_emails()
+
+        self.assertEqual(agent.work_queue.counts(), {EXTRACT: {DEAD: 1}})
+        self.assertEqual(agent.work_queue.dead_letters()[0]["error"], "context length exceeded")
+
+    def test_stage_worker_count_bounds_concurrency(self):
+        in_flight = {"now": 0, "max": 0}
+
+        async def extract(text, cache=None):
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+            await asyncio.sleep(0.05)
+            in_flight["now"] -= 1
+            return {"Intent": "None", "EventData": {}}
+
+        agent = self.make_agent([make_email(f"m{i}") for i in range(6)], stage_workers={EXTRACT: 2})
+
+        with patch("src.agent.extract_event_data_async", extract):
+            agent._process_emails()
+
+        self.assertEqual(in_flight["max"], 2)
+        self.assertEqual(agent.ledger.get("m5"), "no_event")
+
+    def test_burst_is_marked_read_in_one_call(self):
+        async def extract(text, cache=None):
+            message_id = text.split("Meeting ", 1)[1].split("\n", 1)[0]
+            # Finish at different times, so label jobs trickle in.
+            await asyncio.sleep(0.01 * int(message_id[1:]))
+            return {**MEETING_RESULT, "EventData": {**MEETING_RESULT["EventData"], "message_id": message_id}}
+
+        agent = self.make_agent([make_email(f"m{i}") for i in range(20)])
+        calls = []
+        mark_read = agent.gmail_client.batch_mark_as_read
+        agent.gmail_client.batch_mark_as_read = lambda ids: calls.append(len(ids)) or mark_read(ids)
+
+        with patch("src.agent.extract_event_data_async", extract):
+            agent._process_emails()
+
+        self.assertEqual(calls, [20])
+        self.assertEqual(agent.work_queue.counts(), {})
+
+    def test_label_jobs_wait_for_a_batch_while_upstream_is_busy(self):
+        agent = self.make_agent([])
+        agent._busy = 1
+        agent.label_flush_size = 3
+        for message_id in ("m1", "m2"):
+            agent.work_queue.enqueue(LABEL, message_id, {"message_ids": [message_id]})
+
+        self.assertFalse(agent._label_due())
+        agent.work_queue.enqueue(LABEL, "m3", {"message_ids": ["m3"]})
+        self.assertTrue(agent._label_due())
+
+        agent.label_flush_size = 10
+        self.assertFalse(agent._label_due())
+        agent.label_max_delay = 0
+        self.assertTrue(agent._label_due())
+
+
+class TestThreadCoalescing(AgentTestCase):
+    def test_thread_is_extracted_once_into_one_event(self):
+        emails = [make_email(f"m{i}") for i in range(3)] + [make_email("other")]
+        for i, email in enumerate(emails[:3]):
+            email.update(thread_id="t1", received_at=1000 + i, snippet=f"message {i}")
+        emails[0]["id"] = "t1"
+        seen = []
+
+        async def extract(text, cache=None):
+            seen.append(text)
+            return MEETING_RESULT
+
+        created = []
+        agent = self.make_agent(emails)
+        agent.calendar_client.create_event = lambda event_data, event_id=None: created.append(event_id) or {"id": event_id}
+
+        with patch("src.agent.extract_event_data_async", extract):
+            agent._process_emails()
+
+        self.assertEqual(len(seen), 2)
+        thread_text = next(text for text in seen if "Meeting m2" in text)
+        self.assertIn("Earlier in this thread", thread_text)
+        self.assertIn("message 1", thread_text)
+        self.assertIn(("threads", ("t1",)), self.log)
+        self.assertIn(event_id_for("t1"), created)
+        for message_id in ("t1", "m1", "m2"):
+            self.assertEqual(agent.ledger.get(message_id), "event_created")
+        self.assertEqual(agent.work_queue.counts(), {})
+
+    def make_thread(self):
+        emails = [make_email("m1"), make_email("m2")]
+        for i, email in enumerate(emails):
+            email.update(thread_id="t1", received_at=1000 + i)
+        return emails
+
+    def test_coalesced_messages_wait_for_the_thread_outcome(self):
+        agent = self.make_agent(self.make_thread())
+        agent.work_queue.enqueue_many(FETCH, ["m1", "m2"])
+
+        asyncio.run(agent._fetch_stage(agent.work_queue.lease(FETCH, 10)))
+
+        # A crash now loses nothing: m1 is still queued behind m2.
+        self.assertEqual(agent.work_queue.counts(), {FETCH: {LEASED: 1}, EXTRACT: {READY: 1}})
+
+    def test_coalesced_messages_outlive_a_dead_letter(self):
+        async def failing_extract(text, cache=None):
+            return {"Intent": "None", "EventData": {}, "Error": "context length exceeded"}
+
+        agent = self.make_agent(self.make_thread())
+        agent.work_queue = WorkQueue(os.path.join(self.tmp.name, "dead.db"), max_attempts=1)
+
+        with patch("src.agent.extract_event_data_async", failing_extract):
+            agent._process_emails()
+
+        self.assertEqual(agent.work_queue.counts(), {EXTRACT: {DEAD: 1}, FETCH: {DEAD: 1}})
+        self.assertEqual({job["id"] for job in agent.work_queue.dead_letters()}, {"m1", "m2"})
+
+
+if __name__ == "__main__":
+    unittest.main()
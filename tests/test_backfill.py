@@ -0,0 +1,124 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from src.backfill import Backfill, BACKFILL_PRIORITY, build_query
+from src.ledger import ProcessedLedger
+from src.work_queue import WorkQueue, FETCH
+from tests.test_agent import AgentTestCase, make_email
+
+
+class FakePagedGmail:
+    def __init__(self, message_ids, fail_on_page=None):
+        self.message_ids = message_ids
+        self.fail_on_page = fail_on_page
+        self.calls = []
+
+    def list_message_page(self, query, page_token=None, page_size=500):
+        self.calls.append(page_token)
+        start = int(page_token or 0)
+        if self.fail_on_page is not None and start // page_size == self.fail_on_page:
+            self.fail_on_page = None
+            raise ConnectionError("network down")
+        end = start + page_size
+        return self.message_ids[start:end], (str(end) if end < len(self.message_ids) else None)
+
+
+class TestBackfill(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.tmp.name, "backfill.json")
+        self.queue = WorkQueue(os.path.join(self.tmp.name, "queue.db"))
+        self.ledger = ProcessedLedger(os.path.join(self.tmp.name, "ledger.db"))
+
+    def tearDown(self):
+        self.queue.close()
+        self.ledger.close()
+        self.tmp.cleanup()
+
+    def make_backfill(self, gmail, **kwargs):
+        return Backfill(gmail, self.queue, self.ledger, state_file=self.state_file, page_size=2, **kwargs)
+
+    def wait_for(self, backfill):
+        backfill._thread.join(timeout=2)
+        self.assertFalse(backfill.running)
+
+    def test_query_covers_date_range(self):
+        self.assertEqual(build_query("2024-01-01", "2024-04-01"), "after:2024/01/01 before:2024/04/01 -in:sent -in:drafts")
+        with self.assertRaises(ValueError):
+            build_query("01/01/2024")
+
+    def test_pages_are_queued_behind_live_mail(self):
+        self.ledger.record("m2", "no_event")
+        self.queue.enqueue(FETCH, "live")
+        backfill = self.make_backfill(FakePagedGmail([f"m{i}" for i in range(5)]))
+
+        backfill.start("2024-01-01")
+        self.wait_for(backfill)
+
+        self.assertEqual(self.queue.pending(BACKFILL_PRIORITY), 4)
+        self.assertEqual(self.queue.lease(FETCH)[0]["id"], "live")
+        status = backfill.status()
+        self.assertEqual((status["state"], status["pages"], status["listed"], status["queued"]), ("processing", 3, 5, 4))
+        with open(self.state_file) as f:
+            self.assertTrue(json.load(f)["listed_all"])
+
+    def test_interrupted_scan_resumes_from_checkpoint(self):
+        backfill = self.make_backfill(FakePagedGmail([f"m{i}" for i in range(6)], fail_on_page=1))
+        backfill.start("2024-01-01")
+        self.wait_for(backfill)
+        self.assertEqual(backfill.status()["state"], "paused")
+        self.assertIn("network down", backfill.status()["error"])
+
+        # A new process picks up the checkpoint.
+        gmail = FakePagedGmail([f"m{i}" for i in range(6)])
+        resumed = self.make_backfill(gmail)
+        self.assertTrue(resumed.resume())
+        self.wait_for(resumed)
+
+        self.assertEqual(gmail.calls, ["2", "4"])
+        self.assertEqual(self.queue.pending(BACKFILL_PRIORITY), 6)
+
+    def test_listing_pauses_while_backlog_is_full(self):
+        backfill = self.make_backfill(FakePagedGmail([f"m{i}" for i in range(6)]), max_backlog=2)
+
+        with patch("src.backfill.BACKLOG_WAIT", 0.01):
+            backfill.start("2024-01-01")
+            time.sleep(0.1)
+            self.assertEqual(backfill.status()["pages"], 1)
+
+            for job in self.queue.lease(FETCH, limit=10):
+                self.queue.complete(job["id"])
+            time.sleep(0.1)
+            backfill.stop()
+
+        status = backfill.status()
+        self.assertEqual((status["pages"], status["processed"]), (2, 2))
+
+
+class TestAgentBackfill(AgentTestCase):
+    def test_past_events_from_old_mail_are_skipped(self):
+        past, upcoming = make_email("old"), make_email("new")
+        agent = self.make_agent([])
+        agent.gmail_client.by_id.update(old=past, new=upcoming)
+        agent.work_queue.enqueue_many(FETCH, ["old", "new"], {"backfill": True}, priority=BACKFILL_PRIORITY)
+
+        async def extract(text, cache=None):
+            start = "2020-01-01T10:00:00Z" if "Meeting old" in text else "2030-01-01T10:00:00Z"
+            return {"Intent": "Meeting", "EventData": {"title": "Sync", "startDateTime": start,
+                                                        "endDateTime": start.replace("10:", "11:"),
+                                                        "message_id": text.split("Meeting ")[1].split("\n")[0]}}
+
+        with patch("src.agent.extract_event_data_async", extract):
+            agent._process_emails()
+
+        self.assertEqual(agent.ledger.get("old"), "past_event")
+        self.assertEqual(agent.ledger.get("new"), "event_created")
+        self.assertNotIn(("insert", "old"), self.log)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+import json
+import re
+import unittest
+from urllib.parse import urlparse
+
+import httplib2
+from googleapiclient.discovery import build
+
+from src.calendar_client import CalendarClient, event_id_for, instance_id_for, BATCH_SIZE
+from src.ics import parse_ics
+from tests.test_ics import calendar
+from src.ratelimit import RateLimiter
+
+
+def make_event(title="Sync"):
+    return {
+        "title": title,
+        "startDateTime": "2030-01-01T10:00:00Z",
+        "endDateTime": "2030-01-01T11:00:00Z",
+    }
+
+
+class FakeCalendarTransport:
+    """httplib2-compatible transport keeping events in memory and counting round trips."""
+
+    BOUNDARY = "batch_fake_boundary"
+
+    def __init__(self, existing=(), failing_ids=()):
+        self.events = {event_id: {"id": event_id} for event_id in existing}
+        self.failing_ids = set(failing_ids)
+        self.requests = []
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        self.requests.append((method, uri))
+        if isinstance(body, bytes):
+            body = body.decode()
+        if urlparse(uri).path.startswith("/batch"):
+            return self._batch(body)
+        status, content = self._call(method, urlparse(uri).path, body)
+        return httplib2.Response({"status": str(status)}), json.dumps(content).encode()
+
+    def _call(self, method, path, body):
+        event = json.loads(body) if body else {}
+        if method == "POST":
+            event_id = event["id"]
+            if event_id in self.failing_ids:
+                return 400, {"error": {"code": 400, "message": "Invalid value"}}
+            if event_id in self.events:
+                return 409, {"error": {"code": 409, "message": "The requested identifier already exists."}}
+        else:
+            event_id = path.rsplit("/", 1)[-1]
+            series = self.events.get(event_id.split("_", 1)[0], {})
+            if event_id not in self.events and "_" in event_id and series.get("recurrence"):
+                # An occurrence of a recurring event exists until it is changed.
+                self.events[event_id] = {**series, "id": event_id, "recurrence": None, "method": "GET"}
+            if event_id not in self.events:
+                return 404, {"error": {"code": 404, "message": "Not Found"}}
+            if method == "GET":
+                return 200, self.events[event_id]
+            if method == "DELETE":
+                # Deleted events are kept with status "cancelled".
+                self.events[event_id]["status"] = "cancelled"
+                return 204, None
+        self.events[event_id] = {**event, "id": event_id, "method": method}
+        return 200, self.events[event_id]
+
+    def _batch(self, body):
+        parts = []
+        pattern = r"Content-ID: <([^>]+)>\r?\n\r?\n(POST|PUT) (\S+) HTTP/1.1\r?\n.*?\r?\n\r?\n(.*?)\r?\n--"
+        for content_id, method, path, request_body in re.findall(pattern, body, re.S):
+            status, content = self._call(method, urlparse(path).path, request_body)
+            parts.append(
+                f"--{self.BOUNDARY}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} Status\r\n"
+                "Content-Type: application/json\r\n\r\n"
+                f"{json.dumps(content)}\r\n"
+            )
+        payload = "".join(parts) + f"--{self.BOUNDARY}--"
+        resp = httplib2.Response({"status": "200", "content-type": f"multipart/mixed; boundary={self.BOUNDARY}"})
+        return resp, payload.encode()
+
+
+def make_client(transport):
+    return CalendarClient(service=build("calendar", "v3", http=transport, static_discovery=True), calendar_id="cal",
+                          limiter=RateLimiter("calendar", {}))
+
+
+class TestIdempotentWrites(unittest.TestCase):
+    def test_event_id_is_stable_and_valid(self):
+        event_id = event_id_for("18c2f0a9b7e41d3a")
+        self.assertEqual(event_id, event_id_for("18c2f0a9b7e41d3a"))
+        self.assertNotEqual(event_id, event_id_for("18c2f0a9b7e41d3b"))
+        self.assertRegex(event_id, r"^[a-v0-9]{5,1024}$")
+
+    def test_reinsert_updates_instead_of_duplicating(self):
+        transport = FakeCalendarTransport()
+        client = make_client(transport)
+        event_id = event_id_for("m1")
+
+        client.create_event(make_event("First"), event_id=event_id)
+        client.create_event(make_event("Second"), event_id=event_id)
+
+        self.assertEqual(list(transport.events), [event_id])
+        self.assertEqual(transport.events[event_id]["summary"], "Second")
+        self.assertEqual(transport.events[event_id]["method"], "PUT")
+
+
+class TestBatchedWrites(unittest.TestCase):
+    def test_batch_writes_with_per_item_results(self):
+        writes = [{"event_id": event_id_for(f"m{i}"), "event_data": make_event(f"Event {i}")} for i in range(60)]
+        transport = FakeCalendarTransport(existing=[writes[3]["event_id"]], failing_ids=[writes[5]["event_id"]])
+
+        results = make_client(transport).write_events(writes)
+
+        self.assertEqual([r["event_id"] for r in results], [w["event_id"] for w in writes])
+        self.assertEqual(results[0]["action"], "created")
+        self.assertEqual(results[3]["action"], "updated")
+        self.assertFalse(results[5]["ok"])
+        self.assertEqual(sum(r["ok"] for r in results), 59)
+        # Insert batches for 60 writes, plus one update batch for the conflict.
+        self.assertEqual(len(transport.requests), -(-60 // BATCH_SIZE) + 1)
+
+
+def invite(*event_lines, method="REQUEST"):
+    return parse_ics(calendar("UID:weekly@acme.com", *event_lines, method=method))["events"][0]
+
+
+class TestInvites(unittest.TestCase):
+    SERIES = ("SUMMARY:Weekly", "DTSTART:20300106T170000Z", "DTEND:20300106T173000Z", "RRULE:FREQ=WEEKLY;COUNT=10")
+    MOVED = ("SUMMARY:Weekly (moved)", "RECURRENCE-ID:20300113T170000Z", "DTSTART:20300114T170000Z",
+             "DTEND:20300114T173000Z")
+
+    def setUp(self):
+        self.transport = FakeCalendarTransport()
+        self.client = make_client(self.transport)
+        self.series_id = event_id_for("weekly@acme.com")
+        self.instance_id = instance_id_for(self.series_id, "2030-01-13T17:00:00Z")
+        self.client.save_invite(invite(*self.SERIES))
+
+    def test_override_changes_one_occurrence(self):
+        self.client.save_invite(invite(*self.MOVED, "SEQUENCE:1"))
+
+        self.assertEqual(self.transport.events[self.series_id]["recurrence"], ["RRULE:FREQ=WEEKLY;COUNT=10"])
+        self.assertEqual(self.transport.events[self.series_id]["summary"], "Weekly")
+        self.assertEqual(self.transport.events[self.instance_id]["summary"], "Weekly (moved)")
+        self.assertEqual(self.transport.events[self.instance_id]["method"], "PUT")
+
+    def test_cancelling_one_occurrence_keeps_the_series(self):
+        deleted = self.client.cancel_invite(invite(*self.MOVED, "SEQUENCE:1", method="CANCEL"))
+
+        self.assertEqual(deleted, 1)
+        self.assertEqual(self.transport.events[self.instance_id]["status"], "cancelled")
+        self.assertNotIn("status", self.transport.events[self.series_id])
+
+    def test_outdated_sequence_is_ignored(self):
+        self.client.save_invite(invite(*self.SERIES[1:], "SUMMARY:Weekly v2", "SEQUENCE:2"))
+
+        self.assertIsNone(self.client.save_invite(invite(*self.SERIES[1:], "SUMMARY:Weekly v1", "SEQUENCE:1")))
+        self.assertEqual(self.transport.events[self.series_id]["summary"], "Weekly v2")
+        self.assertEqual(self.client.cancel_invite(invite(*self.MOVED, "SEQUENCE:1", method="CANCEL")), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
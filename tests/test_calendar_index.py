@@ -0,0 +1,149 @@
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from src.calendar_index import CalendarIndex, parse_time
+from tests.test_agent import AgentTestCase, MEETING_RESULT, make_email
+from unittest.mock import patch
+
+
+def api_event(event_id, title, start, end, **extra):
+    return {"id": event_id, "summary": title, "start": {"dateTime": start}, "end": {"dateTime": end}, **extra}
+
+
+class FakeListingClient:
+    """Serves events.list pages; the sync token is the number of changes already seen."""
+
+    def __init__(self, events, page_size=100):
+        self.changes = list(events)
+        self.page_size = page_size
+        self.expired = False
+        self.calls = []
+
+    def list_events(self, sync_token=None, page_token=None):
+        self.calls.append((sync_token, page_token))
+        if sync_token is not None and self.expired:
+            raise HttpError(httplib2.Response({"status": "410"}), b'{"error": {"code": 410}}')
+        if sync_token is None:
+            latest = {}
+            for event in self.changes:
+                latest[event["id"]] = event
+            items = [e for e in latest.values() if e.get("status") != "cancelled"]
+        else:
+            items = self.changes[int(sync_token):]
+        offset = int(page_token or 0)
+        response = {"items": items[offset:offset + self.page_size]}
+        if offset + self.page_size < len(items):
+            response["nextPageToken"] = str(offset + self.page_size)
+        else:
+            response["nextSyncToken"] = str(len(self.changes))
+        return response
+
+
+class TestCalendarIndex(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeListingClient([
+            api_event("a", "Project Review", "2030-01-01T10:00:00Z", "2030-01-01T11:00:00Z"),
+            api_event("b", "Lunch", "2030-01-01T12:00:00Z", "2030-01-01T13:00:00Z"),
+            api_event("c", "Focus time", "2030-01-01T10:30:00Z", "2030-01-01T12:30:00Z", transparency="transparent"),
+        ], page_size=2)
+        self.index = CalendarIndex(self.client)
+        self.index.sync()
+
+    def test_duplicate_and_conflicts(self):
+        found = self.index.check({
+            "title": "project  review",
+            "startDateTime": "2030-01-01T10:00:00Z",
+            "endDateTime": "2030-01-01T11:00:00Z",
+        })
+        self.assertEqual(found["duplicate"]["id"], "a")
+        self.assertEqual(found["conflicts"], [])
+
+        found = self.index.check({
+            "title": "1:1",
+            "startDateTime": "2030-01-01T10:45:00Z",
+            "endDateTime": "2030-01-01T12:15:00Z",
+        })
+        self.assertIsNone(found["duplicate"])
+        self.assertEqual([e["id"] for e in found["conflicts"]], ["a", "b"])
+
+    def test_incremental_sync_applies_changes_only(self):
+        self.client.changes.append(api_event("b", "Lunch", "2030-01-01T12:00:00Z", "2030-01-01T13:00:00Z", status="cancelled"))
+        self.client.changes.append(api_event("a", "Project Review", "2030-01-02T10:00:00Z", "2030-01-02T11:00:00Z"))
+
+        self.assertEqual(self.index.sync(), 2)
+
+        self.assertEqual(self.client.calls[-1], ("3", None))
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.find_conflicts(parse_time("2030-01-01T09:00:00Z"), parse_time("2030-01-01T13:00:00Z")), [])
+        self.assertIsNotNone(self.index.find_duplicate(
+            "Project Review", parse_time("2030-01-02T10:00:00Z"), parse_time("2030-01-02T11:00:00Z")
+        ))
+
+    def test_expired_sync_token_triggers_full_resync(self):
+        self.client.expired = True
+        self.client.changes.append(api_event("d", "Standup", "2030-01-03T09:00:00Z", "2030-01-03T09:15:00Z"))
+
+        self.index.sync()
+
+        self.assertEqual(self.client.calls[-2:], [(None, None), (None, "2")])
+        self.assertEqual(len(self.index), 4)
+
+    def test_long_and_all_day_events(self):
+        self.client.changes += [
+            {"id": "trip", "summary": "Trip", "start": {"date": "2029-12-20"}, "end": {"date": "2030-01-20"}},
+            api_event("block", "Conference", "2029-12-28T08:00:00Z", "2030-01-05T18:00:00Z"),
+        ]
+        self.index.sync()
+
+        conflicts = self.index.find_conflicts(parse_time("2030-01-01T10:45:00Z"), parse_time("2030-01-01T12:15:00Z"))
+        self.assertEqual([e["id"] for e in conflicts], ["block", "a", "b"])
+        self.assertEqual(self.index.find_conflicts(parse_time("2030-01-10T10:00:00Z"), parse_time("2030-01-10T11:00:00Z")), [])
+
+        self.client.changes.append({"id": "block", "status": "cancelled"})
+        self.index.sync()
+        conflicts = self.index.find_conflicts(parse_time("2030-01-01T10:45:00Z"), parse_time("2030-01-01T12:15:00Z"))
+        self.assertEqual([e["id"] for e in conflicts], ["a", "b"])
+
+    def test_lookups_stay_fast_with_thousands_of_events(self):
+        base = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        events = []
+        for i in range(5000):
+            start = base + timedelta(minutes=30 * i)
+            events.append(api_event(f"e{i}", f"Event {i}", start.isoformat(), (start + timedelta(minutes=45)).isoformat()))
+        index = CalendarIndex(FakeListingClient(events, page_size=2500))
+        index.sync()
+
+        started = time.perf_counter()
+        for i in range(1000):
+            start = (base + timedelta(minutes=30 * i)).timestamp()
+            self.assertIsNotNone(index.find_duplicate(f"Event {i}", start, start + 45 * 60))
+            self.assertEqual(len(index.find_conflicts(start, start + 45 * 60)), 3 if i else 2)
+        per_lookup = (time.perf_counter() - started) / 1000
+
+        self.assertLess(per_lookup, 0.001)
+
+
+class TestAgentDuplicateCheck(AgentTestCase):
+    def test_duplicate_event_is_not_inserted(self):
+        agent = self.make_agent([make_email("m1")])
+        agent.calendar_index = CalendarIndex(FakeListingClient([
+            api_event("x", "Sync", "2030-01-01T10:00:00Z", "2030-01-01T11:00:00Z"),
+        ]))
+
+        async def extract(text, cache=None):
+            return MEETING_RESULT
+
+        with patch("src.agent.extract_event_data_async", extract):
+            agent._process_emails()
+
+        self.assertNotIn("insert", [entry[0] for entry in self.log])
+        self.assertEqual(agent.ledger.get("m1"), "duplicate_event")
+        self.assertIn(("read", "m1"), self.log)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from src.email_store import EmailStore
+
+
+def make_email(i, category="Work", importance="High", sender=None):
+    return {
+        "id": f"m{i}",
+        "subject": f"Subject {i}",
+        "sender": sender or f"Person {i} <person{i}@example.com>",
+        "summary": "Summary",
+        "category": category,
+        "importance": importance,
+    }
+
+
+class TestEmailStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "emails.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def ids(self, emails):
+        return [email["id"] for email in emails]
+
+    def test_feed_keeps_newest_and_survives_reopen(self):
+        store = EmailStore(self.path, feed_size=3)
+        for i in range(5):
+            store.add(make_email(i))
+        store.add(make_email(2))
+        self.assertEqual(self.ids(store.recent()), ["m2", "m4", "m3"])
+        self.assertEqual(len(store), 5)
+        store.close()
+
+        reopened = EmailStore(self.path, feed_size=3)
+        self.assertEqual(self.ids(reopened.recent()), ["m2", "m4", "m3"])
+        reopened.close()
+
+    def test_cursor_pages_through_history(self):
+        store = EmailStore(self.path, feed_size=3)
+        for i in range(7):
+            store.add(make_email(i))
+
+        pages, cursor = [], None
+        while True:
+            emails, cursor = store.query(limit=2, cursor=cursor)
+            pages.append(self.ids(emails))
+            if cursor is None:
+                break
+        self.assertEqual(pages, [["m6", "m5"], ["m4", "m3"], ["m2", "m1"], ["m0"]])
+        store.close()
+
+    def test_filters(self):
+        store = EmailStore(self.path)
+        store.add(make_email(0, category="Work", importance="High", sender="Boss <BOSS@example.com>"))
+        store.add(make_email(1, category="Personal", importance="Medium"))
+        store.add(make_email(2, category="Work", importance="Medium"))
+
+        self.assertEqual(self.ids(store.query(category="Work")[0]), ["m2", "m0"])
+        self.assertEqual(self.ids(store.query(importance="Medium")[0]), ["m2", "m1"])
+        self.assertEqual(self.ids(store.query(sender="boss@example.com")[0]), ["m0"])
+        emails, cursor = store.query(limit=1, category="Work")
+        self.assertEqual(self.ids(store.query(limit=1, cursor=cursor, category="Work")[0]), ["m0"])
+        store.close()
+
+    def test_concurrent_adds_and_reads(self):
+        store = EmailStore(self.path, feed_size=10)
+        errors = []
+
+        def writer(offset):
+            for i in range(50):
+                store.add(make_email(offset + i))
+
+        def reader():
+            try:
+                for _ in range(200):
+                    self.assertLessEqual(len(store.recent()), 10)
+                    store.query(limit=5)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=(n * 100,)) for n in range(3)]
+        threads.append(threading.Thread(target=reader))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(store), 150)
+        self.assertEqual(len(store.recent()), 10)
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
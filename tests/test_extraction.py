@@ -1,7 +1,20 @@
 import json
 import unittest
-from unittest.mock import MagicMock, patch
-from src.extraction import extract_event_data
+from types import SimpleNamespace
+from unittest.mock import patch
+from src.extraction import extract_event_data, extract_event_data_batch
+from src.ratelimit import RateLimiter
+
+# Run without client-side quota so tests never wait on the shared buckets.
+_unlimited = patch("src.extraction.OPENAI_LIMITER", RateLimiter("openai", {}, base_delay=0))
+
+
+def setUpModule():
+    _unlimited.start()
+
+
+def tearDownModule():
+    _unlimited.stop()
 
 # Mock response for a meeting
 MOCK_MEETING_RESPONSE = {
@@ -50,11 +63,19 @@ MOCK_NO_EVENT_RESPONSE = {
     ]
 }
 
+def to_response(data):
+    """Converts a nested dict/list into attribute-accessible objects like the OpenAI SDK returns."""
+    if isinstance(data, dict):
+        return SimpleNamespace(**{k: to_response(v) for k, v in data.items()})
+    if isinstance(data, list):
+        return [to_response(v) for v in data]
+    return data
+
 class TestExtraction(unittest.TestCase):
     @patch("src.extraction.client")
     def test_extract_meeting(self, mock_client):
         # Setup mock
-        mock_client.chat.completions.create.return_value = MagicMock(**MOCK_MEETING_RESPONSE)
+        mock_client.chat.completions.create.return_value = to_response(MOCK_MEETING_RESPONSE)
         # Mock the nested structure access
         mock_client.chat.completions.create.return_value.choices[0].message.tool_calls[0].function.arguments = json.dumps({
             "Intent": "Meeting",
@@ -79,7 +100,7 @@ class TestExtraction(unittest.TestCase):
     @patch("src.extraction.client")
     def test_extract_no_event(self, mock_client):
         # Setup mock
-        mock_client.chat.completions.create.return_value = MagicMock(**MOCK_NO_EVENT_RESPONSE)
+        mock_client.chat.completions.create.return_value = to_response(MOCK_NO_EVENT_RESPONSE)
         # Mock the nested structure access
         mock_client.chat.completions.create.return_value.choices[0].message.tool_calls[0].function.arguments = json.dumps({
             "Intent": "None",
@@ -92,5 +113,90 @@ class TestExtraction(unittest.TestCase):
         self.assertEqual(result["Intent"], "None")
         self.assertEqual(result["EventData"], {})
 
+def tool_response(arguments, prompt_tokens=100, completion_tokens=20):
+    return to_response({
+        "choices": [{"message": {"tool_calls": [{"function": {"arguments": json.dumps(arguments)}}]}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens},
+    })
+
+def batch_reply(message_ids):
+    return tool_response({"results": [
+        {"message_id": message_id, "Intent": "None", "EventData": {}} for message_id in message_ids
+    ]})
+
+class TestBatchExtraction(unittest.TestCase):
+    @patch("src.extraction.client")
+    def test_emails_share_one_request(self, mock_client):
+        emails = {f"m{i}": f"Email number {i}" for i in range(5)}
+        mock_client.chat.completions.create.return_value = batch_reply(emails)
+        usage = {}
+
+        results = extract_event_data_batch(emails, usage=usage)
+
+        self.assertEqual(list(results), list(emails))
+        self.assertEqual(results["m3"], {"Intent": "None", "EventData": {}})
+        self.assertEqual(mock_client.chat.completions.create.call_count, 1)
+        self.assertEqual(usage["requests"], 1)
+        self.assertEqual(usage["emails"], 5)
+        self.assertEqual(usage["prompt_tokens"], 100)
+
+    @patch("src.extraction.client")
+    def test_token_budget_splits_requests(self, mock_client):
+        emails = {f"m{i}": "x" * 400 for i in range(6)}
+        mock_client.chat.completions.create.side_effect = lambda **kwargs: batch_reply(
+            [m for m in emails if f'id="{m}"' in kwargs["messages"][1]["content"]]
+        )
+
+        results = extract_event_data_batch(emails, token_budget=250)
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(mock_client.chat.completions.create.call_count, 3)
+
+    @patch("src.extraction.client")
+    def test_reply_for_another_batch_is_ignored(self, mock_client):
+        emails = {f"m{i}": "x" * 400 for i in range(6)}
+
+        def reply(**kwargs):
+            content = kwargs["messages"][1]["content"]
+            if 'id="m4"' in content:
+                # The model also answers for an email it was never shown.
+                return tool_response({"results": [
+                    {"message_id": "m4", "Intent": "None", "EventData": {}},
+                    {"message_id": "m5", "Intent": "None", "EventData": {}},
+                    {"message_id": "m0", "Intent": "Meeting", "EventData": {"title": "Invented"}},
+                ]})
+            return batch_reply([m for m in emails if f'id="{m}"' in content])
+        mock_client.chat.completions.create.side_effect = reply
+        usage = {}
+
+        results = extract_event_data_batch(emails, token_budget=250, max_workers=3, usage=usage)
+
+        self.assertEqual(results["m0"], {"Intent": "None", "EventData": {}})
+        self.assertEqual(usage["requests"], 3)
+        self.assertEqual(usage["emails"], 6)
+        self.assertEqual(usage["prompt_tokens"], 300)
+
+    @patch("src.extraction.client")
+    def test_only_unanswered_emails_are_retried_singly(self, mock_client):
+        single = tool_response({"Intent": "Meeting", "EventData": {"title": "Retro"}})
+        mock_client.chat.completions.create.side_effect = [batch_reply(["a", "c"]), single]
+
+        results = extract_event_data_batch({"a": "one", "b": "two", "c": "three"})
+
+        self.assertEqual(results["b"]["Intent"], "Meeting")
+        self.assertEqual(results["a"]["Intent"], "None")
+        second_call = mock_client.chat.completions.create.call_args_list[1].kwargs
+        self.assertEqual(second_call["messages"][1]["content"], "two")
+
+    @patch("src.extraction.client")
+    def test_failed_batch_request_returns_errors(self, mock_client):
+        mock_client.chat.completions.create.side_effect = RuntimeError("timeout")
+
+        results = extract_event_data_batch({"a": "one", "b": "two"})
+
+        self.assertIn("Error", results["a"])
+        self.assertIn("Error", results["b"])
+        self.assertEqual(mock_client.chat.completions.create.call_count, 1)
+
 if __name__ == "__main__":
     unittest.main()
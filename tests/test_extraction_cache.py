@@ -0,0 +1,136 @@
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from src import extraction
+from src.extraction import extract_event_data
+from src.extraction_cache import ExtractionCache
+from src.ratelimit import RateLimiter
+
+# Run without client-side quota so tests never wait on the shared buckets.
+_unlimited = patch("src.extraction.OPENAI_LIMITER", RateLimiter("openai", {}, base_delay=0))
+
+
+def setUpModule():
+    _unlimited.start()
+
+
+def tearDownModule():
+    _unlimited.stop()
+
+MEETING_ARGS = {
+    "Intent": "Meeting",
+    "EventData": {
+        "title": "Project review",
+        "startDateTime": "2023-10-27T10:00:00Z",
+        "endDateTime": "2023-10-27T11:00:00Z",
+    },
+}
+
+
+def tool_call_response(arguments):
+    function = SimpleNamespace(arguments=json.dumps(arguments))
+    message = SimpleNamespace(tool_calls=[SimpleNamespace(function=function)])
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class TestExtractionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cache.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_resends_share_a_key(self):
+        original = ExtractionCache.key_for("Subject: Review\n\nMeet   Friday at 10", "v1")
+        forwarded = ExtractionCache.key_for("Subject: Fwd: RE: Review\n\n> Meet Friday at 10", "v1")
+        self.assertEqual(original, forwarded)
+        self.assertNotEqual(original, ExtractionCache.key_for("Subject: Review\n\nMeet Friday at 10", "v2"))
+
+    def test_memory_hit_returns_independent_copy(self):
+        cache = ExtractionCache(path=None)
+        cache.put("k", MEETING_ARGS)
+
+        first = cache.get("k")
+        first["Intent"] = "None"
+
+        self.assertEqual(cache.get("k")["Intent"], "Meeting")
+        self.assertEqual(cache.stats["memory_hits"], 2)
+        self.assertIsNone(cache.get("missing"))
+        self.assertEqual(cache.stats["misses"], 1)
+
+    def test_disk_tier_survives_restart(self):
+        cache = ExtractionCache(self.path)
+        cache.put("k", MEETING_ARGS)
+        cache.close()
+
+        reopened = ExtractionCache(self.path)
+        self.assertEqual(reopened.get("k"), MEETING_ARGS)
+        self.assertEqual(reopened.stats["disk_hits"], 1)
+        # Promoted into memory by the disk hit.
+        reopened.get("k")
+        self.assertEqual(reopened.stats["memory_hits"], 1)
+        reopened.close()
+
+    def test_entries_expire_after_ttl(self):
+        cache = ExtractionCache(self.path, ttl_seconds=60)
+        with patch("src.extraction_cache.time.time", return_value=1000.0):
+            cache.put("k", MEETING_ARGS)
+        with patch("src.extraction_cache.time.time", return_value=1061.0):
+            self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.stats["expired"], 1)
+        cache.close()
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        cache = ExtractionCache(path=None, max_memory_entries=2)
+        cache.put("a", MEETING_ARGS)
+        cache.put("b", MEETING_ARGS)
+        cache.get("a")
+        cache.put("c", MEETING_ARGS)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.stats["evictions"], 1)
+
+
+class TestCachedExtraction(unittest.TestCase):
+    @patch("src.extraction.client")
+    def test_repeat_email_skips_api_call(self, mock_client):
+        mock_client.chat.completions.create.return_value = tool_call_response(MEETING_ARGS)
+        cache = ExtractionCache(path=None)
+
+        first = extract_event_data("Subject: Review\n\nFriday 10am", cache=cache)
+        second = extract_event_data("Subject: Re: Review\n\nFriday 10am", cache=cache)
+
+        self.assertEqual(first, second)
+        self.assertEqual(mock_client.chat.completions.create.call_count, 1)
+
+    @patch("src.extraction.client")
+    def test_schema_change_invalidates_cache(self, mock_client):
+        mock_client.chat.completions.create.return_value = tool_call_response(MEETING_ARGS)
+        cache = ExtractionCache(path=None)
+        extract_event_data("Friday 10am", cache=cache)
+
+        with patch.object(extraction, "SYSTEM_PROMPT_TEMPLATE", extraction.SYSTEM_PROMPT_TEMPLATE + "\nBe brief."):
+            extract_event_data("Friday 10am", cache=cache)
+
+        self.assertEqual(mock_client.chat.completions.create.call_count, 2)
+
+    @patch("src.extraction.client")
+    def test_failed_calls_are_not_cached(self, mock_client):
+        mock_client.chat.completions.create.side_effect = RuntimeError("timeout")
+        cache = ExtractionCache(path=None)
+
+        result = extract_event_data("Friday 10am", cache=cache)
+
+        self.assertIn("Error", result)
+        self.assertEqual(cache.stats["misses"], 1)
+        self.assertEqual(len(cache._memory), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,241 @@
+import base64
+import json
+import os
+import re
+import tempfile
+import unittest
+from unittest.mock import patch
+from urllib.parse import urlparse
+
+import httplib2
+from googleapiclient.discovery import build
+
+from src.gmail_client import GmailClient, BATCH_SIZE
+from src.ratelimit import RateLimiter
+
+
+def make_message(message_id, subject="Hello", body="Body text"):
+    return {
+        "id": message_id,
+        "threadId": f"thread-{message_id}",
+        "snippet": body[:20],
+        "payload": {
+            "mimeType": "text/plain",
+            "headers": [
+                {"name": "Subject", "value": subject},
+                {"name": "From", "value": "Alice <alice@example.com>"},
+            ],
+            "body": {"data": base64.urlsafe_b64encode(body.encode()).decode()},
+        },
+    }
+
+
+class FakeGmailTransport:
+    """httplib2-compatible transport serving canned Gmail responses and counting round trips."""
+
+    BOUNDARY = "batch_fake_boundary"
+
+    def __init__(self, messages, failing_ids=(), history=(), history_id="100", history_expired=False, throttled_ids=()):
+        self.messages = {m["id"]: m for m in messages}
+        self.failing_ids = set(failing_ids)
+        # Messages whose first get is answered with 429.
+        self.throttled_ids = set(throttled_ids)
+        self.history = list(history)
+        self.history_id = history_id
+        self.history_expired = history_expired
+        self.requests = []
+        self.gets = []
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        self.requests.append((method, uri))
+        path = urlparse(uri).path
+        if path == "/batch" or path.startswith("/batch/"):
+            return self._batch(body if isinstance(body, str) else body.decode())
+        if path.endswith("/profile"):
+            return httplib2.Response({"status": "200"}), json.dumps({"historyId": self.history_id}).encode()
+        if path.endswith("/history"):
+            if self.history_expired:
+                error = {"error": {"code": 404, "message": "Requested entity was not found."}}
+                return httplib2.Response({"status": "404"}), json.dumps(error).encode()
+            listing = {"history": self.history, "historyId": self.history_id}
+            return httplib2.Response({"status": "200"}), json.dumps(listing).encode()
+        if path.endswith("/messages"):
+            listing = {"messages": [{"id": m, "threadId": f"thread-{m}"} for m in self.messages]}
+            return httplib2.Response({"status": "200"}), json.dumps(listing).encode()
+        return self._get(path.rsplit("/", 1)[-1], uri)
+
+    def _get(self, message_id, uri=""):
+        self.gets.append((message_id, "metadata" if "format=metadata" in uri else "full"))
+        if message_id in self.throttled_ids:
+            self.throttled_ids.discard(message_id)
+            error = {"error": {"code": 429, "message": "Too many concurrent requests for user"}}
+            return httplib2.Response({"status": "429"}), json.dumps(error).encode()
+        if message_id in self.failing_ids or message_id not in self.messages:
+            error = {"error": {"code": 404, "message": "Not Found"}}
+            return httplib2.Response({"status": "404"}), json.dumps(error).encode()
+        return httplib2.Response({"status": "200"}), json.dumps(self.messages[message_id]).encode()
+
+    def _batch(self, body):
+        parts = []
+        for content_id, path in re.findall(r"Content-ID: <([^>]+)>.*?GET (\S+) HTTP", body, re.S):
+            resp, content = self._get(urlparse(path).path.rsplit("/", 1)[-1], path)
+            reason = "OK" if resp.status == 200 else "Not Found"
+            parts.append(
+                f"--{self.BOUNDARY}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {resp.status} {reason}\r\n"
+                "Content-Type: application/json\r\n\r\n"
+                f"{content.decode()}\r\n"
+            )
+        payload = "".join(parts) + f"--{self.BOUNDARY}--"
+        resp = httplib2.Response({"status": "200", "content-type": f"multipart/mixed; boundary={self.BOUNDARY}"})
+        return resp, payload.encode()
+
+
+def make_client(transport, sync_state_file=None):
+    return GmailClient(service=build("gmail", "v1", http=transport, static_discovery=True), sync_state_file=sync_state_file,
+                       limiter=RateLimiter("gmail", {}))
+
+
+def message_added(message_id, labels=("INBOX", "UNREAD")):
+    return {"messagesAdded": [{"message": {"id": message_id, "labelIds": list(labels)}}]}
+
+
+class TestBatchedFetch(unittest.TestCase):
+    def test_batched_fetch_uses_few_round_trips(self):
+        messages = [make_message(f"m{i}", subject=f"Subject {i}") for i in range(100)]
+        transport = FakeGmailTransport(messages)
+
+        emails = make_client(transport).fetch_recent_emails(max_results=100)
+
+        self.assertEqual(len(emails), 100)
+        self.assertEqual([e["id"] for e in emails], [m["id"] for m in messages])
+        self.assertEqual(emails[7]["subject"], "Subject 7")
+        self.assertEqual(emails[7]["body"], "Body text")
+        # One list call plus one batch call per BATCH_SIZE messages.
+        self.assertEqual(len(transport.requests), 1 + 100 // BATCH_SIZE)
+
+    def test_unbatched_fetch_costs_one_round_trip_per_message(self):
+        transport = FakeGmailTransport([make_message(f"m{i}") for i in range(10)])
+
+        emails = make_client(transport).fetch_recent_emails(max_results=10, batch=False)
+
+        self.assertEqual(len(emails), 10)
+        self.assertEqual(len(transport.requests), 11)
+
+    def test_partial_batch_failure_skips_only_failed_messages(self):
+        messages = [make_message(f"m{i}") for i in range(5)]
+        transport = FakeGmailTransport(messages, failing_ids={"m1", "m3"})
+
+        emails = make_client(transport).fetch_recent_emails(max_results=5)
+
+        self.assertEqual([e["id"] for e in emails], ["m0", "m2", "m4"])
+
+    def test_throttled_messages_are_retried_in_a_later_batch(self):
+        messages = [make_message(f"m{i}") for i in range(5)]
+        transport = FakeGmailTransport(messages, throttled_ids={"m1", "m3"})
+        client = make_client(transport)
+        client.limiter.base_delay = 0.001
+
+        emails = client.fetch_recent_emails(max_results=5)
+
+        self.assertEqual([e["id"] for e in emails], [m["id"] for m in messages])
+        # List, first batch, then one batch with the two throttled messages.
+        self.assertEqual(len(transport.requests), 3)
+
+
+
+class TestTriageFetch(unittest.TestCase):
+    def test_only_accepted_messages_are_fetched_in_full(self):
+        messages = [make_message(f"m{i}", subject=f"Subject {i}") for i in range(10)]
+        transport = FakeGmailTransport(messages)
+        seen = []
+
+        def accept_even(metadata):
+            seen.append(metadata)
+            return int(metadata["id"][1:]) % 2 == 0
+
+        emails = make_client(transport).fetch_recent_emails(max_results=10, triage=accept_even)
+
+        self.assertEqual(len(seen), 10)
+        self.assertEqual(seen[3]["subject"], "Subject 3")
+        self.assertEqual([e["id"] for e in emails], [m["id"] for m in messages])
+        self.assertEqual([e["id"] for e in emails if e.get("triaged_out")], ["m1", "m3", "m5", "m7", "m9"])
+        self.assertEqual(emails[1]["body"], "")
+        self.assertEqual(emails[2]["body"], "Body text")
+        full = sorted(m for m, fmt in transport.gets if fmt == "full")
+        self.assertEqual(full, ["m0", "m2", "m4", "m6", "m8"])
+        # List, one metadata batch, one full batch.
+        self.assertEqual(len(transport.requests), 3)
+
+
+class TestIncrementalSync(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.tmp.name, "gmail_sync.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_first_sync_is_full_and_saves_checkpoint(self):
+        transport = FakeGmailTransport([make_message("m1"), make_message("m2")], history_id="500")
+
+        emails = make_client(transport, self.state_file).fetch_new_emails()
+
+        self.assertEqual([e["id"] for e in emails], ["m1", "m2"])
+        # A restarted client resumes from the persisted checkpoint.
+        self.assertEqual(make_client(transport, self.state_file).history_id, "500")
+
+    def test_quiet_mailbox_costs_one_history_call(self):
+        transport = FakeGmailTransport([make_message("m1")], history_id="500")
+        client = make_client(transport, self.state_file)
+        client.fetch_new_emails()
+        transport.requests.clear()
+
+        emails = client.fetch_new_emails()
+
+        self.assertEqual(emails, [])
+        self.assertEqual(len(transport.requests), 1)
+        self.assertIn("/history", transport.requests[0][1])
+
+    def test_only_new_unread_messages_are_fetched(self):
+        transport = FakeGmailTransport([make_message("m1"), make_message("m2"), make_message("m3")])
+        client = make_client(transport, self.state_file)
+        client.history_id = "100"
+        transport.history = [
+            message_added("m2"),
+            message_added("m3", labels=("SENT",)),
+            message_added("m2"),
+        ]
+        transport.history_id = "120"
+
+        emails = client.fetch_new_emails()
+
+        self.assertEqual([e["id"] for e in emails], ["m2"])
+        self.assertEqual(client.history_id, "120")
+
+    def test_expired_checkpoint_falls_back_to_full_resync(self):
+        transport = FakeGmailTransport([make_message("m1")], history_id="900", history_expired=True)
+        client = make_client(transport, self.state_file)
+        client.history_id = "1"
+
+        emails = client.fetch_new_emails()
+
+        self.assertEqual([e["id"] for e in emails], ["m1"])
+        self.assertEqual(client.history_id, "900")
+
+    def test_failed_checkpoint_write_keeps_previous_checkpoint(self):
+        transport = FakeGmailTransport([make_message("m1")], history_id="500")
+        client = make_client(transport, self.state_file)
+        client.fetch_new_emails()
+
+        with patch("src.gmail_client.json.dump", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                client._save_history_id("600")
+
+        self.assertEqual(make_client(transport, self.state_file).history_id, "500")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+from unittest.mock import patch
+
+from src.ics import parse_ics
+from tests.test_agent import AgentTestCase, make_email
+
+
+def calendar(*event_lines, method="REQUEST"):
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Test//EN"]
+    if method:
+        lines.append(f"METHOD:{method}")
+    lines += ["BEGIN:VEVENT", *event_lines, "END:VEVENT", "END:VCALENDAR"]
+    return "\r\n".join(lines) + "\r\n"
+
+
+class TestParseIcs(unittest.TestCase):
+    def test_tzid_converted_to_utc_with_zone_kept(self):
+        result = parse_ics(calendar(
+            "UID:abc@example.com",
+            "SUMMARY:Quarterly review",
+            "DTSTART;TZID=America/New_York:20300115T100000",
+            "DTEND;TZID=America/New_York:20300115T113000",
+        ))
+        event = result["events"][0]
+        self.assertEqual(result["method"], "REQUEST")
+        self.assertEqual(event["startDateTime"], "2030-01-15T15:00:00Z")
+        self.assertEqual(event["endDateTime"], "2030-01-15T16:30:00Z")
+        self.assertEqual(event["timeZone"], "America/New_York")
+        self.assertEqual(event["uid"], "abc@example.com")
+
+    def test_windows_tzid(self):
+        event = parse_ics(calendar(
+            'DTSTART;TZID="Pacific Standard Time":20300701T090000',
+            "DURATION:PT45M",
+        ))["events"][0]
+        self.assertEqual(event["startDateTime"], "2030-07-01T16:00:00Z")
+        self.assertEqual(event["endDateTime"], "2030-07-01T16:45:00Z")
+        self.assertEqual(event["timeZone"], "America/Los_Angeles")
+
+    def test_recurrence_and_people(self):
+        event = parse_ics(calendar(
+            "DTSTART:20300106T170000Z",
+            "DTEND:20300106T173000Z",
+            "RRULE:FREQ=WEEKLY;BYDAY=MO;COUNT=10",
+            "EXDATE:20300113T170000Z",
+            "ORGANIZER;CN=Dana:mailto:dana@acme.com",
+            'ATTENDEE;CN="Lee, Sam";ROLE=REQ-PARTICIPANT:mailto:sam@acme.com',
+            "ATTENDEE:MAILTO:dana@acme.com",
+        ))["events"][0]
+        self.assertEqual(event["recurrence"], ["RRULE:FREQ=WEEKLY;BYDAY=MO;COUNT=10", "EXDATE:20300113T170000Z"])
+        self.assertEqual(event["organizer"], "dana@acme.com")
+        self.assertEqual(event["attendees"], ["sam@acme.com"])
+
+    def test_folded_lines_and_escapes(self):
+        event = parse_ics(calendar(
+            "DTSTART:20300106T170000Z",
+            "SUMMARY:Planning\\, part one",
+            "DESCRIPTION:Line one\\nLine",
+            "  two",
+            "LOCATION:Room 4\\; 2nd floor",
+        ))["events"][0]
+        self.assertEqual(event["title"], "Planning, part one")
+        self.assertEqual(event["description"], "Line one\nLine two")
+        self.assertEqual(event["location"], "Room 4; 2nd floor")
+
+    def test_all_day_event(self):
+        event = parse_ics(calendar("DTSTART;VALUE=DATE:20300310", "SUMMARY:Offsite"))["events"][0]
+        self.assertTrue(event["allDay"])
+        self.assertEqual(event["startDate"], "2030-03-10")
+        self.assertEqual(event["endDate"], "2030-03-11")
+        self.assertNotIn("startDateTime", event)
+
+    def test_override_of_one_occurrence(self):
+        series, override = parse_ics(calendar("UID:abc@example.com", "DTSTART:20300106T170000Z",
+                                              "RRULE:FREQ=WEEKLY", "END:VEVENT", "BEGIN:VEVENT",
+                                              "UID:abc@example.com", "SEQUENCE:3",
+                                              "RECURRENCE-ID;TZID=Europe/Berlin:20300113T180000",
+                                              "DTSTART:20300114T170000Z"))["events"]
+
+        self.assertIsNone(series["recurrenceId"])
+        self.assertEqual(override["recurrenceId"], "2030-01-13T17:00:00Z")
+        self.assertEqual(override["sequence"], 3)
+        self.assertEqual(override["recurrence"], [])
+
+    def test_cancel(self):
+        result = parse_ics(calendar("UID:abc@example.com", "DTSTART:20300106T170000Z", method="CANCEL"))
+        self.assertEqual(result["method"], "CANCEL")
+        self.assertTrue(result["events"][0]["cancelled"])
+
+
+class FakeInviteCalendarClient:
+    def __init__(self, log):
+        self.log = log
+
+    def save_invite(self, event_data):
+        self.log.append(("save", event_data["uid"]))
+
+    def cancel_invite(self, event_data):
+        self.log.append(("cancel", event_data["uid"]))
+        return 1
+
+
+class TestInviteFastPath(AgentTestCase):
+    def make_invite(self, message_id, method="REQUEST"):
+        email = make_email(message_id)
+        email["calendar"] = calendar("UID:uid-" + message_id, "DTSTART:20300106T170000Z", method=method)
+        return email
+
+    def test_invites_bypass_extraction(self):
+        agent = self.make_agent([self.make_invite("m1"), self.make_invite("m2", method="CANCEL")])
+        agent.calendar_client = FakeInviteCalendarClient(self.log)
+
+        async def unexpected(*args, **kwargs):
+            raise AssertionError("extraction should not run for invites")
+
+        with patch("src.agent.extract_event_data_async", unexpected):
+            agent._process_emails()
+
+        self.assertIn(("save", "uid-m1"), self.log)
+        self.assertIn(("cancel", "uid-m2"), self.log)
+        self.assertIn(("read", "m1"), self.log)
+        self.assertEqual(agent.ledger.get("m1"), "invite_saved")
+        self.assertEqual(agent.ledger.get("m2"), "invite_cancelled")
+
+    def test_inline_invite_is_applied_once(self):
+        email = self.make_invite("m1")
+        # The inline part repeats the VEVENT, and Gmail also lists invite.ics.
+        email["calendar"] += email["calendar"]
+        email["calendar_attachments"] = [{"attachment_id": "att-1", "filename": "invite.ics"}]
+        agent = self.make_agent([email])
+        agent.calendar_client = FakeInviteCalendarClient(self.log)
+        agent.gmail_client.get_attachment = lambda *args: self.fail("attachment downloaded despite inline invite")
+
+        agent._process_emails()
+
+        self.assertEqual([entry for entry in self.log if entry[0] == "save"], [("save", "uid-m1")])
+        self.assertEqual(agent.ledger.get("m1"), "invite_saved")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from src.ledger import ProcessedLedger
+
+
+class TestProcessedLedger(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "ledger.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_outcomes_survive_reopen(self):
+        ledger = ProcessedLedger(self.path)
+        ledger.record("m1", "no_event")
+        ledger.close()
+
+        reopened = ProcessedLedger(self.path)
+        self.assertEqual(reopened.get("m1"), "no_event")
+        self.assertIn("m1", reopened)
+        self.assertNotIn("m2", reopened)
+        reopened.close()
+
+    def test_filter_unprocessed_preserves_order(self):
+        ledger = ProcessedLedger(self.path)
+        ledger.record("m2", "event_created")
+
+        self.assertEqual(ledger.filter_unprocessed(["m3", "m2", "m1"]), ["m3", "m1"])
+        ledger.close()
+
+    def test_prune_drops_expired_entries(self):
+        ledger = ProcessedLedger(self.path, retention_days=1)
+        with patch("src.ledger.time.time", return_value=1_000_000.0):
+            ledger.record("old", "no_event")
+        with patch("src.ledger.time.time", return_value=1_000_000.0 + 2 * 86400):
+            ledger.record("new", "no_event")
+            self.assertEqual(ledger.prune(), 1)
+
+        self.assertNotIn("old", ledger)
+        self.assertIn("new", ledger)
+        ledger.close()
+
+    def test_prune_caps_entry_count(self):
+        ledger = ProcessedLedger(self.path, max_entries=3)
+        for i in range(5):
+            with patch("src.ledger.time.time", return_value=1_000_000.0 + i):
+                ledger.record(f"m{i}", "no_event")
+        with patch("src.ledger.time.time", return_value=1_000_010.0):
+            ledger.prune()
+
+        self.assertEqual(len(ledger), 3)
+        self.assertEqual(ledger.filter_unprocessed(["m0", "m1", "m4"]), ["m0", "m1"])
+        ledger.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from src import extraction
+from src.agent import Agent
+from src.backfill import Backfill
+from src.email_store import EmailStore
+from src.ledger import ProcessedLedger
+from src.manager import AgentManager
+from src.ratelimit import RateLimiter
+from src.work_queue import WorkQueue
+from tests.test_agent import AgentTestCase, FakeCalendarClient, FakeGmailClient, MEETING_RESULT, make_email
+
+
+class FakeManager(AgentManager):
+    """Builds agents on fake clients instead of tokens and shared Google services."""
+
+    def __init__(self, tmp, **kwargs):
+        super().__init__(accounts_file=os.path.join(tmp, "accounts.json"), data_dir=os.path.join(tmp, "accounts"),
+                         **kwargs)
+        self.polls = []
+
+    def _build_agent(self, account_id):
+        directory = os.path.join(self.data_dir, account_id)
+        os.makedirs(directory, exist_ok=True)
+        agent = Agent(poll_interval=self.poll_interval)
+        agent.io_pool = self.io_pool
+        agent.gmail_client = FakeGmailClient([], [])
+        agent.gmail_client.limiter = RateLimiter(f"gmail:{account_id}", {})
+        list_ids = agent.gmail_client.list_new_message_ids
+
+        def counting_list(**kwargs):
+            self.polls.append((account_id, time.monotonic()))
+            time.sleep(0.02)
+            return list_ids(**kwargs)
+
+        agent.gmail_client.list_new_message_ids = counting_list
+        agent.calendar_client = FakeCalendarClient([])
+        agent.ledger = ProcessedLedger(os.path.join(directory, "ledger.db"))
+        agent.work_queue = WorkQueue(os.path.join(directory, "queue.db"))
+        agent.email_store = EmailStore(os.path.join(directory, "emails.db"))
+        agent.backfill = Backfill(agent.gmail_client, agent.work_queue, agent.ledger,
+                                  state_file=os.path.join(directory, "backfill.json"))
+        agent.extraction_cache = object()
+        return agent
+
+
+class TestAgentManager(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def wait_for(self, condition, timeout=3.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_accounts_are_polled_fairly_within_concurrency_cap(self):
+        manager = FakeManager(self.tmp.name, max_concurrent_polls=3)
+        accounts = [f"user{i}" for i in range(12)]
+        for account_id in accounts:
+            manager.add_account(account_id, "token.json", f"{account_id}@example.com")
+            manager.start_account(account_id)
+
+        self.assertTrue(self.wait_for(lambda: len({a for a, _ in manager.polls}) == 12))
+        manager.request_sync("user0")
+        self.assertTrue(self.wait_for(lambda: [a for a, _ in manager.polls].count("user0") == 2))
+        manager.shutdown()
+
+        # Every account got its first poll before any account got a second.
+        first_round = [account_id for account_id, _ in manager.polls[:12]]
+        self.assertEqual(sorted(first_round), sorted(accounts))
+        # With 3 slots and 20ms per poll, 12 polls take at least 4 rounds.
+        times = [at for _, at in manager.polls[:12]]
+        self.assertGreater(times[-1] - times[0], 0.05)
+
+    def test_stop_account_ends_its_polls_only(self):
+        manager = FakeManager(self.tmp.name)
+        for account_id in ("a", "b"):
+            manager.add_account(account_id, "token.json", "primary")
+            manager.start_account(account_id)
+        self.assertTrue(self.wait_for(lambda: len(manager.polls) == 2))
+
+        self.assertTrue(manager.stop_account("a"))
+        self.assertFalse(manager.stop_account("a"))
+        manager.request_sync("a")
+        manager.request_sync("b")
+        self.assertTrue(self.wait_for(lambda: len(manager.polls) == 3))
+        time.sleep(0.05)
+
+        self.assertEqual(manager.polls[-1][0], "b")
+        self.assertEqual(len(manager.polls), 3)
+        self.assertEqual(manager.status("a"), {"status": "Stopped", "running": False})
+        self.assertTrue(manager.status("b")["running"])
+        manager.shutdown()
+
+    def test_account_ids_cannot_escape_data_dir(self):
+        manager = FakeManager(self.tmp.name)
+        for account_id in ("..", "a/b", ""):
+            with self.assertRaises(ValueError):
+                manager.add_account(account_id, "token.json", "primary")
+
+    def build_agents(self, *account_ids):
+        """Runs the real _build_agent with fake credentials and services."""
+        manager = AgentManager(accounts_file=os.path.join(self.tmp.name, "accounts.json"),
+                               data_dir=os.path.join(self.tmp.name, "accounts"))
+        for account_id in account_ids:
+            manager.add_account(account_id, "token.json", "primary")
+        manager._ensure_started()
+        with patch("src.manager.load_credentials", return_value=SimpleNamespace(refresh_token=None)), \
+             patch.object(AgentManager, "_shared_services", return_value=(object(), object())):
+            agents = [manager._build_agent(account_id) for account_id in account_ids]
+
+        def close():
+            for agent in agents:
+                manager._close(agent)
+            manager.shutdown()
+
+        self.addCleanup(close)
+        return manager, agents
+
+    def test_token_files_stay_in_tokens_dir(self):
+        manager = FakeManager(self.tmp.name)
+        for token_file in ("../token.json", "/etc/cron.d/x.json", "a/b.json", "token", ".json"):
+            with self.assertRaises(ValueError):
+                manager.add_account("a", token_file, "primary")
+        with self.assertRaises(ValueError):
+            manager.add_account("a", "token.json", "primary/../x")
+
+        manager.add_account("a", "a.json", "abc123@group.calendar.google.com")
+
+        self.assertEqual(manager.accounts["a"]["token_file"], os.path.join(manager.tokens_dir, "a.json"))
+
+    def test_built_agent_keeps_its_own_ledger(self):
+        manager, (agent,) = self.build_agents("a")
+
+        self.assertEqual(agent.ledger.path, os.path.join(manager.data_dir, "a", "processed_ledger.db"))
+        self.assertIs(agent.backfill.ledger, agent.ledger)
+        self.assertIs(agent.extraction_cache, manager.extraction_cache)
+
+    def test_accounts_have_their_own_gmail_quota(self):
+        _, (a, b) = self.build_agents("a", "b")
+
+        self.assertIsNot(a.gmail_client.limiter, b.gmail_client.limiter)
+        # A Retry-After on one mailbox does not hold back the other.
+        a.gmail_client.limiter.buckets["units"].pause(60)
+        self.assertEqual(b.gmail_client.limiter.buckets["units"].reserve(5), 0.0)
+
+    def test_failed_build_closes_what_it_opened(self):
+        opened = []
+
+        class RecordingLedger(ProcessedLedger):
+            def __init__(self, path):
+                super().__init__(path)
+                opened.append(self)
+
+        manager = AgentManager(accounts_file=os.path.join(self.tmp.name, "accounts.json"),
+                               data_dir=os.path.join(self.tmp.name, "accounts"))
+        manager.add_account("a", "token.json", "primary")
+        self.addCleanup(manager.shutdown)
+
+        def load_credentials(token_file):
+            # Built outside the manager lock, so other accounts are not held up.
+            self.assertFalse(manager._lock.locked())
+            return SimpleNamespace(refresh_token=None)
+
+        with patch("src.manager.load_credentials", load_credentials), \
+             patch.object(AgentManager, "_shared_services", return_value=(object(), object())), \
+             patch("src.manager.ProcessedLedger", RecordingLedger), \
+             patch("src.manager.EmailStore", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                manager.start_account("a")
+
+        self.assertEqual(manager.agents, {})
+        with self.assertRaises(sqlite3.ProgrammingError):
+            opened[0].get("m1")
+
+    def test_idle_account_memory_stays_small(self):
+        manager = FakeManager(self.tmp.name)
+        manager.add_account("warmup", "token.json", "primary")
+        manager.start_account("warmup")
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(50):
+            manager.add_account(f"idle{i}", "token.json", "primary")
+            manager.start_account(f"idle{i}")
+        per_account = (tracemalloc.get_traced_memory()[0] - before) / 50
+        tracemalloc.stop()
+        manager.shutdown()
+
+        self.assertLess(per_account, 100_000)
+
+
+class LoopBoundClient:
+    """AsyncOpenAI stand-in that, like the real one, only works on the loop it was first used on."""
+
+    def __init__(self):
+        self.loop = None
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **request):
+        loop = asyncio.get_running_loop()
+        if self.loop is None:
+            self.loop = loop
+        assert loop is self.loop, "client reused across event loops"
+        message_id = request["messages"][1]["content"].split("Meeting ", 1)[1].split("\n", 1)[0]
+        result = {**MEETING_RESULT, "EventData": {**MEETING_RESULT["EventData"], "message_id": message_id}}
+        call = SimpleNamespace(function=SimpleNamespace(arguments=json.dumps(result)))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(tool_calls=[call]))], usage=None)
+
+
+class TestSingleAndMultiAccountModes(AgentTestCase):
+    def test_both_modes_extract_in_one_process(self):
+        clients = []
+
+        def factory():
+            clients.append(LoopBoundClient())
+            return clients[-1]
+
+        single = self.make_agent([make_email("m1")])
+        single.extraction_cache = None
+        manager = FakeManager(self.tmp.name)
+        manager.add_account("b", "token.json", "primary")
+        manager._ensure_started()
+        account = manager._build_agent("b")
+        account.extraction_cache = None
+        account.running = True
+
+        def deliver(agent, message_id):
+            agent.gmail_client.emails = [make_email(message_id)]
+            agent.gmail_client.by_id[message_id] = agent.gmail_client.emails[0]
+
+        def run_account_cycle(message_id):
+            deliver(account, message_id)
+            asyncio.run_coroutine_threadsafe(account.run_cycle(), manager._loop).result(timeout=5)
+
+        try:
+            with patch.object(extraction.async_client, "_factory", factory), \
+                 patch.object(extraction.async_client, "_clients", {}):
+                single._process_emails()
+                run_account_cycle("m2")
+                deliver(single, "m3")
+                single._process_emails()
+                run_account_cycle("m4")
+
+            self.assertEqual(len(clients), 2)
+            for message_id in ("m1", "m3"):
+                self.assertEqual(single.ledger.get(message_id), "event_created")
+            for message_id in ("m2", "m4"):
+                self.assertEqual(account.ledger.get(message_id), "event_created")
+        finally:
+            manager._close(account)
+            manager.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from src import extraction, server
+from src.metrics import (Counter, Histogram, Registry, EVENTS_CREATED, INTENTS, OPENAI_TOKENS, OPERATION_SECONDS,
+                         POLL_CYCLE_SECONDS)
+from src.work_queue import EXTRACT
+from tests.test_agent import AgentTestCase, MEETING_RESULT, make_email
+
+
+class TestMetrics(unittest.TestCase):
+    def test_text_format(self):
+        registry = Registry()
+        latency = registry.register(Histogram("op_seconds", "Op latency.", ["op"], buckets=(0.1, 1.0)))
+        errors = registry.register(Counter("errors_total", "Errors.", ["error"]))
+        latency.observe(0.05, op="get")
+        latency.observe(0.5, op="get")
+        latency.observe(5, op="get")
+        errors.inc(error='Bad "quote"')
+
+        lines = registry.render().splitlines()
+
+        self.assertIn("# TYPE op_seconds histogram", lines)
+        self.assertIn('op_seconds_bucket{op="get",le="0.1"} 1', lines)
+        self.assertIn('op_seconds_bucket{op="get",le="1"} 2', lines)
+        self.assertIn('op_seconds_bucket{op="get",le="+Inf"} 3', lines)
+        self.assertIn('op_seconds_sum{op="get"} 5.55', lines)
+        self.assertIn('op_seconds_count{op="get"} 3', lines)
+        self.assertIn('errors_total{error="Bad \\"quote\\""} 1', lines)
+
+    def test_labels_must_match(self):
+        with self.assertRaises(ValueError):
+            Counter("c_total", "C.", ["a"]).inc(b="x")
+
+    def test_openai_usage_is_counted_without_a_usage_dict(self):
+        prompt, completion = OPENAI_TOKENS.value(kind="prompt"), OPENAI_TOKENS.value(kind="completion")
+        response = SimpleNamespace(usage=SimpleNamespace(prompt_tokens=120, completion_tokens=30))
+
+        extraction._record_usage(None, response)
+
+        self.assertEqual(OPENAI_TOKENS.value(kind="prompt") - prompt, 120)
+        self.assertEqual(OPENAI_TOKENS.value(kind="completion") - completion, 30)
+
+
+class TestAgentMetrics(AgentTestCase):
+    def test_cycle_records_latencies_intents_and_events(self):
+        async def extract(text, cache=None):
+            return {**MEETING_RESULT, "EventData": {**MEETING_RESULT["EventData"], "message_id": "m1"}}
+
+        before = {operation: OPERATION_SECONDS.count(operation=operation)
+                  for operation in ("gmail_list", "gmail_get", "extraction", "calendar_insert", "label_modify")}
+        cycles, meetings, created = POLL_CYCLE_SECONDS.count(), INTENTS.value(intent="Meeting"), EVENTS_CREATED.value()
+        agent = self.make_agent([make_email("m1")])
+
+        with patch("src.agent.extract_event_data_async", extract):
+            agent._process_emails()
+
+        for operation, count in before.items():
+            self.assertEqual(OPERATION_SECONDS.count(operation=operation), count + 1, operation)
+        self.assertEqual(POLL_CYCLE_SECONDS.count(), cycles + 1)
+        self.assertEqual(INTENTS.value(intent="Meeting"), meetings + 1)
+        self.assertEqual(EVENTS_CREATED.value(), created + 1)
+
+    def test_created_today_starts_over_each_day(self):
+        agent = self.make_agent([])
+        agent.stats["created_today"] = 7
+        agent._stats_date = date.today() - timedelta(days=1)
+
+        agent._count_created()
+
+        self.assertEqual(agent.stats["created_today"], 1)
+
+    def test_metrics_endpoint_reports_queue_depth(self):
+        agent = self.make_agent([])
+        agent.work_queue.enqueue(EXTRACT, "m1", {"email": make_email("m1")})
+
+        with patch.object(server, "agent", agent):
+            body = server.metrics().body.decode()
+
+        self.assertIn('agent_queue_jobs{stage="extract",state="ready"} 1', body)
+        self.assertIn('agent_queue_jobs{stage="insert",state="ready"} 0', body)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import base64
+import unittest
+
+from src.mime import extract_bodies
+
+
+def encode(data):
+    if isinstance(data, str):
+        data = data.encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def leaf(mime_type, data, filename="", headers=()):
+    raw = data.encode() if isinstance(data, str) else data
+    return {
+        "mimeType": mime_type,
+        "filename": filename,
+        "headers": list(headers),
+        "body": {"data": encode(raw), "size": len(raw)},
+    }
+
+
+INVITE = "BEGIN:VCALENDAR\r\nMETHOD:REQUEST\r\nEND:VCALENDAR\r\n"
+
+
+class TestExtractBodies(unittest.TestCase):
+    def test_nested_tree_prefers_plain_and_skips_attachments(self):
+        payload = {
+            "mimeType": "multipart/mixed",
+            "parts": [
+                {
+                    "mimeType": "multipart/alternative",
+                    "parts": [
+                        leaf("text/plain", "Plain body"),
+                        leaf("text/html", "<p>HTML body</p>"),
+                        leaf("text/calendar", INVITE),
+                    ],
+                },
+                {"mimeType": "application/pdf", "filename": "agenda.pdf", "body": {"attachmentId": "att-1", "size": 10_000_000}},
+                {"mimeType": "application/ics", "filename": "invite.ics", "body": {"attachmentId": "att-2", "size": 900}},
+            ],
+        }
+
+        result = extract_bodies(payload)
+
+        self.assertEqual(result["text"], "Plain body")
+        self.assertEqual(result["html"], "")
+        self.assertEqual(result["calendar"], INVITE)
+        self.assertEqual(result["calendar_attachments"], [{"attachment_id": "att-2", "filename": "invite.ics"}])
+        self.assertEqual(result["skipped_attachments"], 1)
+        self.assertFalse(result["truncated"])
+
+    def test_falls_back_to_html(self):
+        payload = {"mimeType": "multipart/alternative", "parts": [leaf("text/html", "<p>Only HTML</p>")]}
+
+        self.assertEqual(extract_bodies(payload)["html"], "<p>Only HTML</p>")
+
+    def test_declared_charset_is_honoured(self):
+        part = leaf("text/plain", "Café à 14h".encode("iso-8859-1"),
+                    headers=[{"name": "Content-Type", "value": 'text/plain; charset="ISO-8859-1"'}])
+
+        self.assertEqual(extract_bodies(part)["text"], "Café à 14h")
+
+    def test_byte_cap_limits_decoding(self):
+        payload = {"mimeType": "multipart/mixed", "parts": [leaf("text/plain", "a" * 5000), leaf("text/plain", "b" * 5000)]}
+
+        result = extract_bodies(payload, max_bytes=1000)
+
+        self.assertEqual(result["text"], "a" * 1000)
+        self.assertTrue(result["truncated"])
+
+    def test_inline_text_attachment_is_not_decoded_as_body(self):
+        payload = {"mimeType": "multipart/mixed", "parts": [leaf("text/plain", "Body"), leaf("text/plain", "log " * 100, filename="log.txt")]}
+
+        result = extract_bodies(payload)
+
+        self.assertEqual(result["text"], "Body")
+        self.assertEqual(result["skipped_attachments"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
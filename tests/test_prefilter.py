@@ -0,0 +1,58 @@
+import json
+import os
+import unittest
+
+from src.prefilter import PreFilter
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "prefilter_labeled.json")
+
+
+class TestPreFilter(unittest.TestCase):
+    def setUp(self):
+        with open(FIXTURES) as f:
+            self.fixtures = json.load(f)
+
+    def test_no_false_negatives_on_labeled_fixtures(self):
+        report = PreFilter().evaluate(self.fixtures)
+
+        self.assertEqual(report["false_negative_rate"], 0.0, report["missed"])
+        # Most non-event traffic should never reach the LLM.
+        self.assertGreaterEqual(report["skip_rate"], 0.75)
+
+    def test_skip_records_reasons(self):
+        verdict = PreFilter().check({
+            "subject": "Your order has shipped",
+            "sender": "Shop <no-reply@shop.com>",
+            "body": "Track your package with the link below.",
+        })
+
+        self.assertTrue(verdict["skip"])
+        self.assertIn("bulk sender", verdict["reasons"])
+        self.assertIn("no date or time expression", verdict["reasons"])
+
+    def test_triage_never_rejects_labeled_events(self):
+        prefilter = PreFilter()
+        for email in self.fixtures:
+            if email["is_event"]:
+                self.assertTrue(prefilter.triage(email), email["subject"])
+
+    def test_triage_rejects_mailing_list_without_signal(self):
+        metadata = {
+            "subject": "Product updates",
+            "sender": "Acme <team@acme.com>",
+            "list_unsubscribe": "<mailto:unsubscribe@acme.com>",
+        }
+
+        self.assertFalse(PreFilter().triage(metadata))
+        self.assertTrue(PreFilter().triage({**metadata, "subject": "Webinar on June 3"}))
+        self.assertTrue(PreFilter().triage({**metadata, "content_type": "text/calendar; method=REQUEST"}))
+
+    def test_threshold_is_tunable(self):
+        email = {"subject": "Lunch", "sender": "sam@gmail.com", "body": "Lunch sometime?"}
+
+        self.assertTrue(PreFilter().check(email)["skip"])
+        self.assertFalse(PreFilter(threshold=1.0).check(email)["skip"])
+
+
+if __name__ == "__main__":
+    unittest.main()
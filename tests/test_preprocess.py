@@ -0,0 +1,75 @@
+import unittest
+
+from src.preprocess import estimate_tokens, html_to_text, preprocess_email_body, strip_signature, truncate_to_budget
+
+REPLY_CHAIN = """Moving the review to Friday at 11am, same room.
+
+Thanks,
+Dana
+-- 
+Dana Lee | Engineering Manager | Acme Corp
+CONFIDENTIALITY NOTICE: This email is intended only for the recipient.
+
+On Tue, Mar 4, 2025 at 3:00 PM Sam <sam@acme.com> wrote:
+> Can we do the review Thursday at 10am instead?
+> Sam
+"""
+
+
+class TestPreprocess(unittest.TestCase):
+    def test_strips_quoted_history_signature_and_footer(self):
+        result = preprocess_email_body(REPLY_CHAIN)
+
+        self.assertIn("Friday at 11am", result["text"])
+        self.assertNotIn("Thursday", result["text"])
+        self.assertNotIn("Engineering Manager", result["text"])
+        self.assertNotIn("CONFIDENTIALITY", result["text"])
+        self.assertGreater(result["bytes_saved"], 0)
+        self.assertGreater(result["tokens_saved"], 0)
+        self.assertEqual(result["original_bytes"] - result["bytes"], result["bytes_saved"])
+
+    def test_footer_wording_at_the_top_is_kept(self):
+        body = "This email is to confirm your interview on Friday, March 7 at 2:00 PM.\nPlease bring ID.\n\nBest,\nHR"
+        confidential = "Confidential: board meeting moved to Monday at 4pm.\nAgenda to follow."
+
+        self.assertEqual(preprocess_email_body(body)["text"], body)
+        self.assertEqual(strip_signature(confidential), confidential)
+
+    def test_forwarded_message_is_kept(self):
+        body = "FYI\n\n---------- Forwarded message ---------\nFrom: events@pycon.org\nPyCon starts May 14 at 9am."
+
+        self.assertIn("May 14 at 9am", preprocess_email_body(body)["text"])
+
+    def test_html_only_body_is_converted(self):
+        html = ("<html><head><style>p {color: red}</style></head><body>"
+                "<p>Dinner on <b>Saturday</b> at 7pm</p><script>track()</script><p>Tom &amp; Ann</p></body></html>")
+
+        result = preprocess_email_body("", html=html)
+
+        self.assertEqual(result["text"], "Dinner on Saturday at 7pm\n\nTom & Ann")
+        self.assertEqual(html_to_text("<div>a<br>b</div>"), "a\nb")
+
+    def test_truncation_keeps_date_and_time_lines(self):
+        filler = [f"Paragraph {i} about nothing in particular, padded out to some length." for i in range(200)]
+        filler.insert(150, "The offsite is on June 3 at 9:30 am.")
+        text = "\n".join(filler)
+
+        truncated = truncate_to_budget(text, token_budget=200)
+
+        self.assertIn("The offsite is on June 3 at 9:30 am.", truncated)
+        self.assertIn("Paragraph 0 ", truncated)
+        self.assertIn("[...]", truncated)
+        self.assertLess(len(truncated), len(text) // 5)
+
+    def test_oversized_line_is_cut_around_its_date(self):
+        line = "lorem ipsum " * 400 + "The offsite is on June 3 at 9:30 am." + " dolor sit" * 400
+
+        truncated = truncate_to_budget(line, token_budget=200)
+
+        self.assertIn("June 3 at 9:30 am", truncated)
+        self.assertTrue(truncated.startswith("[...] ") and truncated.endswith(" [...]"))
+        self.assertLessEqual(estimate_tokens(truncated), 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from types import SimpleNamespace
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from src.ratelimit import RateLimiter, TokenBucket, is_retryable, retry_after
+from tests.test_extraction import MOCK_MEETING_RESPONSE, to_response
+
+
+def http_error(status, headers=None, content=b"{}"):
+    return HttpError(httplib2.Response({"status": str(status), **(headers or {})}), content)
+
+
+class FakeStatusError(Exception):
+    """Shaped like openai.APIStatusError: a status_code and the HTTP response's headers."""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def openai_rate_limit(retry_after_seconds="0"):
+    return FakeStatusError(429, {"retry-after": retry_after_seconds})
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_waits_grow_once_capacity_is_spent(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        waits = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 0.1, places=2)
+        self.assertAlmostEqual(waits[3], 0.2, places=2)
+
+    def test_limiter_holds_throughput_to_rate(self):
+        limiter = RateLimiter("test", {"requests": TokenBucket(rate=100, capacity=1)})
+        started = time.perf_counter()
+        for _ in range(21):
+            limiter.call(lambda: None)
+        self.assertGreaterEqual(time.perf_counter() - started, 0.18)
+
+
+class TestRetry(unittest.TestCase):
+    def test_classifies_errors(self):
+        self.assertTrue(is_retryable(http_error(429)))
+        self.assertTrue(is_retryable(http_error(503)))
+        self.assertTrue(is_retryable(http_error(403, content=b'{"error": {"errors": [{"reason": "userRateLimitExceeded"}]}}')))
+        self.assertFalse(is_retryable(http_error(403)))
+        self.assertFalse(is_retryable(http_error(404)))
+        self.assertTrue(is_retryable(openai_rate_limit()))
+        self.assertEqual(retry_after(http_error(429, {"retry-after": "7"})), 7.0)
+        self.assertEqual(retry_after(openai_rate_limit("3")), 3.0)
+
+    def test_retries_transient_errors_then_succeeds(self):
+        limiter = RateLimiter("test", {}, base_delay=0.01)
+        outcomes = [http_error(503), http_error(429, {"retry-after": "0.05"}), "ok"]
+
+        def flaky():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        started = time.perf_counter()
+        self.assertEqual(limiter.call(flaky), "ok")
+        self.assertGreaterEqual(time.perf_counter() - started, 0.05)
+        self.assertEqual(limiter.stats["retries"], 2)
+        self.assertEqual(limiter.stats["throttled"], 1)
+
+    def test_non_retryable_and_exhausted_errors_are_raised(self):
+        limiter = RateLimiter("test", {}, max_retries=2, base_delay=0.001)
+        calls = []
+
+        def failing(error):
+            calls.append(error)
+            raise error
+
+        with self.assertRaises(HttpError):
+            limiter.call(failing, http_error(404))
+        self.assertEqual(len(calls), 1)
+        with self.assertRaises(HttpError):
+            limiter.call(failing, http_error(500))
+        self.assertEqual(len(calls), 1 + 3)
+        self.assertEqual(limiter.stats["failures"], 2)
+
+    @patch("src.extraction.client")
+    def test_extraction_retries_openai_throttling(self, mock_client):
+        from src.extraction import extract_event_data
+
+        mock_client.chat.completions.create.side_effect = [openai_rate_limit(), to_response(MOCK_MEETING_RESPONSE)]
+
+        with patch("src.extraction.OPENAI_LIMITER", RateLimiter("openai", {}, base_delay=0.001)):
+            result = extract_event_data("Meeting tomorrow at 2pm")
+
+        self.assertEqual(result["Intent"], "Meeting")
+        self.assertEqual(mock_client.chat.completions.create.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
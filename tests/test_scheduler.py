@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+import unittest
+
+from src.calendar_index import CalendarIndex
+from src.extraction_cache import ExtractionCache
+from src.scheduler import PollScheduler
+from tests.test_agent import AgentTestCase
+from tests.test_calendar_index import FakeListingClient
+
+
+class TestPollScheduler(unittest.TestCase):
+    def test_interval_tightens_on_mail_and_backs_off_when_idle(self):
+        scheduler = PollScheduler(60, min_interval=5, max_interval=300)
+
+        self.assertEqual(scheduler.record_poll(3), 5)
+        self.assertEqual([scheduler.record_poll(0) for _ in range(8)], [10, 20, 40, 80, 160, 300, 300, 300])
+        self.assertEqual(scheduler.record_poll(1), 5)
+
+    def test_wake_ends_wait_immediately(self):
+        scheduler = PollScheduler(60)
+        threading.Timer(0.05, scheduler.wake).start()
+
+        started = time.perf_counter()
+        self.assertTrue(scheduler.wait())
+        self.assertLess(time.perf_counter() - started, 1)
+
+    def test_wake_before_wait_is_not_lost(self):
+        scheduler = PollScheduler(60)
+        scheduler.wake()
+        self.assertTrue(scheduler.wait())
+        self.assertFalse(scheduler.wait(timeout=0.01))
+
+
+class TestAgentLoop(AgentTestCase):
+    def make_running_agent(self):
+        agent = self.make_agent([], poll_interval=60)
+        agent.running = False
+        agent.extraction_cache = ExtractionCache(os.path.join(self.tmp.name, "cache.db"))
+        agent.calendar_index = CalendarIndex(FakeListingClient([]))
+        polls = []
+        fetch = agent.gmail_client.list_new_message_ids
+        agent.gmail_client.list_new_message_ids = lambda **kwargs: polls.append(time.perf_counter()) or fetch(**kwargs)
+        return agent, polls
+
+    def wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_sync_request_polls_immediately_and_stop_is_instant(self):
+        agent, polls = self.make_running_agent()
+        agent.start()
+        self.assertTrue(self.wait_for(lambda: len(polls) == 1))
+
+        agent.request_sync()
+        self.assertTrue(self.wait_for(lambda: len(polls) == 2))
+
+        started = time.perf_counter()
+        agent.stop()
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertFalse(agent.thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
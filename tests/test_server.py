@@ -0,0 +1,108 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from starlette.requests import Request
+
+from src import server
+from src.email_store import EmailStore
+from src.notify import ChangeNotifier
+
+
+def make_request(headers=None):
+    raw = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw})
+
+
+class ConnectedRequest:
+    """Stands in for the request of an /events stream that never disconnects."""
+
+    async def is_disconnected(self):
+        return False
+
+
+def parse_events(chunks):
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(":"):
+            events.append(("comment", None))
+            continue
+        fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+class TestChangeNotifier(unittest.TestCase):
+    def test_publish_from_another_thread_wakes_waiter(self):
+        notifier = ChangeNotifier()
+
+        async def wait():
+            threading.Timer(0.05, notifier.publish).start()
+            return await notifier.wait(0, timeout=2)
+
+        self.assertEqual(asyncio.run(wait()), 1)
+
+    def test_wait_returns_at_once_when_behind_and_times_out_when_idle(self):
+        notifier = ChangeNotifier()
+        notifier.publish()
+
+        async def waits():
+            return await notifier.wait(0), await notifier.wait(1, timeout=0.01)
+
+        self.assertEqual(asyncio.run(waits()), (1, 1))
+        self.assertEqual(notifier._waiters, [])
+
+
+class TestServer(unittest.TestCase):
+    def test_etag_matches_unchanged_body_only(self):
+        first = server.etag_response(make_request(), {"a": 1})
+        etag = first.headers["etag"]
+        self.assertEqual(first.status_code, 200)
+
+        self.assertEqual(server.etag_response(make_request({"If-None-Match": etag}), {"a": 1}).status_code, 304)
+        self.assertEqual(server.etag_response(make_request({"If-None-Match": etag}), {"a": 2}).status_code, 200)
+
+    def test_events_stream_sends_snapshot_then_deltas(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        agent = server.Agent(poll_interval=60)
+        agent.email_store = EmailStore(os.path.join(tmp.name, "emails.db"))
+        self.addCleanup(agent.email_store.close)
+        agent.email_store.add({"id": "m1", "subject": "Old", "processed_at": time.time() - 60})
+
+        async def read_stream():
+            stream = (await server.events(ConnectedRequest())).body_iterator
+            chunks = [await stream.__anext__(), await stream.__anext__()]
+
+            agent.stats["created_today"] += 1
+            agent.email_store.add({"id": "m2", "subject": "New", "processed_at": time.time()})
+            agent.changes.publish()
+            chunks += [await stream.__anext__(), await stream.__anext__()]
+
+            # Nothing changed: only a keep-alive comment.
+            with patch.object(server, "EVENTS_KEEPALIVE_SECONDS", 0.01):
+                agent.changes.publish()
+                chunks.append(await stream.__anext__())
+            await stream.aclose()
+            return chunks
+
+        with patch.object(server, "agent", agent):
+            events = parse_events(asyncio.run(read_stream()))
+
+        self.assertEqual(events[0][0], "status")
+        self.assertEqual(set(events[0][1]), {"status", "running", "stats", "poll_interval"})
+        self.assertEqual(events[1][0], "feed")
+        self.assertEqual([email["id"] for email in events[1][1]["emails"]], ["m1"])
+        self.assertEqual(events[2], ("status", {"stats": {**agent.stats}}))
+        self.assertEqual(events[3][0], "feed")
+        self.assertEqual([email["id"] for email in events[3][1]["emails"]], ["m2"])
+        self.assertEqual(events[4], ("comment", None))
+
+
+if __name__ == "__main__":
+    unittest.main()
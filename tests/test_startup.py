@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+
+import httplib2
+
+from src import discovery
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Importing the server and answering /status, in a fresh interpreter. Eager
+# openai and discovery imports alone used to take well over a second.
+STARTUP_BUDGET_SECONDS = 2.0
+
+# Modules that must only be imported once the agent starts.
+DEFERRED_MODULES = ["openai", "googleapiclient.discovery", "google_auth_oauthlib.flow",
+                    "google.auth.transport.requests"]
+
+STARTUP_SCRIPT = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+from src import server
+from starlette.requests import Request
+response = asyncio.run(server.status(Request({"type": "http", "method": "GET", "path": "/", "headers": []})))
+elapsed = time.perf_counter() - started
+print(json.dumps({"elapsed": elapsed, "status": json.loads(response.body)["status"],
+                  "loaded": [name for name in %r if name in sys.modules]}))
+""" % (DEFERRED_MODULES,)
+
+
+class TestStartup(unittest.TestCase):
+    def test_server_answers_status_quickly_without_heavy_imports(self):
+        env = {key: value for key, value in os.environ.items() if key != "OPENAI_API_KEY"}
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+
+        self.assertEqual(result["status"], "Stopped")
+        self.assertEqual(result["loaded"], [])
+        self.assertLess(result["elapsed"], STARTUP_BUDGET_SECONDS)
+
+    def test_discovery_document_is_parsed_once(self):
+        from googleapiclient import discovery_cache
+
+        with patch.dict(discovery._documents, clear=True), \
+             patch.object(discovery_cache, "get_static_doc", wraps=discovery_cache.get_static_doc) as get_doc:
+            first = discovery.build_service("gmail", "v1", http=httplib2.Http())
+            second = discovery.build_service("gmail", "v1", http=httplib2.Http())
+
+        self.assertEqual(get_doc.call_count, 1)
+        self.assertIsNot(first, second)
+        request = second.users().messages().list(userId="me", q="is:unread")
+        self.assertIn("/gmail/v1/users/me/messages", request.uri)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import gc
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from src.transport import TokenRefresher, shared_http
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class FakeCredentials:
+    """Shaped like google-auth credentials: token, naive UTC expiry and refresh(request)."""
+
+    def __init__(self, expires_in, fail=False, refresh_token="refresh"):
+        self.token = "old"
+        self.expiry = utcnow() + timedelta(seconds=expires_in)
+        self.refresh_token = refresh_token
+        self.fail = fail
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        if self.fail:
+            raise RuntimeError("token endpoint unreachable")
+        self.token = f"new{self.refreshes}"
+        self.expiry = utcnow() + timedelta(hours=1)
+
+
+class TestTokenRefresher(unittest.TestCase):
+    def wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_token_is_refreshed_before_it_expires(self):
+        refresher = TokenRefresher(margin=300)
+        creds = FakeCredentials(expires_in=300.1)
+        saved = []
+        refresher.register(creds, saved.append)
+
+        self.assertEqual(creds.refreshes, 0)
+        self.assertTrue(self.wait_for(lambda: creds.refreshes == 1))
+        self.assertTrue(self.wait_for(lambda: saved == [creds]))
+        self.assertGreater(creds.expiry, utcnow())
+        time.sleep(0.1)
+        self.assertEqual(creds.refreshes, 1)
+
+    def test_failed_refresh_waits_before_retrying(self):
+        refresher = TokenRefresher(margin=300, retry_delay=60)
+        creds = FakeCredentials(expires_in=0, fail=True)
+        refresher.register(creds)
+
+        self.assertTrue(self.wait_for(lambda: creds.refreshes == 1))
+        time.sleep(0.1)
+        self.assertEqual(creds.refreshes, 1)
+        self.assertGreater(refresher.refresh_due(), time.time() + 50)
+
+    def test_dropped_and_unrenewable_credentials_are_not_kept(self):
+        refresher = TokenRefresher()
+        refresher.register(FakeCredentials(expires_in=3600, refresh_token=None))
+        creds = FakeCredentials(expires_in=3600)
+        refresher.register(creds)
+        self.assertEqual(len(refresher._credentials), 1)
+
+        del creds
+        gc.collect()
+        self.assertEqual(len(refresher._credentials), 0)
+
+
+class TestSharedHttp(unittest.TestCase):
+    def test_one_connection_per_thread(self):
+        other = []
+        thread = threading.Thread(target=lambda: other.append(shared_http()))
+        thread.start()
+        thread.join()
+
+        self.assertIs(shared_http(), shared_http())
+        self.assertIsNot(other[0], shared_http())
+
+
+if __name__ == "__main__":
+    unittest.main()
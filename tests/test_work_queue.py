@@ -0,0 +1,84 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from src.work_queue import WorkQueue, FETCH, EXTRACT, INSERT, LEASED, DEAD
+
+
+class TestWorkQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "queue.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_job_moves_through_stages(self):
+        queue = WorkQueue(self.path)
+        self.assertTrue(queue.enqueue(FETCH, "m1"))
+        self.assertFalse(queue.enqueue(FETCH, "m1"))
+
+        [job] = queue.lease(FETCH)
+        self.assertEqual((job["id"], job["payload"]), ("m1", {}))
+        self.assertEqual(queue.lease(FETCH), [])
+
+        queue.advance("m1", EXTRACT, {"email": {"id": "m1"}})
+        self.assertEqual(queue.lease(EXTRACT)[0]["payload"], {"email": {"id": "m1"}})
+        queue.complete("m1")
+        self.assertEqual(queue.counts(), {})
+        queue.close()
+
+    def test_failures_back_off_then_dead_letter(self):
+        queue = WorkQueue(self.path, max_attempts=3, retry_delay=10)
+        queue.enqueue(EXTRACT, "m1")
+
+        now = time.time()
+        for attempt in range(3):
+            with patch("src.work_queue.time.time", return_value=now + 1000 * attempt):
+                [job] = queue.lease(EXTRACT)
+                self.assertEqual(job["attempts"], attempt)
+                dead = queue.fail("m1", "rate limited")
+                self.assertEqual(queue.lease(EXTRACT), [])
+        self.assertTrue(dead)
+
+        self.assertEqual(queue.counts(), {EXTRACT: {DEAD: 1}})
+        [letter] = queue.dead_letters()
+        self.assertEqual((letter["id"], letter["stage"], letter["error"]), ("m1", EXTRACT, "rate limited"))
+
+        self.assertTrue(queue.requeue("m1"))
+        self.assertEqual(queue.lease(EXTRACT)[0]["attempts"], 0)
+        queue.close()
+
+    def test_expired_lease_is_reclaimed_and_counted(self):
+        queue = WorkQueue(self.path, lease_seconds=0.01, max_attempts=2)
+        queue.enqueue(INSERT, "m1")
+        queue.lease(INSERT)
+
+        time.sleep(0.02)
+        self.assertTrue(queue.has_ready())
+        [job] = queue.lease(INSERT)
+        self.assertEqual(job["attempts"], 1)
+
+        time.sleep(0.02)
+        self.assertEqual(queue.lease(INSERT), [])
+        self.assertEqual(queue.counts(), {INSERT: {DEAD: 1}})
+        queue.close()
+
+    def test_leased_jobs_survive_a_crash(self):
+        queue = WorkQueue(self.path)
+        queue.enqueue_many(FETCH, ["m1", "m2"])
+        queue.lease(FETCH, limit=10)
+        # The process dies without settling its leases.
+        queue.close()
+
+        reopened = WorkQueue(self.path)
+        self.assertEqual(reopened.counts(), {FETCH: {LEASED: 2}})
+        self.assertEqual(reopened.recover(), 2)
+        self.assertEqual([job["id"] for job in reopened.lease(FETCH, limit=10)], ["m1", "m2"])
+        reopened.close()
+
+
+if __name__ == "__main__":
+    unittest.main()